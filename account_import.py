@@ -0,0 +1,88 @@
+import io
+import logging
+import re
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Separators accepted between the number and an optional OTP (phone:otp, CSV, TSV)
+FIELD_SEPARATOR = re.compile(r'[:;,\t]')
+# Formatting people paste into numbers: spaces, dashes, dots, brackets
+NUMBER_FORMATTING = re.compile(r'[\s\-.()]')
+# E.164: a '+' and up to 15 digits; anything under 8 is not a real number
+E164 = re.compile(r'\+[1-9]\d{7,14}')
+
+
+class ImportResult(NamedTuple):
+    """Outcome of import_accounts"""
+    added: int = 0
+    duplicates: int = 0
+    invalid: int = 0
+
+    def __add__(self, other: 'ImportResult') -> 'ImportResult':
+        return ImportResult(self.added + other.added, self.duplicates + other.duplicates,
+                            self.invalid + other.invalid)
+
+    def summary(self, account_type: str) -> str:
+        return (f"✅ Added {self.added} {account_type} accounts!\n"
+                f"♻️ Duplicates skipped: {self.duplicates}\n"
+                f"⚠️ Invalid lines: {self.invalid}")
+
+
+def normalise_phone(raw: str) -> Optional[str]:
+    """``raw`` in E.164 form (+<digits>), or None if it is not a phone number"""
+    number = NUMBER_FORMATTING.sub('', raw)
+    if number.startswith('00'):
+        number = '+' + number[2:]
+    return number if E164.fullmatch(number) else None
+
+
+def parse_line(line: str) -> Optional[Tuple[str, Optional[str]]]:
+    """(phone_number, otp) from one ``phone`` / ``phone:otp`` / ``phone,otp`` line"""
+    fields = FIELD_SEPARATOR.split(line.strip(), maxsplit=1)
+    phone = normalise_phone(fields[0].strip('"\''))
+    if not phone:
+        return None
+    otp = fields[1].strip().strip('"\'') if len(fields) > 1 else ''
+    return phone, otp or None
+
+
+def document_lines(data: bytes) -> Iterator[str]:
+    """Lines of an uploaded TXT/CSV file, decoded one at a time (BOM and CRLF tolerated)"""
+    yield from io.TextIOWrapper(io.BytesIO(data), encoding='utf-8-sig', errors='replace')
+
+
+def import_accounts(database, account_type: str, lines: Iterable[str], price: float,
+                    chunk_size: int = config.ACCOUNT_IMPORT_CHUNK_SIZE) -> ImportResult:
+    """Validate ``lines`` and insert them in chunks of ``chunk_size`` per transaction
+
+    Blank lines are ignored. A number repeated in the upload or already in
+    stock counts as a duplicate. Only one chunk is held in memory at a time.
+    """
+    result = ImportResult()
+    chunk: List[Tuple[str, Optional[str]]] = []
+    invalid = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        account = parse_line(line)
+        if account is None:
+            invalid += 1
+            continue
+        chunk.append(account)
+        if len(chunk) >= chunk_size:
+            result += _insert_chunk(database, account_type, chunk, price)
+            chunk = []
+    if chunk:
+        result += _insert_chunk(database, account_type, chunk, price)
+    result += ImportResult(invalid=invalid)
+    logger.info(f"Imported {account_type} accounts: {result}")
+    return result
+
+
+def _insert_chunk(database, account_type: str, chunk: List[Tuple[str, Optional[str]]],
+                  price: float) -> ImportResult:
+    added = database.add_accounts(account_type, chunk, price)
+    return ImportResult(added=added, duplicates=len(chunk) - added)
@@ -0,0 +1,217 @@
+"""asyncio runtime: the same bot on AsyncTeleBot instead of a thread per update
+
+Run with ``python async_bot.py`` instead of ``python bot.py``. The handlers
+themselves are shared with bot.py (see handlers.py); they block on sqlite3,
+so they run on a dedicated executor sized to the connection pool while the
+Telegram I/O of their replies is awaited on the event loop. Pending OTP
+deliveries are asyncio timers. Notifications to other users and broadcasts
+keep using the thread-backed Outbox and Broadcaster through SyncBridge.
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from telebot import asyncio_helper
+from telebot.apihelper import ApiTelegramException
+from telebot.async_telebot import AsyncTeleBot
+
+import config
+from database import db
+from broadcast import Broadcaster
+from scheduler import AsyncioTimerScheduler
+from otp_delivery import OtpDeliveryPool
+from otp_providers import get_provider
+from outbox import Outbox
+from ratelimit import TokenBucket
+from account_import import document_lines
+from idempotency import SeenKeys, filter_new_updates
+import handlers
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+class DedupAsyncTeleBot(AsyncTeleBot):
+    """AsyncTeleBot that processes each update once, however often it is delivered"""
+
+    def __init__(self, token: str, seen: SeenKeys, **kwargs):
+        super().__init__(token, **kwargs)
+        self.seen = seen
+
+    async def process_new_updates(self, updates):
+        updates = filter_new_updates(updates, self.seen)
+        if updates:
+            await super().process_new_updates(updates)
+
+
+# Initialize bot; updates redelivered by Telegram are processed once
+bot = DedupAsyncTeleBot(config.BOT_TOKEN, SeenKeys(persist=db.mark_update_processed if config.DEDUP_PERSIST else None))
+
+# sqlite3 blocks, so every handler and database call goes through this executor
+db_executor = ThreadPoolExecutor(max_workers=config.DB_POOL_SIZE, thread_name_prefix='db')
+
+# Created in main() once the event loop is running
+loop = None
+outbox = None
+
+
+async def run_db(fn, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(db_executor, partial(fn, *args, **kwargs))
+
+
+class SyncBridge:
+    """Blocking send_message/edit_message_text on top of the async client
+
+    Lets worker-thread components (Outbox, Broadcaster) send through the
+    event loop. Never call it from the loop thread itself.
+    """
+
+    def __init__(self, async_bot: AsyncTeleBot, event_loop: asyncio.AbstractEventLoop):
+        self.bot = async_bot
+        self.loop = event_loop
+
+    def _call(self, coro):
+        try:
+            return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+        except asyncio_helper.ApiTelegramException as e:
+            # Outbox and Broadcaster understand the sync client's exception
+            raise ApiTelegramException(e.function_name, e.result, e.result_json) from e
+
+    def send_message(self, *args, **kwargs):
+        return self._call(self.bot.send_message(*args, **kwargs))
+
+    def edit_message_text(self, *args, **kwargs):
+        return self._call(self.bot.edit_message_text(*args, **kwargs))
+
+
+# ========== SENDING REPLIES ==========
+def send_notices(notices):
+    for notice in notices:
+        outbox.send_message(notice.chat_id, notice.text, parse_mode=notice.parse_mode,
+                            reply_markup=notice.reply_markup)
+
+async def respond(call, reply):
+    """Carry out a handler's Reply to a button press"""
+    if reply.text is not None:
+        await bot.edit_message_text(reply.text, call.message.chat.id, call.message.message_id,
+                                    parse_mode=reply.parse_mode, reply_markup=reply.reply_markup)
+    if reply.alert is not None:
+        await bot.answer_callback_query(call.id, reply.alert or None, show_alert=reply.show_alert)
+    send_notices(reply.notices)
+
+async def reply_to(message, reply):
+    """Carry out a handler's Reply to a message"""
+    if reply.text is not None:
+        await bot.send_message(message.chat.id, reply.text, parse_mode=reply.parse_mode,
+                               reply_markup=reply.reply_markup)
+    send_notices(reply.notices)
+
+# ========== OTP DELIVERY SYSTEM ==========
+async def push_otp(delivery):
+    """Show the arrived OTP by editing the buyer's purchase message in place"""
+    if delivery.chat_id and delivery.message_id:
+        reply = handlers.otp_code_reply(delivery)
+        try:
+            await bot.edit_message_text(reply.text, delivery.chat_id, delivery.message_id,
+                                        parse_mode=reply.parse_mode, reply_markup=reply.reply_markup)
+            await run_db(handlers.otp_shown, delivery)
+            return
+        except Exception as e:
+            logger.warning(f"Could not edit purchase message for order {delivery.order_id}: {e}")
+
+    send_notices([handlers.otp_ready_notice(delivery)])
+
+async def report_failed_otp(order):
+    """Tell the buyer their order was refunded because no OTP arrived"""
+    reply = handlers.otp_failed_reply(order)
+    if order.chat_id and order.message_id:
+        try:
+            await bot.edit_message_text(reply.text, order.chat_id, order.message_id,
+                                        parse_mode=reply.parse_mode, reply_markup=reply.reply_markup)
+        except Exception as e:
+            logger.warning(f"Could not edit purchase message for order {order.order_id}: {e}")
+    send_notices(reply.notices)
+
+def on_otp_delivered(delivery):
+    # Called by OtpDeliveryPool on an executor thread
+    asyncio.run_coroutine_threadsafe(push_otp(delivery), loop)
+
+def on_otp_failed(order):
+    asyncio.run_coroutine_threadsafe(report_failed_otp(order), loop)
+
+# ========== COMMAND HANDLERS ==========
+def replying_with(handler):
+    async def on_message(message):
+        await reply_to(message, await run_db(handler, message))
+    return on_message
+
+for commands, handler in handlers.COMMANDS:
+    bot.register_message_handler(replying_with(handler), commands=commands)
+
+# ========== BUTTON HANDLER ==========
+@bot.callback_query_handler(func=lambda call: True)
+async def handle_callback(call):
+    try:
+        await respond(call, await run_db(handlers.handle_callback, call))
+    except Exception as e:
+        logger.error(f"Error in button handler: {e}")
+        await bot.answer_callback_query(call.id, "❌ Error occurred!")
+
+# ========== ACCOUNT IMPORT ==========
+@bot.message_handler(content_types=['document'])
+async def handle_document(message):
+    account_type = await run_db(handlers.import_target, message)
+    if not account_type:
+        return
+
+    document = message.document
+    if document.file_size and document.file_size > config.ACCOUNT_IMPORT_MAX_FILE_SIZE:
+        await reply_to(message, handlers.FILE_TOO_LARGE)
+        return
+
+    try:
+        data = await bot.download_file((await bot.get_file(document.file_id)).file_path)
+    except Exception as e:
+        logger.error(f"Failed to download account file from {message.from_user.id}: {e}")
+        await reply_to(message, handlers.DOWNLOAD_FAILED)
+        return
+
+    await reply_to(message, await run_db(handlers.finish_account_import, message, account_type,
+                                         document_lines(data)))
+
+# ========== MESSAGE HANDLER FOR TEXT INPUT ==========
+@bot.message_handler(func=lambda message: True)
+async def handle_all_messages(message):
+    # Broadcaster.start sends its progress message through SyncBridge, so this stays off the loop
+    await reply_to(message, await run_db(handlers.handle_text, message))
+
+# ========== START BOT ==========
+async def main():
+    global loop, outbox
+    loop = asyncio.get_running_loop()
+    bridge = SyncBridge(bot, loop)
+    # Telegram's global limit covers every sender in the process, so they share one bucket
+    api_bucket = TokenBucket(config.BOT_API_RATE)
+    outbox = Outbox(bridge, api_bucket)
+    broadcaster = Broadcaster(bridge, db, api_bucket)
+    otp_scheduler = AsyncioTimerScheduler(loop, db_executor, name='otp-delivery')
+    otp_delivery = OtpDeliveryPool(db, otp_scheduler, get_provider(), on_otp_delivered, on_otp_failed)
+    handlers.setup(otp_delivery, broadcaster)
+
+    logger.info("🚀 Starting Telegram Bot (asyncio)...")
+    try:
+        await run_db(handlers.resume_background_work, otp_scheduler)
+        # Polling and a webhook cannot be used at the same time
+        await bot.delete_webhook()
+        await bot.infinity_polling()
+    finally:
+        otp_scheduler.shutdown()
+        await bot.close_session()
+
+if __name__ == '__main__':
+    asyncio.run(main())
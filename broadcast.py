@@ -0,0 +1,177 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Dict, Optional
+
+from telebot.apihelper import ApiTelegramException
+
+import config
+from database import Broadcast, Database
+from keyboards import owner_panel
+from ratelimit import TokenBucket, retry_after
+
+logger = logging.getLogger(__name__)
+
+# Telegram errors that will not go away by retrying (blocked bot, deleted account, bad chat)
+PERMANENT_ERROR_CODES = {400, 403}
+
+
+class Broadcaster:
+    """Sends broadcasts in the background, paced to Telegram's limits
+
+    Recipients are streamed in user_id order (blocked users are skipped in
+    SQL) and sent one chunk at a time by a bounded pool of sender threads
+    sharing a global token bucket. After
+    each chunk the cursor and counters are checkpointed to the broadcasts
+    table and the owner's progress message is refreshed, so a restart
+    resumes after the last finished chunk instead of starting over.
+
+    Every send takes a token from the broadcast's own bucket (``rate``)
+    and from ``api_bucket``, the process-wide bucket the Outbox uses too.
+    Keeping ``rate`` below the shared rate leaves room for purchase
+    confirmations and OTP pushes while a broadcast runs.
+    """
+
+    def __init__(self, bot, database: Database,
+                 api_bucket: Optional[TokenBucket] = None,
+                 rate: float = config.BROADCAST_RATE,
+                 workers: int = config.BROADCAST_WORKERS,
+                 chunk_size: int = config.BROADCAST_CHUNK_SIZE,
+                 per_chat_interval: float = config.BROADCAST_PER_CHAT_INTERVAL,
+                 max_retries: int = config.BROADCAST_MAX_RETRIES,
+                 progress_interval: float = config.BROADCAST_PROGRESS_INTERVAL):
+        self.bot = bot
+        self.db = database
+        self.bucket = TokenBucket(rate)
+        self.api_bucket = api_bucket or TokenBucket(config.BOT_API_RATE)
+        self.chunk_size = chunk_size
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self.progress_interval = progress_interval
+        self._senders = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='broadcast')
+        self._last_sent: Dict[int, float] = {}
+        self._last_sent_lock = threading.Lock()
+        self._running: Dict[int, threading.Thread] = {}
+
+    # ========== CONTROL ==========
+    def start(self, text: str, created_by: int, chat_id: int) -> int:
+        """Queue a broadcast and return its id; progress is reported to ``chat_id``"""
+        total = self.db.count_users(include_blocked=False)
+        broadcast_id = self.db.create_broadcast(text, created_by, chat_id, total)
+        try:
+            progress = self.bot.send_message(chat_id, f"📢 *Broadcast #{broadcast_id}* queued for {total} users...",
+                                             parse_mode='Markdown')
+            self.db.set_broadcast_message(broadcast_id, progress.message_id)
+        except Exception as e:
+            logger.error(f"Failed to send broadcast progress message: {e}")
+        self._spawn(broadcast_id)
+        return broadcast_id
+
+    def resume(self):
+        """Continue every broadcast that was still running when the process stopped"""
+        for broadcast in self.db.get_running_broadcasts():
+            logger.info(f"Resuming broadcast {broadcast.id} after user {broadcast.last_user_id}")
+            self._spawn(broadcast.id)
+
+    def is_running(self, broadcast_id: int) -> bool:
+        thread = self._running.get(broadcast_id)
+        return bool(thread and thread.is_alive())
+
+    def _spawn(self, broadcast_id: int):
+        if self.is_running(broadcast_id):
+            return
+        thread = threading.Thread(target=self._run, args=(broadcast_id,),
+                                  name=f'broadcast-{broadcast_id}', daemon=True)
+        self._running[broadcast_id] = thread
+        thread.start()
+
+    # ========== DELIVERY ==========
+    def _run(self, broadcast_id: int):
+        broadcast = self.db.get_broadcast(broadcast_id)
+        if not broadcast:
+            return
+        text = f"📢 *Broadcast Message*\n\n{broadcast.text}"
+        sent, failed, cursor = broadcast.sent, broadcast.failed, broadcast.last_user_id
+        last_progress = 0.0
+
+        try:
+            users = self.db.iter_users(self.chunk_size, after_user_id=cursor, include_blocked=False)
+            while True:
+                chunk = [user[0] for user in islice(users, self.chunk_size)]
+                if not chunk:
+                    break
+                results = list(self._senders.map(lambda chat_id: self._send(chat_id, text), chunk))
+                sent += sum(results)
+                failed += len(results) - sum(results)
+                cursor = chunk[-1]
+                self.db.update_broadcast_progress(broadcast_id, cursor, sent, failed)
+
+                if time.monotonic() - last_progress >= self.progress_interval:
+                    last_progress = time.monotonic()
+                    self._report(broadcast, sent, failed)
+
+            self.db.finish_broadcast(broadcast_id)
+            self._report(broadcast, sent, failed, done=True)
+        except Exception as e:
+            # The checkpoint stays 'running'; resume() picks it up on the next start
+            logger.error(f"Broadcast {broadcast_id} stopped at user {cursor}: {e}")
+        finally:
+            self._running.pop(broadcast_id, None)
+
+    def _send(self, chat_id: int, text: str) -> bool:
+        for attempt in range(self.max_retries + 1):
+            self._pace_chat(chat_id)
+            self.bucket.acquire()
+            self.api_bucket.acquire()
+            try:
+                self.bot.send_message(chat_id, text, parse_mode='Markdown')
+                return True
+            except ApiTelegramException as e:
+                wait = retry_after(e)
+                if wait is not None:
+                    # Slow every sender down, the Outbox included, not just this one
+                    self.api_bucket.pause(wait)
+                    continue
+                if e.error_code in PERMANENT_ERROR_CODES:
+                    return False
+                logger.warning(f"Broadcast to {chat_id} failed (attempt {attempt + 1}): {e}")
+            except Exception as e:
+                logger.warning(f"Broadcast to {chat_id} failed (attempt {attempt + 1}): {e}")
+            time.sleep(min(2 ** attempt, 30))
+        return False
+
+    def _pace_chat(self, chat_id: int):
+        """Keep at least per_chat_interval between messages to the same chat"""
+        with self._last_sent_lock:
+            now = time.monotonic()
+            wait = self._last_sent.get(chat_id, 0.0) + self.per_chat_interval - now
+            self._last_sent[chat_id] = max(now, now + wait)
+            if len(self._last_sent) > 10000:
+                # Entries older than the interval no longer constrain anything
+                cutoff = now - self.per_chat_interval
+                self._last_sent = {c: t for c, t in self._last_sent.items() if t > cutoff}
+        if wait > 0:
+            time.sleep(wait)
+
+    def _report(self, broadcast: Broadcast, sent: int, failed: int, done: bool = False):
+        if not broadcast.message_id and not done:
+            return
+        total = max(broadcast.total, sent + failed)
+        if done:
+            text = f"✅ Broadcast sent to {sent}/{total} users"
+            markup = owner_panel()
+        else:
+            percent = int((sent + failed) * 100 / total) if total else 100
+            text = f"📢 *Broadcast #{broadcast.id}* in progress: {percent}%\n\n✅ Sent: {sent}\n❌ Failed: {failed}\n👥 Total: {total}"
+            markup = None
+        self.api_bucket.acquire()
+        try:
+            if broadcast.message_id:
+                self.bot.edit_message_text(text, broadcast.chat_id, broadcast.message_id,
+                                           parse_mode='Markdown', reply_markup=markup)
+            else:
+                self.bot.send_message(broadcast.chat_id, text, reply_markup=markup)
+        except Exception as e:
+            logger.warning(f"Failed to update broadcast {broadcast.id} progress: {e}")
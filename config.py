@@ -1,6 +1,8 @@
 import os
+import secrets
 import sqlite3
 from dotenv import load_dotenv
+from migrations import run_migrations
 
 load_dotenv()
 
@@ -8,88 +10,108 @@ load_dotenv()
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 OWNER_ID = int(os.getenv('OWNER_ID', 0))
 ADMIN_IDS = list(map(int, os.getenv('ADMIN_IDS', '').split(','))) if os.getenv('ADMIN_IDS') else []
+ROLE_CACHE_TTL = int(os.getenv('ROLE_CACHE_TTL', 300))  # seconds before cached admin ids are reloaded
+
+# Webhook (leave WEBHOOK_URL empty to long-poll instead)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')  # public base URL, e.g. https://your-app.onrender.com
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+# Sent back by Telegram in X-Telegram-Bot-Api-Secret-Token; a random one is made per process when unset
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '') or secrets.token_urlsafe(32)
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 4))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))
 
 # Payment Configuration
 MIN_DEPOSIT = int(os.getenv('MIN_DEPOSIT', 50))
+UTR_CACHE_SIZE = int(os.getenv('UTR_CACHE_SIZE', 100000))  # recent UTRs rejected without a DB round trip
+PAYMENTS_PAGE_SIZE = int(os.getenv('PAYMENTS_PAGE_SIZE', 20))  # pending payments shown in the review list
+PAYMENT_BULK_LIMIT = int(os.getenv('PAYMENT_BULK_LIMIT', 500))  # most payments one "approve up to" click approves
+PAYMENT_BULK_THRESHOLDS = [int(x) for x in os.getenv('PAYMENT_BULK_THRESHOLDS', '100,500,1000').split(',') if x]
 OWNER_QR_CODE = os.getenv('OWNER_QR_CODE', "https://ibb.co/jkhs189T")
 
 # Account Prices
 TELEGRAM_OTP_PRICE = int(os.getenv('TELEGRAM_OTP_PRICE', 90))
 WHATSAPP_OTP_PRICE = int(os.getenv('WHATSAPP_OTP_PRICE', 70))
 SESSION_PRICE = int(os.getenv('SESSION_PRICE', 25))
+
+# Keyboards
+KEYBOARD_CACHE_SIZE = int(os.getenv('KEYBOARD_CACHE_SIZE', 2048))  # cached per-order/user/payment keyboards
+USERS_PAGE_SIZE = int(os.getenv('USERS_PAGE_SIZE', 15))  # rows per page in the admin user browser
+
+# Account import
+ACCOUNT_IMPORT_CHUNK_SIZE = int(os.getenv('ACCOUNT_IMPORT_CHUNK_SIZE', 1000))  # numbers per transaction
+ACCOUNT_IMPORT_MAX_FILE_SIZE = int(os.getenv('ACCOUNT_IMPORT_MAX_FILE_SIZE', 20 * 1024 * 1024))  # Bot API download limit
+
 # OTP Configuration
-OTP_DELIVERY_MIN_TIME = 05  # seconds
+OTP_DELIVERY_MIN_TIME = 5  # seconds
 OTP_DELIVERY_MAX_TIME = 30  # seconds
+SCHEDULER_WORKERS = int(os.getenv('SCHEDULER_WORKERS', 2))  # threads running due OTP deliveries
+OTP_JOB_BATCH_SIZE = int(os.getenv('OTP_JOB_BATCH_SIZE', 100))  # jobs claimed per drain
+OTP_JOB_LEASE_SECONDS = int(os.getenv('OTP_JOB_LEASE_SECONDS', 60))  # claim expires if a worker dies
+OTP_JOB_MAX_ATTEMPTS = int(os.getenv('OTP_JOB_MAX_ATTEMPTS', 40))  # provider polls before giving up
 
+# OTP provider polling
+OTP_PROVIDER = os.getenv('OTP_PROVIDER', 'fake')
+OTP_POLL_INITIAL_DELAY = int(os.getenv('OTP_POLL_INITIAL_DELAY', OTP_DELIVERY_MIN_TIME))  # seconds after purchase
+OTP_POLL_BATCH_WINDOW = float(os.getenv('OTP_POLL_BATCH_WINDOW', 1))  # seconds to gather due jobs into one poll
+OTP_POLL_CONCURRENCY = int(os.getenv('OTP_POLL_CONCURRENCY', 4))  # provider batches polled in parallel
+OTP_POLL_BACKOFF_BASE = float(os.getenv('OTP_POLL_BACKOFF_BASE', 2))  # seconds, doubled per miss
+OTP_POLL_BACKOFF_MAX = float(os.getenv('OTP_POLL_BACKOFF_MAX', 30))  # seconds
 
-# Database
-DB_NAME = os.getenv('DB_NAME', 'accounts_bot.db')
-DB_PATH = DB_NAME
+
+# Outbound Bot API rate (Telegram allows ~30 messages/second overall and ~1/second per chat)
+BOT_API_RATE = float(os.getenv('BOT_API_RATE', 28))  # calls per second, shared by the outbox and broadcasts
+
+# Broadcast
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', 20))  # messages per second; below BOT_API_RATE so replies get through
+BROADCAST_WORKERS = int(os.getenv('BROADCAST_WORKERS', 8))
+BROADCAST_CHUNK_SIZE = int(os.getenv('BROADCAST_CHUNK_SIZE', 200))  # users per checkpoint
+BROADCAST_PER_CHAT_INTERVAL = float(os.getenv('BROADCAST_PER_CHAT_INTERVAL', 1))  # seconds
+BROADCAST_MAX_RETRIES = int(os.getenv('BROADCAST_MAX_RETRIES', 3))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv('BROADCAST_PROGRESS_INTERVAL', 5))  # seconds between progress edits
+
+# Outbound Bot API queue
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', 4))
+OUTBOX_MAX_RETRIES = int(os.getenv('OUTBOX_MAX_RETRIES', 5))
+OUTBOX_BACKOFF_BASE = float(os.getenv('OUTBOX_BACKOFF_BASE', 1))  # seconds
+OUTBOX_BACKOFF_MAX = float(os.getenv('OUTBOX_BACKOFF_MAX', 60))  # seconds
+
+# Update de-duplication
+DEDUP_CACHE_SIZE = int(os.getenv('DEDUP_CACHE_SIZE', 10000))  # remembered update/callback ids
+DEDUP_PERSIST = os.getenv('DEDUP_PERSIST', 'false').lower() in ('1', 'true', 'yes')  # also record ids in SQLite
+DEDUP_RETENTION = int(os.getenv('DEDUP_RETENTION', 86400))  # seconds persisted ids are kept
+DEDUP_TAP_WINDOW = float(os.getenv('DEDUP_TAP_WINDOW', 2))  # seconds; repeated taps of a button that changes state are ignored
 
 # Database
 DB_NAME = os.getenv('DB_NAME', 'accounts_bot.db')
 DB_PATH = DB_NAME
 
-def init_database():
-    conn = sqlite3.connect(DB_PATH)
+# Database connection pool
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 8))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))  # seconds to wait for a free connection
+DB_BUSY_TIMEOUT = int(os.getenv('DB_BUSY_TIMEOUT', 5000))  # milliseconds
+DB_HEALTH_CHECK_INTERVAL = int(os.getenv('DB_HEALTH_CHECK_INTERVAL', 60))  # idle seconds before a ping
+DB_SYNCHRONOUS = os.getenv('DB_SYNCHRONOUS', 'NORMAL')
+DB_CACHE_SIZE = int(os.getenv('DB_CACHE_SIZE', -16000))  # negative = KiB
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', 64 * 1024 * 1024))  # bytes
+DB_GROUP_COMMIT = os.getenv('DB_GROUP_COMMIT', 'false').lower() in ('1', 'true', 'yes')  # single writer thread
+DB_GROUP_COMMIT_WINDOW_MS = float(os.getenv('DB_GROUP_COMMIT_WINDOW_MS', 2))  # how long a group stays open
+DB_GROUP_COMMIT_MAX_BATCH = int(os.getenv('DB_GROUP_COMMIT_MAX_BATCH', 256))  # writes per commit
+DB_GROUP_COMMIT_TIMEOUT = float(os.getenv('DB_GROUP_COMMIT_TIMEOUT', 30))  # seconds a caller waits for its write
+
+# Balance ledger
+LEDGER_CHECKPOINT_INTERVAL = int(os.getenv('LEDGER_CHECKPOINT_INTERVAL', 300))  # seconds between checkpoints
+LEDGER_CHECKPOINT_BATCH = int(os.getenv('LEDGER_CHECKPOINT_BATCH', 5000))  # entries per checkpoint transaction
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 10000))  # user profiles kept in memory
+INVENTORY_CACHE_TTL = int(os.getenv('INVENTORY_CACHE_TTL', 60))  # seconds before stock counts are re-read
+INVENTORY_RECOUNT_INTERVAL = int(os.getenv('INVENTORY_RECOUNT_INTERVAL', 3600))  # seconds between counter audits
+
+def init_database(db_path: str = DB_PATH):
+    """Bring the schema up to date and make sure the owner exists"""
+    conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
-    # Users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            balance REAL DEFAULT 0,
-            total_spent REAL DEFAULT 0,
-            accounts_bought INTEGER DEFAULT 0,
-            is_blocked BOOLEAN DEFAULT FALSE,
-            is_admin BOOLEAN DEFAULT FALSE,
-            joined_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            total_refund REAL DEFAULT 0
-        )
-    ''')
-    
-    # Accounts table with proper status tracking
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS accounts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            type TEXT NOT NULL,
-            phone_number TEXT UNIQUE,
-            otp_code TEXT,
-            status TEXT DEFAULT 'available',  -- available, in_use, sold
-            price REAL NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Account orders table with OTP tracking
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS account_orders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            account_type TEXT,
-            phone_number TEXT,
-            otp_code TEXT,
-            status TEXT DEFAULT 'pending',  -- pending, otp_ready, completed, cancelled
-            price REAL,
-            purchased_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            completed_at TIMESTAMP,
-            refund_amount REAL DEFAULT 0
-        )
-    ''')
-    
-    # Payments table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS payments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            amount REAL,
-            utr TEXT,
-            status TEXT DEFAULT 'pending',
-            admin_id INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+    # Tables and indexes live in migrations.py; this is a no-op once up to date
+    run_migrations(conn)
     
     # Insert owner if not exists
     if OWNER_ID:
@@ -98,5 +120,3 @@ def init_database():
     
     conn.commit()
     conn.close()
-
-init_database()
@@ -1,139 +1,1426 @@
 import sqlite3
-import datetime
-from typing import List, Tuple, Optional
+import logging
+import queue
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from typing import Callable, Dict, FrozenSet, Iterator, List, NamedTuple, Tuple, TypeVar, Optional
 import config
 
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Column order handlers unpack orders in; kept explicit so new columns don't shift it
+ORDER_COLUMNS = '''id, user_id, account_type, phone_number, otp_code, status, price, 
+                   purchased_at, completed_at, refund_amount'''
+USER_COLUMNS = '''user_id, username, balance, total_spent, accounts_bought, is_blocked, is_admin, 
+                  joined_date, total_refund'''
+
+
+class ConnectionPool:
+    """Fixed-size pool of long-lived SQLite connections shared by all threads"""
+
+    def __init__(self, db_path: str, size: int = config.DB_POOL_SIZE,
+                 timeout: float = config.DB_POOL_TIMEOUT,
+                 health_check_interval: int = config.DB_HEALTH_CHECK_INTERVAL):
+        self.db_path = db_path
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        # LIFO so the most recently used (warmest) connection is handed out first
+        self._idle = queue.LifoQueue(maxsize=self.size)
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=config.DB_BUSY_TIMEOUT / 1000,
+                               check_same_thread=False)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute(f'PRAGMA synchronous = {config.DB_SYNCHRONOUS}')
+        conn.execute(f'PRAGMA cache_size = {int(config.DB_CACHE_SIZE)}')
+        conn.execute(f'PRAGMA mmap_size = {int(config.DB_MMAP_SIZE)}')
+        conn.execute(f'PRAGMA busy_timeout = {int(config.DB_BUSY_TIMEOUT)}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        return conn
+
+    def _is_healthy(self, conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn: sqlite3.Connection):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    def _acquire(self) -> sqlite3.Connection:
+        if self._closed:
+            raise sqlite3.ProgrammingError("Connection pool is closed")
+
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = self._created < self.size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    try:
+                        return self._connect()
+                    except sqlite3.Error:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                try:
+                    conn, last_used = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise sqlite3.OperationalError(
+                        f"Timed out after {self.timeout}s waiting for a database connection")
+
+            # Only ping connections that have been sitting idle for a while
+            if time.monotonic() - last_used < self.health_check_interval or self._is_healthy(conn):
+                return conn
+            logger.warning("Discarding unhealthy database connection")
+            self._discard(conn)
+
+    def _release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            # Never hand a connection with an open transaction to the next caller
+            conn.rollback()
+        if self._closed:
+            self._discard(conn)
+            return
+        self._idle.put((conn, time.monotonic()))
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a ``with`` block"""
+        conn = self._acquire()
+        try:
+            yield conn
+        except BaseException:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                # Connection is unusable; drop it instead of returning it to the pool
+                self._discard(conn)
+            else:
+                self._release(conn)
+            raise
+        else:
+            self._release(conn)
+
+    def close(self):
+        """Close every idle connection; borrowed ones are closed on return"""
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def stats(self) -> dict:
+        return {'size': self.size, 'open': self._created, 'idle': self._idle.qsize()}
+
+
+def normalise_utr(utr: str) -> str:
+    """Canonical form of a UTR: letters and digits only, upper case, without a 'UTR' label
+
+    Every real UTR has digits in it; anything else ('UTR-----', 'utr !!!')
+    comes back as '' so callers reject it instead of keying it as 'UTR'.
+    """
+    key = re.sub(r'[^0-9A-Za-z]', '', utr).upper()
+    if key.startswith('UTR') and len(key) > 3:
+        key = key[3:]
+    return key if any(char.isdigit() for char in key) else ''
+
+
+class Rollback(Exception):
+    """Raised by a write function to undo its changes and return ``value`` instead"""
+
+    def __init__(self, value=None):
+        super().__init__(value)
+        self.value = value
+
+
+def run_write(conn: sqlite3.Connection, write: Callable[[sqlite3.Cursor], T]) -> T:
+    """Run ``write`` inside a savepoint of the open transaction
+
+    If ``write`` raises, only its own changes are undone, so one failing
+    write does not take the rest of a group commit down with it.
+    """
+    conn.execute('SAVEPOINT write')
+    cursor = conn.cursor()
+    try:
+        result = write(cursor)
+    except Rollback as rollback:
+        cursor.close()
+        conn.execute('ROLLBACK TO write')
+        result = rollback.value
+    except BaseException:
+        cursor.close()
+        conn.execute('ROLLBACK TO write')
+        conn.execute('RELEASE write')
+        raise
+    cursor.close()
+    conn.execute('RELEASE write')
+    return result
+
+
+class GroupCommitWriter:
+    """One thread that owns all writes and commits them in groups
+
+    Callers queue a write function and wait on its future. The writer
+    drains whatever arrives within ``window`` seconds (up to ``max_batch``
+    writes), runs each in its own savepoint of a single transaction and
+    commits once, so a burst of purchases costs one lock acquisition and
+    one fsync instead of one each. Futures resolve only after the commit.
+
+    The thread survives any error: a group that cannot be committed fails
+    all of its futures, and the connection is reopened for the next one.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection],
+                 window: float = config.DB_GROUP_COMMIT_WINDOW_MS / 1000,
+                 max_batch: int = config.DB_GROUP_COMMIT_MAX_BATCH,
+                 timeout: float = config.DB_GROUP_COMMIT_TIMEOUT):
+        self._connect = connect
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.timeout = timeout
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, write: Callable[[sqlite3.Cursor], T]) -> 'Future[T]':
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("A write function cannot queue another write")
+        if not self._thread.is_alive():
+            raise sqlite3.OperationalError("The database writer thread is not running")
+        future: 'Future[T]' = Future()
+        self._queue.put((write, future))
+        return future
+
+    def run(self, write: Callable[[sqlite3.Cursor], T]) -> T:
+        """Queue ``write`` and wait for its result
+        
+        Gives up after ``timeout`` seconds. The write stays queued and may
+        still commit afterwards.
+        """
+        try:
+            return self.submit(write).result(timeout=self.timeout)
+        except FutureTimeout:
+            raise sqlite3.OperationalError(
+                f"Timed out after {self.timeout}s waiting for the database writer")
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def close(self):
+        """Commit everything already queued, then stop the thread"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        conn: Optional[sqlite3.Connection] = None
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                if conn is None:
+                    conn = self._connect()
+                conn = self._commit(conn, batch)
+            except Exception as e:
+                # Callers are blocked on these futures; never leave one unresolved
+                logger.error(f"Database writer failed a group of {len(batch)} writes: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except sqlite3.Error:
+                        pass
+                conn = None
+        if conn is not None:
+            conn.close()
+
+    def _commit(self, conn: sqlite3.Connection, batch: list) -> sqlite3.Connection:
+        outcomes = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for write, future in batch:
+                try:
+                    outcomes.append((future, True, run_write(conn, write)))
+                except Exception as e:
+                    outcomes.append((future, False, e))
+            conn.commit()
+        except sqlite3.Error as e:
+            # Nothing in the group was committed; fail every caller
+            logger.error(f"Group commit of {len(batch)} writes failed: {e}")
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                conn.close()
+                conn = self._connect()
+            for _, future in batch:
+                future.set_exception(e)
+            return conn
+
+        for future, ok, value in outcomes:
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+        return conn
+
+
+class PurchaseResult(NamedTuple):
+    """Outcome of Database.purchase_otp"""
+    status: str
+    order_id: Optional[int] = None
+    phone_number: Optional[str] = None
+    balance: Optional[float] = None
+
+    OK = 'ok'
+    USER_NOT_FOUND = 'user_not_found'
+    BLOCKED = 'blocked'
+    INSUFFICIENT_BALANCE = 'insufficient_balance'
+    OUT_OF_STOCK = 'out_of_stock'
+
+    @property
+    def ok(self) -> bool:
+        return self.status == PurchaseResult.OK
+
+
+class OtpJob(NamedTuple):
+    """A claimed row of the otp_jobs delivery queue"""
+    order_id: int
+    user_id: int
+    phone_number: str
+    attempts: int
+
+
+class OtpDelivery(NamedTuple):
+    """An order whose OTP was just stored by Database.update_otp_codes"""
+    order_id: int
+    user_id: int
+    phone_number: str
+    otp_code: str
+    price: float
+    chat_id: Optional[int]
+    message_id: Optional[int]
+
+
+class CancelledOrder(NamedTuple):
+    """A pending OTP order just cancelled and refunded"""
+    order_id: int
+    user_id: int
+    phone_number: str
+    price: float
+    chat_id: Optional[int]
+    message_id: Optional[int]
+
+
+class ReviewedPayment(NamedTuple):
+    """A payment just approved or declined by a bulk review"""
+    id: int
+    user_id: int
+    amount: float
+
+
+class LedgerEntry(NamedTuple):
+    """A row of the ledger table"""
+    id: int
+    user_id: int
+    amount: float
+    kind: str
+    ref_id: Optional[int]
+    actor_id: Optional[int]
+    created_at: float
+
+    OPENING = 'opening'
+    DEPOSIT = 'deposit'
+    PURCHASE = 'purchase'
+    REFUND = 'refund'
+    ADJUST = 'adjust'
+
+
+class LedgerCheckpoint(NamedTuple):
+    """Outcome of Database.checkpoint_ledger"""
+    entries: int  # ledger entries folded into ledger_balances
+    repaired: List[int]  # users whose users.balance disagreed with the ledger
+
+
+class Broadcast(NamedTuple):
+    """A row of the broadcasts table"""
+    id: int
+    text: str
+    created_by: int
+    chat_id: int
+    message_id: Optional[int]
+    status: str
+    last_user_id: int
+    sent: int
+    failed: int
+    total: int
+
+
+class UserRecord:
+    """A row of the users table, as returned by Database.get_user
+
+    Records are shared through the user cache, so treat them as read-only;
+    Database methods that change a user drop the cached record, and the
+    next get_user reads a fresh one.
+    """
+    __slots__ = ('user_id', 'username', 'balance', 'total_spent', 'accounts_bought',
+                 'is_blocked', 'is_admin', 'joined_date', 'total_refund')
+
+    def __init__(self, user_id: int, username: Optional[str], balance: float, total_spent: float,
+                 accounts_bought: int, is_blocked: bool, is_admin: bool, joined_date: str,
+                 total_refund: float):
+        self.user_id = user_id
+        self.username = username
+        self.balance = balance
+        self.total_spent = total_spent
+        self.accounts_bought = accounts_bought
+        self.is_blocked = bool(is_blocked)
+        self.is_admin = bool(is_admin)
+        self.joined_date = joined_date
+        self.total_refund = total_refund
+
+    def __repr__(self):
+        return f"UserRecord(user_id={self.user_id}, username={self.username!r}, balance={self.balance})"
+
+
+class UserCache:
+    """Bounded LRU of UserRecords keyed by user_id
+
+    Only holds users that exist; a miss always falls through to the
+    database. Writers ``discard`` the user after committing instead of
+    patching the record: commits can finish in any order, so a value
+    computed inside one transaction may already be stale by the time it
+    reaches the cache. ``version`` changes on every discard; a reader
+    passes the version it saw before its query to ``put``, which then
+    refuses a row that may predate a write that committed meanwhile.
+    """
+
+    def __init__(self, maxsize: int = config.USER_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._records: 'OrderedDict[int, UserRecord]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.version = 0
+
+    def get(self, user_id: int) -> Optional[UserRecord]:
+        with self._lock:
+            record = self._records.get(user_id)
+            if record is not None:
+                self._records.move_to_end(user_id)
+            return record
+
+    def put(self, record: UserRecord, version: int):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if version != self.version:
+                return
+            self._records[record.user_id] = record
+            self._records.move_to_end(record.user_id)
+            while len(self._records) > self.maxsize:
+                self._records.popitem(last=False)
+
+    def discard(self, user_id: int):
+        with self._lock:
+            self._records.pop(user_id, None)
+            self.version += 1
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+            self.version += 1
+
+
+class RecentUtrs:
+    """Bounded LRU set of normalised UTRs that are pending or approved
+
+    A hit is a certain duplicate and is rejected without touching the
+    database; a miss proves nothing and falls through to the unique index.
+    """
+
+    def __init__(self, maxsize: int = config.UTR_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._utrs: 'OrderedDict[str, None]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def __contains__(self, utr: str) -> bool:
+        with self._lock:
+            if utr in self._utrs:
+                self._utrs.move_to_end(utr)
+                return True
+            return False
+
+    def add(self, utr: str):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._utrs[utr] = None
+            self._utrs.move_to_end(utr)
+            while len(self._utrs) > self.maxsize:
+                self._utrs.popitem(last=False)
+
+    def discard(self, utr: str):
+        with self._lock:
+            self._utrs.pop(utr, None)
+
+
 class Database:
-    def __init__(self, db_path: str = config.DB_PATH):
+    def __init__(self, db_path: str = config.DB_PATH, pool_size: int = config.DB_POOL_SIZE):
         self.db_path = db_path
+        config.init_database(db_path)
+        self.pool = ConnectionPool(db_path, size=pool_size)
+        # With group commit on, every write goes through one writer thread; reads stay on the pool
+        self.writer = GroupCommitWriter(self.pool._connect) if config.DB_GROUP_COMMIT else None
+        # Role cache: admin user ids, reloaded after ROLE_CACHE_TTL or on admin changes
+        self._admin_ids: Optional[FrozenSet[int]] = None
+        self._admin_ids_loaded_at = 0.0
+        self._roles_lock = threading.Lock()
+        # Profile cache; every users mutation below drops the user's entry
+        self.users = UserCache()
+        # Stock counts: type -> status -> count, mirrored from inventory_counts
+        self._inventory: Optional[Dict[str, Dict[str, int]]] = None
+        self._inventory_loaded_at = 0.0
+        self._inventory_version = 0
+        self._inventory_lock = threading.Lock()
+        self.recent_utrs = RecentUtrs()
 
-    # ... (keep all existing methods) ...
+    def close(self):
+        if self.writer:
+            self.writer.close()
+        self.pool.close()
+
+    def _write(self, write: Callable[[sqlite3.Cursor], T]) -> T:
+        """Run ``write(cursor)`` in a write transaction and return its result
+
+        ``write`` may raise Rollback to undo its changes and return a value.
+        Post-commit work (cache updates) belongs to the caller, after this
+        returns.
+        """
+        if self.writer:
+            return self.writer.run(write)
+        with self.pool.connection() as conn:
+            # Take the write lock up front so concurrent writers serialise here
+            conn.execute('BEGIN IMMEDIATE')
+            result = run_write(conn, write)
+            conn.commit()
+        return result
 
     def create_otp_purchase(self, user_id: int, account_type: str, phone_number: str, price: float):
         """Create a new OTP purchase with pending status"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO account_orders (user_id, account_type, phone_number, status, price) 
-            VALUES (?, ?, ?, 'pending', ?)
-        ''', (user_id, account_type, phone_number, price))
-        order_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return order_id
+        def write(cursor):
+            cursor.execute('''
+                INSERT INTO account_orders (user_id, account_type, phone_number, status, price) 
+                VALUES (?, ?, ?, 'pending', ?)
+            ''', (user_id, account_type, phone_number, price))
+            return cursor.lastrowid
+        return self._write(write)
+
+    def get_order(self, order_id: int):
+        """Get a single order by id"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'SELECT {ORDER_COLUMNS} FROM account_orders WHERE id = ?', (order_id,))
+            order = cursor.fetchone()
+        return order
 
     def get_pending_otp_order(self, user_id: int):
         """Get user's pending OTP order"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT * FROM account_orders 
-            WHERE user_id = ? AND status = 'pending' 
-            ORDER BY purchased_at DESC LIMIT 1
-        ''', (user_id,))
-        order = cursor.fetchone()
-        conn.close()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT {ORDER_COLUMNS} FROM account_orders 
+                WHERE user_id = ? AND status = 'pending' 
+                ORDER BY purchased_at DESC LIMIT 1
+            ''', (user_id,))
+            order = cursor.fetchone()
         return order
 
-    def update_otp_code(self, order_id: int, otp_code: str):
-        """Update OTP code for an order"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE account_orders 
-            SET otp_code = ?, status = 'otp_ready' 
-            WHERE id = ?
-        ''', (otp_code, order_id))
-        conn.commit()
-        conn.close()
-
-    def complete_otp_order(self, order_id: int):
-        """Mark OTP order as completed"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def update_otp_code(self, order_id: int, otp_code: str) -> bool:
+        """Update OTP code for an order; False if it is no longer pending"""
+        def write(cursor):
+            cursor.execute('''
+                UPDATE account_orders 
+                SET otp_code = ?, status = 'otp_ready' 
+                WHERE id = ? AND status = 'pending'
+            ''', (otp_code, order_id))
+            return cursor.rowcount > 0
+        return self._write(write)
+
+    def complete_otp_order(self, order_id: int) -> bool:
+        """Complete an order whose OTP has been shown and mark its number sold
+        
+        Only an otp_ready order completes, so when the pushed OTP and a 'View
+        OTP' tap both report the same order, the number is sold and counted
+        in accounts_bought once. Returns False if the order was not otp_ready.
+        """
+        def write(cursor):
+            cursor.execute('''
+                UPDATE account_orders 
+                SET status = 'completed', completed_at = CURRENT_TIMESTAMP 
+                WHERE id = ? AND status = 'otp_ready' 
+                RETURNING user_id, phone_number
+            ''', (order_id,))
+            row = cursor.fetchone()
+            if row:
+                user_id, phone_number = row
+                cursor.execute("UPDATE accounts SET status = 'sold' WHERE phone_number = ?", (phone_number,))
+                cursor.execute('UPDATE users SET accounts_bought = accounts_bought + 1 WHERE user_id = ?',
+                               (user_id,))
+            return row
+        
+        row = self._write(write)
+        if not row:
+            return False
+        self.users.discard(row[0])
+        self.invalidate_inventory()
+        return True
+
+    def cancel_otp_order(self, order_id: int):
+        """Cancel a pending OTP order and refund it; returns (user_id, price) or None
+
+        Only a pending order can be cancelled, so a repeated cancel (double
+        tap, redelivered update) finds nothing to do and refunds nothing.
+        The number goes back to the pool in the same transaction.
+        """
+        order = self._write(lambda cursor: self._cancel_pending_order(cursor, order_id))
+        if not order:
+            return None
+        self.users.discard(order.user_id)
+        self.invalidate_inventory()
+        return order.user_id, order.price
+
+    def _cancel_pending_order(self, cursor: sqlite3.Cursor, order_id: int) -> Optional[CancelledOrder]:
+        """Cancel, refund and release a pending order inside the caller's transaction"""
         cursor.execute('''
             UPDATE account_orders 
-            SET status = 'completed', completed_at = CURRENT_TIMESTAMP 
-            WHERE id = ?
+            SET status = 'cancelled', completed_at = CURRENT_TIMESTAMP, refund_amount = price 
+            WHERE id = ? AND status = 'pending' 
+            RETURNING user_id, phone_number, price, chat_id, message_id
         ''', (order_id,))
-        conn.commit()
-        conn.close()
-
-    def cancel_otp_order(self, order_id: int):
-        """Cancel OTP order and refund"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        row = cursor.fetchone()
+        if not row:
+            return None
         
-        # Get order details
-        cursor.execute('SELECT user_id, price FROM account_orders WHERE id = ?', (order_id,))
-        order = cursor.fetchone()
+        order = CancelledOrder(order_id, *row)
+        # Refund user balance
+        cursor.execute('''
+            UPDATE users SET balance = balance + ?, total_refund = total_refund + ? 
+            WHERE user_id = ?
+        ''', (order.price, order.price, order.user_id))
+        self._append_ledger(cursor, order.user_id, order.price, LedgerEntry.REFUND, ref_id=order_id)
+        
+        # Drop the pending delivery job and put the number back in the pool
+        cursor.execute('DELETE FROM otp_jobs WHERE order_id = ?', (order_id,))
+        cursor.execute("UPDATE accounts SET status = 'available' WHERE phone_number = ? AND status = 'in_use'",
+                       (order.phone_number,))
+        return order
+
+    def purchase_otp(self, user_id: int, account_type: str, price: float, otp_delay: float = 0,
+                     chat_id: Optional[int] = None, message_id: Optional[int] = None) -> PurchaseResult:
+        """Reserve a number, debit the buyer and create the order in one transaction
         
-        if order:
-            user_id, price = order
-            # Update order status
+        The order's OTP delivery job is queued in the same transaction, due
+        ``otp_delay`` seconds from now. ``chat_id``/``message_id`` identify the
+        purchase message so the delivery can edit it in place.
+        """
+        def write(cursor):
+            cursor.execute('SELECT balance, is_blocked FROM users WHERE user_id = ?', (user_id,))
+            user = cursor.fetchone()
+            if not user:
+                raise Rollback(PurchaseResult(PurchaseResult.USER_NOT_FOUND))
+            
+            balance, is_blocked = user
+            if is_blocked:
+                raise Rollback(PurchaseResult(PurchaseResult.BLOCKED, balance=balance))
+            
+            # Conditional debit: never lets the balance go below zero
             cursor.execute('''
-                UPDATE account_orders 
-                SET status = 'cancelled', completed_at = CURRENT_TIMESTAMP, refund_amount = ? 
-                WHERE id = ?
-            ''', (price, order_id))
+                UPDATE users SET balance = balance - ? 
+                WHERE user_id = ? AND balance >= ?
+            ''', (price, user_id, price))
+            if cursor.rowcount == 0:
+                raise Rollback(PurchaseResult(PurchaseResult.INSUFFICIENT_BALANCE, balance=balance))
+            
+            phone_number = self._claim_phone_number(cursor, account_type)
+            if not phone_number:
+                # Also undoes the debit above
+                raise Rollback(PurchaseResult(PurchaseResult.OUT_OF_STOCK, balance=balance))
             
-            # Refund user balance
-            cursor.execute('UPDATE users SET balance = balance + ? WHERE user_id = ?', (price, user_id))
-            cursor.execute('UPDATE users SET total_refund = total_refund + ? WHERE user_id = ?', (price, user_id))
+            cursor.execute('''
+                INSERT INTO account_orders (user_id, account_type, phone_number, status, price, chat_id, message_id) 
+                VALUES (?, ?, ?, 'pending', ?, ?, ?)
+            ''', (user_id, account_type, phone_number, price, chat_id, message_id))
+            order_id = cursor.lastrowid
+            
+            cursor.execute('''
+                INSERT INTO otp_jobs (order_id, user_id, phone_number, due_at) 
+                VALUES (?, ?, ?, ?)
+            ''', (order_id, user_id, phone_number, time.time() + otp_delay))
+            self._append_ledger(cursor, user_id, -price, LedgerEntry.PURCHASE, ref_id=order_id)
+            return PurchaseResult(PurchaseResult.OK, order_id, phone_number, balance - price)
         
-        conn.commit()
-        conn.close()
-        return order
+        result = self._write(write)
+        if result.ok:
+            self.users.discard(user_id)
+            self.invalidate_inventory()
+        return result
 
-    def get_available_phone_number(self, account_type: str):
-        """Get a random available phone number"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def _claim_phone_number(self, cursor: sqlite3.Cursor, account_type: str) -> Optional[str]:
+        """Mark a random available number as in use; caller owns the transaction
+        
+        Picks a random id inside the (type, 'available') range of
+        idx_accounts_type_status_id and claims the first available row at or
+        after it, wrapping to the start of the range if the probe lands past
+        the last one. Every step is an index seek, so the cost stays O(log n).
+        """
         cursor.execute('''
-            SELECT phone_number FROM accounts 
-            WHERE type = ? AND status = 'available' 
-            ORDER BY RANDOM() LIMIT 1
-        ''', (account_type,))
-        result = cursor.fetchone()
+            SELECT 
+                (SELECT MIN(id) FROM accounts WHERE type = ? AND status = 'available'),
+                (SELECT MAX(id) FROM accounts WHERE type = ? AND status = 'available')
+        ''', (account_type, account_type))
+        low, high = cursor.fetchone()
         
-        if result:
-            phone_number = result[0]
-            # Mark as in use
-            cursor.execute('UPDATE accounts SET status = "in_use" WHERE phone_number = ?', (phone_number,))
-            conn.commit()
+        if low is None:
+            return None
         
-        conn.close()
-        return phone_number if result else None
+        probe = random.randint(low, high)
+        cursor.execute('''
+            UPDATE accounts SET status = 'in_use' 
+            WHERE id = COALESCE(
+                (SELECT id FROM accounts 
+                 WHERE type = ? AND status = 'available' AND id >= ? 
+                 ORDER BY id LIMIT 1),
+                (SELECT id FROM accounts 
+                 WHERE type = ? AND status = 'available' 
+                 ORDER BY id LIMIT 1)
+            )
+            RETURNING phone_number
+        ''', (account_type, probe, account_type))
+        result = cursor.fetchone()
+        return result[0] if result else None
+
+    def get_available_phone_number(self, account_type: str):
+        """Get a random available phone number"""
+        phone_number = self._write(lambda cursor: self._claim_phone_number(cursor, account_type))
+        if phone_number:
+            self.invalidate_inventory()
+        return phone_number
 
     def release_phone_number(self, phone_number: str):
         """Release phone number back to available pool"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('UPDATE accounts SET status = "available" WHERE phone_number = ?', (phone_number,))
-        conn.commit()
-        conn.close()
-
-    def mark_phone_sold(self, phone_number: str, user_id: int):
-        """Mark phone number as sold"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('UPDATE accounts SET status = "sold" WHERE phone_number = ?', (phone_number,))
-        cursor.execute('UPDATE users SET accounts_bought = accounts_bought + 1 WHERE user_id = ?', (user_id,))
-        conn.commit()
-        conn.close()
+        self._write(lambda cursor: cursor.execute('UPDATE accounts SET status = "available" WHERE phone_number = ?',
+                                                  (phone_number,)))
+        self.invalidate_inventory()
+
+    def get_user_orders(self, user_id: int, limit: int = 20):
+        """User's finished (completed or cancelled) orders, newest first
+        
+        Served by idx_account_orders_user_status_purchased (one seek per
+        status); the two ranges are merged by a top-``limit`` sort.
+        """
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT {ORDER_COLUMNS} FROM account_orders 
+                WHERE user_id = ? AND status IN ('completed', 'cancelled')
+                ORDER BY purchased_at DESC, id DESC LIMIT ?
+            ''', (user_id, limit))
+            orders = cursor.fetchall()
+        return orders
 
     def get_user_active_orders(self, user_id: int):
         """Get user's active OTP orders"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT * FROM account_orders 
-            WHERE user_id = ? AND status IN ('pending', 'otp_ready')
-            ORDER BY purchased_at DESC
-        ''', (user_id,))
-        orders = cursor.fetchall()
-        conn.close()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT {ORDER_COLUMNS} FROM account_orders 
+                WHERE user_id = ? AND status IN ('pending', 'otp_ready')
+                ORDER BY purchased_at DESC
+            ''', (user_id,))
+            orders = cursor.fetchall()
         return orders
 
+    # ========== INVENTORY ==========
+    def add_account(self, account_type: str, phone_number: str, price: float,
+                    otp_code: Optional[str] = None) -> bool:
+        """Add one number to stock; False if it is already there"""
+        return self.add_accounts(account_type, [(phone_number, otp_code)], price) == 1
+
+    def add_accounts(self, account_type: str, accounts: List[Tuple[str, Optional[str]]], price: float) -> int:
+        """Add (phone_number, otp_code) pairs in one transaction; returns how many were new"""
+        def write(cursor):
+            cursor.executemany('''
+                INSERT OR IGNORE INTO accounts (type, phone_number, otp_code, price) 
+                VALUES (?, ?, ?, ?)
+            ''', [(account_type, phone, otp, price) for phone, otp in accounts])
+            return cursor.rowcount
+        
+        added = self._write(write)
+        if added:
+            self.invalidate_inventory()
+        return added
+
+    def get_inventory_counts(self) -> Dict[str, Dict[str, int]]:
+        """Accounts per type and status ('available', 'in_use', 'sold'), served from memory
+
+        The counts come from inventory_counts, which triggers on accounts keep
+        exact. Writes made through this class drop the cached copy; the TTL
+        picks up writes made by other processes.
+        """
+        with self._inventory_lock:
+            if (self._inventory is not None
+                    and time.monotonic() - self._inventory_loaded_at <= config.INVENTORY_CACHE_TTL):
+                return self._inventory
+            version = self._inventory_version
+
+        with self.pool.connection() as conn:
+            rows = conn.execute('SELECT type, status, count FROM inventory_counts').fetchall()
+        counts: Dict[str, Dict[str, int]] = {}
+        for account_type, status, count in rows:
+            counts.setdefault(account_type, {})[status] = count
+
+        with self._inventory_lock:
+            # Don't cache a read that raced with a write
+            if version == self._inventory_version:
+                self._inventory = counts
+                self._inventory_loaded_at = time.monotonic()
+        return counts
+
+    def get_available_accounts_count(self) -> Dict[str, int]:
+        """Available accounts per type, e.g. {'telegram': 12, 'whatsapp': 3}"""
+        return {account_type: statuses.get('available', 0)
+                for account_type, statuses in self.get_inventory_counts().items()}
+
+    def invalidate_inventory(self):
+        with self._inventory_lock:
+            self._inventory = None
+            self._inventory_version += 1
+
+    def recount_inventory(self) -> bool:
+        """Rebuild inventory_counts from the accounts table; True if it had drifted"""
+        def write(cursor):
+            cursor.execute('''
+                SELECT type, status, COUNT(*) FROM accounts 
+                WHERE status IS NOT NULL GROUP BY type, status
+            ''')
+            actual = {(t, s): c for t, s, c in cursor.fetchall()}
+            cursor.execute('SELECT type, status, count FROM inventory_counts WHERE count != 0')
+            stored = {(t, s): c for t, s, c in cursor.fetchall()}
+            if actual != stored:
+                cursor.execute('DELETE FROM inventory_counts')
+                cursor.executemany('INSERT INTO inventory_counts (type, status, count) VALUES (?, ?, ?)',
+                                   [(t, s, c) for (t, s), c in actual.items()])
+            return actual, stored
+        
+        # The counts are read inside the write transaction, so no write can land in between
+        actual, stored = self._write(write)
+        drifted = actual != stored
+        if drifted:
+            logger.warning(f"Inventory counters had drifted and were rebuilt: {stored} -> {actual}")
+            self.invalidate_inventory()
+        return drifted
+
+    # ========== OTP DELIVERY JOBS ==========
+    def claim_due_otp_jobs(self, worker_id: str, limit: int, lease_seconds: float) -> List[OtpJob]:
+        """Lease up to ``limit`` due jobs (or jobs whose lease expired) to ``worker_id``"""
+        now = time.time()
+        def write(cursor):
+            cursor.execute('''
+                UPDATE otp_jobs 
+                SET status = 'leased', lease_owner = ?, lease_expires_at = ?, attempts = attempts + 1 
+                WHERE order_id IN (
+                    SELECT order_id FROM otp_jobs 
+                    WHERE (status = 'queued' AND due_at <= ?) 
+                       OR (status = 'leased' AND lease_expires_at <= ?) 
+                    ORDER BY due_at LIMIT ?
+                )
+                RETURNING order_id, user_id, phone_number, attempts
+            ''', (worker_id, now + lease_seconds, now, now, limit))
+            return [OtpJob(*row) for row in cursor.fetchall()]
+        return self._write(write)
+
+    def update_otp_codes(self, codes: List[Tuple[int, str]]) -> List[OtpDelivery]:
+        """Store OTP codes for many orders in one transaction and retire their jobs
+        
+        Only orders that are still pending move to otp_ready; those orders are
+        returned so callers notify exactly once.
+        """
+        if not codes:
+            return []
+        code_by_order = dict(codes)
+        placeholders = ','.join('?' * len(code_by_order))
+        
+        def write(cursor):
+            cursor.execute(f'''
+                SELECT id, user_id, phone_number, price, chat_id, message_id FROM account_orders 
+                WHERE id IN ({placeholders}) AND status = 'pending'
+            ''', list(code_by_order))
+            delivered = [OtpDelivery(order_id, user_id, phone_number, code_by_order[order_id], price,
+                                     chat_id, message_id)
+                         for order_id, user_id, phone_number, price, chat_id, message_id in cursor.fetchall()]
+            cursor.executemany('''
+                UPDATE account_orders 
+                SET otp_code = ?, status = 'otp_ready' 
+                WHERE id = ?
+            ''', [(delivery.otp_code, delivery.order_id) for delivery in delivered])
+            cursor.executemany('DELETE FROM otp_jobs WHERE order_id = ?', [(order_id,) for order_id in code_by_order])
+            return delivered
+        return self._write(write)
+
+    def reschedule_otp_jobs(self, due: List[Tuple[int, float]], max_attempts: int) -> List[CancelledOrder]:
+        """Return leased jobs to the queue at new due times; returns the orders given up on
+        
+        A job that has already been polled ``max_attempts`` times fails: its
+        order is cancelled, refunded and its number released in the same
+        transaction, so no buyer is left with a debit and no OTP.
+        """
+        if not due:
+            return []
+        
+        def write(cursor):
+            cursor.executemany('''
+                UPDATE otp_jobs 
+                SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, 
+                    due_at = ?, lease_owner = NULL, lease_expires_at = NULL 
+                WHERE order_id = ?
+            ''', [(max_attempts, due_at, order_id) for order_id, due_at in due])
+            return self._refund_failed_otp_jobs(cursor)
+        return self._finish_failed_otp_jobs(self._write(write))
+
+    def refund_failed_otp_jobs(self) -> List[CancelledOrder]:
+        """Cancel and refund the orders of jobs left failed by an older version"""
+        return self._finish_failed_otp_jobs(self._write(self._refund_failed_otp_jobs))
+
+    def _refund_failed_otp_jobs(self, cursor: sqlite3.Cursor) -> List[CancelledOrder]:
+        cursor.execute("SELECT order_id FROM otp_jobs WHERE status = 'failed'")
+        order_ids = [row[0] for row in cursor.fetchall()]
+        cancelled = [self._cancel_pending_order(cursor, order_id) for order_id in order_ids]
+        # Jobs whose order was no longer pending have nothing to refund
+        cursor.executemany('DELETE FROM otp_jobs WHERE order_id = ?', [(order_id,) for order_id in order_ids])
+        return [order for order in cancelled if order]
+
+    def _finish_failed_otp_jobs(self, cancelled: List[CancelledOrder]) -> List[CancelledOrder]:
+        for order in cancelled:
+            self.users.discard(order.user_id)
+        if cancelled:
+            self.invalidate_inventory()
+        return cancelled
+
+    def get_open_otp_job_deadlines(self) -> List[Tuple[int, float]]:
+        """(order_id, unix time it next becomes claimable) for every queued or leased job"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT order_id, CASE status WHEN 'leased' THEN lease_expires_at ELSE due_at END 
+                FROM otp_jobs WHERE status IN ('queued', 'leased')
+            ''')
+            deadlines = cursor.fetchall()
+        return deadlines
+
+    # ========== USERS ==========
+    def get_user(self, user_id: int) -> Optional[UserRecord]:
+        """The user's profile, from the cache when possible"""
+        record = self.users.get(user_id)
+        if record is not None:
+            return record
+        version = self.users.version
+        with self.pool.connection() as conn:
+            row = conn.execute(f'SELECT {USER_COLUMNS} FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        if not row:
+            return None
+        record = UserRecord(*row)
+        self.users.put(record, version)
+        return record
+
+    def create_user(self, user_id: int, username: str):
+        """Register a user; an existing user only gets their username refreshed"""
+        cached = self.users.get(user_id)
+        if cached is not None and (cached.username == username or username == "Unknown"):
+            return
+        def write(cursor):
+            cursor.execute('INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)', (user_id, username))
+            if username != "Unknown":
+                cursor.execute('UPDATE users SET username = ? WHERE user_id = ? AND username IS NOT ?',
+                               (username, user_id, username))
+        
+        self._write(write)
+        if username != "Unknown":
+            self.users.discard(user_id)
+
+    def update_balance(self, user_id: int, amount: float, admin_id: Optional[int] = None) -> Optional[float]:
+        """Add ``amount`` (negative to deduct) to the balance; returns the new balance"""
+        def write(cursor):
+            cursor.execute('UPDATE users SET balance = balance + ? WHERE user_id = ? RETURNING balance',
+                           (amount, user_id))
+            row = cursor.fetchone()
+            if row:
+                self._append_ledger(cursor, user_id, amount, LedgerEntry.ADJUST, actor_id=admin_id)
+            return row
+        
+        row = self._write(write)
+        if not row:
+            return None
+        self.users.discard(user_id)
+        # RETURNING hands back the value before column affinity, so 0.0 + 100 comes out as 100
+        return float(row[0])
+
+    def block_user(self, user_id: int):
+        self._set_blocked(user_id, True)
+
+    def unblock_user(self, user_id: int):
+        self._set_blocked(user_id, False)
+
+    def _set_blocked(self, user_id: int, blocked: bool):
+        self._write(lambda cursor: cursor.execute('UPDATE users SET is_blocked = ? WHERE user_id = ?',
+                                                  (blocked, user_id)))
+        self.users.discard(user_id)
+
+    def get_users_page(self, after_user_id: int = 0, limit: int = 50,
+                       include_blocked: bool = True,
+                       before_user_id: Optional[int] = None) -> List[tuple]:
+        """Up to ``limit`` users with user_id > ``after_user_id``, in user_id order
+
+        Rows are (user_id, username, balance, is_blocked, is_admin, joined_date).
+        With ``before_user_id`` the page is the ``limit`` users just below it
+        instead (still returned in ascending order), for paging backwards.
+        Keyset pagination walks the primary key, so every page costs the same
+        no matter how deep into the table it is.
+        """
+        blocked_filter = '' if include_blocked else 'AND is_blocked = 0'
+        if before_user_id is not None:
+            condition, order, cursor_id = 'user_id < ?', 'DESC', before_user_id
+        else:
+            condition, order, cursor_id = 'user_id > ?', 'ASC', after_user_id
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT user_id, username, balance, is_blocked, is_admin, joined_date 
+                FROM users WHERE {condition} {blocked_filter} 
+                ORDER BY user_id {order} LIMIT ?
+            ''', (cursor_id, limit))
+            users = cursor.fetchall()
+        if before_user_id is not None:
+            users.reverse()
+        return users
+
+    def iter_users(self, batch_size: int = 500, after_user_id: int = 0,
+                   include_blocked: bool = True) -> Iterator[tuple]:
+        """Stream users page by page; at most one page is held in memory
+
+        No connection is held between pages, so a slow consumer (a broadcast)
+        never pins a pooled connection or an open read transaction.
+        """
+        while True:
+            page = self.get_users_page(after_user_id, batch_size, include_blocked)
+            yield from page
+            if len(page) < batch_size:
+                return
+            after_user_id = page[-1][0]
+
+    def search_users(self, username_prefix: str, limit: int = 15) -> List[tuple]:
+        """Users whose username starts with ``username_prefix`` (case-insensitive)
+
+        Written as a range rather than LIKE so that '_' in usernames is not a
+        wildcard; the range is served by idx_users_username_nocase. NOCASE
+        compares ASCII letters as lower case, so the upper bound is built
+        from the lower-cased prefix ('bobZ' -> 'bob{', not 'bob[').
+        """
+        prefix = username_prefix.lstrip('@')
+        if not prefix:
+            return []
+        folded = ''.join(char.lower() if 'A' <= char <= 'Z' else char for char in prefix)
+        upper = folded[:-1] + chr(ord(folded[-1]) + 1)
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT user_id, username, balance, is_blocked, is_admin, joined_date 
+                FROM users 
+                WHERE username >= ? COLLATE NOCASE AND username < ? COLLATE NOCASE 
+                ORDER BY username COLLATE NOCASE, user_id LIMIT ?
+            ''', (prefix, upper, limit))
+            users = cursor.fetchall()
+        return users
+
+    def count_users(self, include_blocked: bool = True) -> int:
+        blocked_filter = '' if include_blocked else 'WHERE is_blocked = 0'
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'SELECT COUNT(*) FROM users {blocked_filter}')
+            count = cursor.fetchone()[0]
+        return count
+
+    # ========== ROLES ==========
+    def admin_ids(self) -> FrozenSet[int]:
+        """Admin user ids (users.is_admin plus config.ADMIN_IDS), served from memory
+
+        add_admin/remove_admin keep the cache current; the TTL only matters
+        if the table is changed by another process or by hand.
+        """
+        with self._roles_lock:
+            if self._admin_ids is None or time.monotonic() - self._admin_ids_loaded_at > config.ROLE_CACHE_TTL:
+                with self.pool.connection() as conn:
+                    rows = conn.execute('SELECT user_id FROM users WHERE is_admin = 1').fetchall()
+                self._admin_ids = frozenset(row[0] for row in rows) | frozenset(config.ADMIN_IDS)
+                self._admin_ids_loaded_at = time.monotonic()
+            return self._admin_ids
+
+    def is_admin(self, user_id: int) -> bool:
+        return user_id in self.admin_ids()
+
+    def invalidate_roles(self):
+        with self._roles_lock:
+            self._admin_ids = None
+
+    def add_admin(self, user_id: int):
+        self._write(lambda cursor: cursor.execute('UPDATE users SET is_admin = 1 WHERE user_id = ?', (user_id,)))
+        self.users.discard(user_id)
+        self.invalidate_roles()
+
+    def remove_admin(self, user_id: int):
+        self._write(lambda cursor: cursor.execute('UPDATE users SET is_admin = 0 WHERE user_id = ?', (user_id,)))
+        self.users.discard(user_id)
+        self.invalidate_roles()
+
+    def get_all_admins(self):
+        """(user_id, username, is_admin) for the owner and every admin, owner first
+
+        Admins come from admin_ids(), so ADMIN_IDS are listed (and notified)
+        even before they have a users row; their username is then None.
+        """
+        admin_ids = self.admin_ids()
+        user_ids = sorted(admin_ids | {config.OWNER_ID}, key=lambda user_id: (user_id != config.OWNER_ID, user_id))
+        placeholders = ','.join('?' * len(user_ids))
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'SELECT user_id, username FROM users WHERE user_id IN ({placeholders})', user_ids)
+            usernames = dict(cursor.fetchall())
+        return [(user_id, usernames.get(user_id), int(user_id in admin_ids)) for user_id in user_ids]
+
+    # ========== PAYMENTS ==========
+    def get_payment(self, payment_id: int):
+        """(id, user_id, amount, utr, status, admin_id, created_at, username) or None"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT p.id, p.user_id, p.amount, p.utr, p.status, p.admin_id, p.created_at, u.username 
+                FROM payments p LEFT JOIN users u ON u.user_id = p.user_id 
+                WHERE p.id = ?
+            ''', (payment_id,))
+            payment = cursor.fetchone()
+        return payment
+
+    def get_pending_payments(self, limit: Optional[int] = None):
+        """Pending payments, oldest first, in the same shape as get_payment"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT p.id, p.user_id, p.amount, p.utr, p.status, p.admin_id, p.created_at, u.username 
+                FROM payments p LEFT JOIN users u ON u.user_id = p.user_id 
+                WHERE p.status = 'pending' ORDER BY p.created_at, p.id LIMIT ?
+            ''', (limit if limit is not None else -1,))
+            payments = cursor.fetchall()
+        return payments
+
+    def summarise_pending_payments(self, max_amount: Optional[float] = None,
+                                   limit: Optional[int] = None) -> Tuple[int, float]:
+        """(count, total) of pending payments, optionally of the oldest ``limit`` up to ``max_amount``"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT COUNT(*), COALESCE(SUM(amount), 0) FROM (
+                    SELECT amount FROM payments 
+                    WHERE status = 'pending' AND (? IS NULL OR amount <= ?) 
+                    ORDER BY created_at, id LIMIT ?
+                )
+            ''', (max_amount, max_amount, limit if limit is not None else -1))
+            count, total = cursor.fetchone()
+        return count, total
+
+    def approve_payment(self, payment_id: int, admin_id: int):
+        """Approve a pending payment and credit the user; returns (user_id, amount) or None"""
+        approved = self.approve_payments([payment_id], admin_id)
+        return (approved[0].user_id, approved[0].amount) if approved else None
+
+    def decline_payment(self, payment_id: int, admin_id: int) -> bool:
+        """Decline a pending payment; False if it was already reviewed"""
+        return bool(self.decline_payments([payment_id], admin_id))
+
+    def approve_payments(self, payment_ids: List[int], admin_id: int) -> List[ReviewedPayment]:
+        """Approve the given payments that are still pending and credit their users"""
+        if not payment_ids:
+            return []
+        placeholders = ','.join('?' * len(payment_ids))
+        return self._approve_payments(f'id IN ({placeholders})', list(payment_ids), admin_id)
+
+    def approve_payments_up_to(self, max_amount: float, admin_id: int,
+                               limit: int = config.PAYMENT_BULK_LIMIT) -> List[ReviewedPayment]:
+        """Approve the oldest ``limit`` pending payments of at most ``max_amount``"""
+        return self._approve_payments('''id IN (
+                SELECT id FROM payments WHERE status = 'pending' AND amount <= ? 
+                ORDER BY created_at, id LIMIT ?
+            )''', [max_amount, limit], admin_id)
+
+    def _approve_payments(self, condition: str, params: list, admin_id: int) -> List[ReviewedPayment]:
+        """Approve and credit every pending payment matching ``condition`` in one transaction
+
+        The status check and the credit happen together, so a payment can
+        only ever be credited once; payments reviewed in the meantime are
+        skipped. Each user's balance is updated once, however many of their
+        payments are in the batch.
+        """
+        def write(cursor):
+            cursor.execute(f'''
+                UPDATE payments SET status = 'approved', admin_id = ? 
+                WHERE {condition} AND status = 'pending' 
+                RETURNING id, user_id, amount
+            ''', [admin_id, *params])
+            approved = [ReviewedPayment(*row) for row in cursor.fetchall()]
+            
+            credits: Dict[int, float] = {}
+            for payment in approved:
+                credits[payment.user_id] = credits.get(payment.user_id, 0.0) + payment.amount
+                self._append_ledger(cursor, payment.user_id, payment.amount, LedgerEntry.DEPOSIT,
+                                    ref_id=payment.id, actor_id=admin_id)
+            cursor.executemany('UPDATE users SET balance = balance + ? WHERE user_id = ?',
+                               [(amount, user_id) for user_id, amount in credits.items()])
+            return approved
+        
+        approved = self._write(write)
+        for user_id in {payment.user_id for payment in approved}:
+            self.users.discard(user_id)
+        return approved
+
+    def decline_payments(self, payment_ids: List[int], admin_id: int) -> List[ReviewedPayment]:
+        """Decline the given payments that are still pending, in one transaction"""
+        if not payment_ids:
+            return []
+        placeholders = ','.join('?' * len(payment_ids))
+        
+        def write(cursor):
+            cursor.execute(f'''
+                UPDATE payments SET status = 'declined', admin_id = ? 
+                WHERE id IN ({placeholders}) AND status = 'pending' 
+                RETURNING id, user_id, amount, utr_normalized
+            ''', [admin_id, *payment_ids])
+            return cursor.fetchall()
+        
+        declined = self._write(write)
+        for _, _, _, utr_key in declined:
+            if utr_key:
+                self.recent_utrs.discard(utr_key)
+        return [ReviewedPayment(payment_id, user_id, amount) for payment_id, user_id, amount, _ in declined]
+
+    def create_payment_request(self, user_id: int, amount: float, utr: str) -> Optional[int]:
+        """Queue a deposit for review; returns the payment id, or None if the UTR was already submitted
+
+        Repeats are usually caught by the in-memory set before any database
+        work; the unique index on utr_normalized settles the rest, including
+        submissions from other processes.
+        """
+        utr_key = normalise_utr(utr)
+        if not utr_key:
+            raise ValueError(f"Not a UTR: {utr!r}")
+        self._load_recent_utrs()
+        if utr_key in self.recent_utrs:
+            return None
+        
+        def write(cursor):
+            cursor.execute('''
+                INSERT OR IGNORE INTO payments (user_id, amount, utr, utr_normalized) 
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, amount, utr, utr_key))
+            return cursor.lastrowid if cursor.rowcount == 1 else None
+        
+        payment_id = self._write(write)
+        if payment_id is not None:
+            self.recent_utrs.add(utr_key)
+        return payment_id
+
+    def _load_recent_utrs(self):
+        if self.recent_utrs.loaded:
+            return
+        with self.pool.connection() as conn:
+            rows = conn.execute('''
+                SELECT utr_normalized FROM payments 
+                WHERE status != 'declined' AND utr_normalized IS NOT NULL 
+                ORDER BY id DESC LIMIT ?
+            ''', (self.recent_utrs.maxsize,)).fetchall()
+        # Oldest first, so the most recent end up most recently used
+        for (utr_key,) in reversed(rows):
+            self.recent_utrs.add(utr_key)
+        self.recent_utrs.loaded = True
+
+    # ========== LEDGER ==========
+    def _append_ledger(self, cursor: sqlite3.Cursor, user_id: int, amount: float, kind: str,
+                       ref_id: Optional[int] = None, actor_id: Optional[int] = None):
+        """Record a balance change; always called in the transaction that makes it"""
+        cursor.execute('''
+            INSERT INTO ledger (user_id, amount, kind, ref_id, actor_id, created_at) 
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (user_id, amount, kind, ref_id, actor_id, time.time()))
+
+    def get_ledger(self, user_id: int, limit: int = 20, before_id: Optional[int] = None) -> List[LedgerEntry]:
+        """A user's ledger entries, newest first; a single range scan of idx_ledger_user_id"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, user_id, amount, kind, ref_id, actor_id, created_at FROM ledger 
+                WHERE user_id = ? AND id < ? 
+                ORDER BY id DESC LIMIT ?
+            ''', (user_id, before_id if before_id is not None else 2 ** 63 - 1, limit))
+            rows = cursor.fetchall()
+        return [LedgerEntry(*row) for row in rows]
+
+    def checkpoint_ledger(self, batch_size: int = config.LEDGER_CHECKPOINT_BATCH) -> LedgerCheckpoint:
+        """Fold new ledger entries into ledger_balances and repair balances that disagree
+
+        Entries are consumed in id order, ``batch_size`` per transaction, so
+        each run only reads what was appended since the last one. Once caught
+        up, the users touched by this run are compared with their ledger sum
+        (in the same transaction, so nothing can land in between) and
+        users.balance is reset to the ledger's figure where they differ.
+        """
+        touched = set()
+        
+        def write(cursor):
+            cursor.execute('SELECT last_entry_id FROM ledger_checkpoint WHERE id = 1')
+            last_entry_id = cursor.fetchone()[0]
+            cursor.execute('SELECT id, user_id, amount FROM ledger WHERE id > ? ORDER BY id LIMIT ?',
+                           (last_entry_id, batch_size))
+            entries = cursor.fetchall()
+            sums: Dict[int, float] = {}
+            for _, user_id, amount in entries:
+                sums[user_id] = sums.get(user_id, 0.0) + amount
+            cursor.executemany('''
+                INSERT INTO ledger_balances (user_id, balance) VALUES (?, ?) 
+                ON CONFLICT (user_id) DO UPDATE SET balance = balance + excluded.balance
+            ''', list(sums.items()))
+            if entries:
+                cursor.execute('UPDATE ledger_checkpoint SET last_entry_id = ? WHERE id = 1', (entries[-1][0],))
+            touched.update(sums)
+            if len(entries) == batch_size or not touched:
+                return len(entries), []
+            
+            placeholders = ','.join('?' * len(touched))
+            cursor.execute(f'''
+                SELECT u.user_id, u.balance, l.balance FROM users u JOIN ledger_balances l USING (user_id) 
+                WHERE u.user_id IN ({placeholders}) AND ABS(u.balance - l.balance) > 0.005
+            ''', list(touched))
+            drifted = cursor.fetchall()
+            cursor.executemany('UPDATE users SET balance = ? WHERE user_id = ?',
+                               [(ledger_balance, user_id) for user_id, _, ledger_balance in drifted])
+            return len(entries), drifted
+        
+        total = 0
+        while True:
+            entries, drifted = self._write(write)
+            total += entries
+            if entries < batch_size:
+                break
+        
+        for user_id, balance, ledger_balance in drifted:
+            logger.warning(f"Balance of user {user_id} was {balance}, ledger says {ledger_balance}; repaired")
+            self.users.discard(user_id)
+        return LedgerCheckpoint(total, [user_id for user_id, _, _ in drifted])
+
+    # ========== PROCESSED UPDATES ==========
+    def mark_update_processed(self, key: str) -> bool:
+        """Record an update/callback id; False if it was recorded before"""
+        def write(cursor):
+            cursor.execute('INSERT OR IGNORE INTO processed_updates (key, seen_at) VALUES (?, ?)',
+                           (key, time.time()))
+            return cursor.rowcount == 1
+        return self._write(write)
+
+    def prune_processed_updates(self, max_age: float) -> int:
+        def write(cursor):
+            cursor.execute('DELETE FROM processed_updates WHERE seen_at < ?', (time.time() - max_age,))
+            return cursor.rowcount
+        return self._write(write)
+
+    # ========== BROADCASTS ==========
+    def create_broadcast(self, text: str, created_by: int, chat_id: int, total: int) -> int:
+        def write(cursor):
+            cursor.execute('''
+                INSERT INTO broadcasts (text, created_by, chat_id, total) 
+                VALUES (?, ?, ?, ?)
+            ''', (text, created_by, chat_id, total))
+            return cursor.lastrowid
+        return self._write(write)
+
+    def set_broadcast_message(self, broadcast_id: int, message_id: int):
+        """Remember the progress message so it can be edited as the broadcast advances"""
+        self._write(lambda cursor: cursor.execute('UPDATE broadcasts SET message_id = ? WHERE id = ?',
+                                                  (message_id, broadcast_id)))
+
+    def get_broadcast(self, broadcast_id: int) -> Optional[Broadcast]:
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, text, created_by, chat_id, message_id, status, last_user_id, sent, failed, total 
+                FROM broadcasts WHERE id = ?
+            ''', (broadcast_id,))
+            row = cursor.fetchone()
+        return Broadcast(*row) if row else None
+
+    def get_running_broadcasts(self) -> List[Broadcast]:
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, text, created_by, chat_id, message_id, status, last_user_id, sent, failed, total 
+                FROM broadcasts WHERE status = 'running' ORDER BY id
+            ''')
+            rows = cursor.fetchall()
+        return [Broadcast(*row) for row in rows]
+
+    def update_broadcast_progress(self, broadcast_id: int, last_user_id: int, sent: int, failed: int):
+        """Checkpoint: every user up to ``last_user_id`` has been handled"""
+        self._write(lambda cursor: cursor.execute('''
+            UPDATE broadcasts SET last_user_id = ?, sent = ?, failed = ? 
+            WHERE id = ?
+        ''', (last_user_id, sent, failed, broadcast_id)))
+
+    def finish_broadcast(self, broadcast_id: int):
+        self._write(lambda cursor: cursor.execute('''
+            UPDATE broadcasts SET status = 'done', finished_at = CURRENT_TIMESTAMP 
+            WHERE id = ?
+        ''', (broadcast_id,)))
+
 # Initialize database instance
 db = Database()
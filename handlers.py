@@ -0,0 +1,1128 @@
+"""Bot logic shared by the threaded (bot.py) and asyncio (async_bot.py) runtimes
+
+Every screen's text and keyboard, the database work behind each button and
+command, permissions and callback routing live here. Handlers are plain
+blocking functions: they take the update and return a Reply describing
+what to show. The runtimes only talk to the Bot API: bot.py carries out a
+Reply through the Outbox, async_bot.py runs handlers on its database
+executor and awaits the edits and answers itself. Messages to other users
+(Notice) always go through the Outbox.
+"""
+import datetime
+import functools
+import logging
+from typing import NamedTuple, Optional, Tuple
+
+import config
+from database import db, normalise_utr, PurchaseResult
+from keyboards import *
+from router import CallbackRouter, PUBLIC, ADMIN, OWNER
+from account_import import import_accounts
+from idempotency import KeyedLocks, SeenKeys
+
+logger = logging.getLogger(__name__)
+
+
+class Notice(NamedTuple):
+    """A message to some chat other than the one the update came from"""
+    chat_id: int
+    text: str
+    reply_markup: object = None
+    parse_mode: Optional[str] = None
+
+
+class Reply(NamedTuple):
+    """What a handler wants shown
+
+    ``text`` replaces the tapped message (buttons) or is sent as a reply
+    (messages); ``alert`` answers the button press, '' answers it silently.
+    """
+    text: Optional[str] = None
+    reply_markup: object = None
+    parse_mode: Optional[str] = None
+    alert: Optional[str] = None
+    show_alert: bool = False
+    notices: Tuple[Notice, ...] = ()
+
+
+# Repeated taps of the same mutating button shortly after each other are ignored (see debounced)
+recent_taps = SeenKeys(ttl=config.DEDUP_TAP_WINDOW)
+
+# Mutating handlers hold the lock of the payment/order/user they change
+entity_locks = KeyedLocks()
+
+# Store temporary data
+user_states = {}
+payment_selections = {}  # admin id -> ids of the payments ticked in the review list
+
+# Created by the runtime and handed over with setup() before updates arrive
+otp_delivery = None
+broadcaster = None
+
+def setup(delivery_pool, broadcast_engine):
+    global otp_delivery, broadcaster
+    otp_delivery = delivery_pool
+    broadcaster = broadcast_engine
+
+# Authentication functions
+def is_owner(user_id: int) -> bool:
+    return user_id == config.OWNER_ID
+
+def is_admin(user_id: int) -> bool:
+    # Served from the database's in-memory role cache
+    return is_owner(user_id) or db.is_admin(user_id)
+
+def debounced(handler):
+    """Answer a repeat of the same tap within DEDUP_TAP_WINDOW instead of running the handler again
+
+    Only for handlers that change state; menus and pages stay responsive to
+    every tap.
+    """
+    @functools.wraps(handler)
+    def wrapper(call):
+        message_key = call.message.message_id if call.message else call.inline_message_id
+        if not recent_taps.first_seen((call.from_user.id, message_key, call.data)):
+            return Reply(alert="⏳ Already processing...")
+        return handler(call)
+    return wrapper
+
+def locked(kind: str):
+    """Run a callback handler holding the lock of the entity whose id ends call.data"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(call):
+            with entity_locks.hold((kind, call.data.split('_')[-1])):
+                return handler(call)
+        return wrapper
+    return decorator
+
+# ========== OTP DELIVERY SYSTEM ==========
+def otp_code_text(phone_number: str, otp_code: str, price) -> str:
+    return f"""
+🔑 *Your OTP Code*
+
+📞 Phone Number: `{phone_number}`
+🔑 OTP Code: `{otp_code}`
+💰 Amount Paid: ₹{price}
+
+💡 *Instructions:*
+1. Open Telegram/WhatsApp
+2. Enter phone number: `{phone_number}`
+3. Enter OTP code: `{otp_code}`
+4. Complete verification
+
+✅ Account will be marked as sold after successful login.
+        """
+
+def otp_code_reply(delivery) -> Reply:
+    """The buyer's purchase message once their OTP has arrived"""
+    return Reply(otp_code_text(delivery.phone_number, delivery.otp_code, delivery.price),
+                 otp_received_menu(delivery.order_id), 'Markdown')
+
+def otp_shown(delivery):
+    # The OTP has been shown, same as pressing 'View OTP'
+    db.complete_otp_order(delivery.order_id)
+
+def otp_ready_notice(delivery) -> Notice:
+    """For orders from before message tracking, or a message we can no longer edit"""
+    notification_text = f"""
+🔔 *OTP Ready!*
+
+📞 Phone Number: `{delivery.phone_number}`
+⏰ OTP has arrived and is ready to view.
+
+Click 'View OTP' button to see your OTP code.
+        """
+    return Notice(delivery.user_id, notification_text, otp_actions_menu(delivery.order_id), 'Markdown')
+
+def otp_failed_reply(order) -> Reply:
+    """The buyer's purchase message once delivery was given up and the order refunded"""
+    failed_text = f"""
+⌛ *No OTP Received*
+
+📞 Phone Number: `{order.phone_number}`
+💰 Refund Amount: ₹{order.price}
+✅ Amount refunded to your wallet.
+
+You can try purchasing another account.
+        """
+    refund_msg = f"💰 No OTP arrived for `{order.phone_number}`, so ₹{order.price} was refunded to your balance."
+    return Reply(failed_text, back_to_main(), 'Markdown',
+                 notices=(Notice(order.user_id, refund_msg, parse_mode='Markdown'),))
+
+# ========== PURCHASE SYSTEM ==========
+@debounced
+def handle_purchase(call):
+    prices = {
+        "buy_telegram_otp": config.TELEGRAM_OTP_PRICE,
+        "buy_whatsapp_otp": config.WHATSAPP_OTP_PRICE,
+        "buy_telegram_session": config.SESSION_PRICE,
+        "buy_whatsapp_session": config.SESSION_PRICE
+    }
+
+    user_id = call.from_user.id
+    price = prices.get(call.data, 0)
+    account_type = "telegram" if "telegram" in call.data else "whatsapp"
+
+    # Balance check, number reservation, debit, order and delivery job in one transaction
+    delay = config.OTP_POLL_INITIAL_DELAY
+    with entity_locks.hold(('user', user_id)):
+        result = db.purchase_otp(user_id, account_type, price, otp_delay=delay,
+                                 chat_id=call.message.chat.id, message_id=call.message.message_id)
+
+    if result.status == PurchaseResult.USER_NOT_FOUND:
+        return Reply(alert="❌ User not found! Send /start")
+    if result.status == PurchaseResult.BLOCKED:
+        return Reply(alert="❌ Account blocked!")
+    if result.status == PurchaseResult.INSUFFICIENT_BALANCE:
+        return Reply(alert=f"❌ Need ₹{price}")
+    if result.status == PurchaseResult.OUT_OF_STOCK:
+        return Reply(alert="❌ No accounts available!")
+
+    order_id, phone_number = result.order_id, result.phone_number
+
+    # Wake the delivery pool when the job is due for its first provider poll
+    otp_delivery.submit(order_id, delay)
+
+    # Show purchase confirmation with OTP buttons
+    purchase_text = f"""
+✅ *Purchase Successful!*
+
+📞 Phone Number: `{phone_number}`
+💰 Amount Paid: ₹{price}
+🆔 Order ID: `{order_id}`
+
+⏳ *OTP Status:* Waiting for OTP...
+This may take {config.OTP_DELIVERY_MIN_TIME}-{config.OTP_DELIVERY_MAX_TIME} seconds.
+This message updates automatically when it arrives.
+
+Use the buttons below to manage your purchase:
+    """
+    return Reply(purchase_text, otp_actions_menu(order_id), 'Markdown')
+
+# ========== OTP VIEWING & CANCELLATION ==========
+@locked('order')
+def view_otp(call):
+    """Show OTP to user"""
+    order_id = int(call.data.split('_')[-1])
+    order = db.get_order(order_id)
+
+    if not order:
+        return Reply(alert="❌ Order not found!")
+
+    order_id, user_id, account_type, phone_number, otp_code, status, price, purchased_at, completed_at, refund = order
+
+    if status == 'otp_ready' and otp_code:
+        # Mark order as completed; a no-op if the pushed OTP already did
+        db.complete_otp_order(order_id)
+        return Reply(otp_code_text(phone_number, otp_code, price), otp_received_menu(order_id), 'Markdown')
+    if status == 'pending':
+        # OTP not arrived yet
+        return Reply(alert="⏳ OTP not arrived yet. Please wait...", show_alert=True)
+    return Reply(alert="❌ No OTP available!")
+
+@locked('order')
+def refresh_otp_status(call):
+    """Refresh an OTP purchase message; normally the delivery already updated it"""
+    order_id = int(call.data.split('_')[-1])
+    order = db.get_order(order_id)
+
+    if not order:
+        return Reply(alert="❌ Order not found!")
+
+    status = order[5]
+    if status == 'otp_ready':
+        return view_otp(call)
+    if status == 'pending':
+        return Reply(alert="⏳ Still waiting for OTP. This message updates automatically.")
+    if status == 'completed':
+        return Reply(alert="✅ OTP already delivered!")
+    return Reply(alert="❌ Order cancelled!")
+
+@debounced
+@locked('order')
+def cancel_otp_purchase(call):
+    """Cancel OTP purchase and refund"""
+    order_id = int(call.data.split('_')[-1])
+    order = db.get_order(order_id)
+
+    if not order:
+        return Reply(alert="❌ Order not found!")
+
+    order_id, user_id, account_type, phone_number, otp_code, status, price, purchased_at, completed_at, refund = order
+
+    if status == 'otp_ready':
+        # OTP already arrived, cannot cancel
+        return Reply(alert="❌ Cannot cancel! OTP has already arrived.", show_alert=True)
+    if status == 'completed':
+        return Reply(alert="❌ Cannot cancel! Order already completed.", show_alert=True)
+
+    # Stop the pending delivery before refunding
+    otp_delivery.cancel(order_id, phone_number)
+
+    # Cancel, refund and release the number in one transaction
+    if not db.cancel_otp_order(order_id):
+        return Reply(alert="❌ Failed to cancel order!")
+
+    cancel_text = f"""
+❌ *Purchase Cancelled*
+
+📞 Phone Number: `{phone_number}`
+💰 Refund Amount: ₹{price}
+✅ Amount refunded to your wallet.
+
+You can try purchasing another account.
+        """
+    # Notify user about refund
+    refund_msg = f"💰 Refund of ₹{price} has been added to your balance."
+    return Reply(cancel_text, back_to_main(), 'Markdown',
+                 notices=(Notice(user_id, refund_msg, parse_mode='Markdown'),))
+
+@locked('order')
+def confirm_otp_received(call):
+    """Confirm OTP received and mark as completed"""
+    order_id = int(call.data.split('_')[-1])
+    if not db.get_order(order_id):
+        return Reply()
+    return Reply("✅ *OTP Confirmed*\n\nThank you for confirming! Your account is now active.",
+                 back_to_main(), 'Markdown', alert="✅ OTP confirmed! Thank you.")
+
+# ========== ORDER HISTORY ==========
+def view_user_orders(call):
+    user_id = call.from_user.id
+    orders = db.get_user_orders(user_id)
+    active_orders = db.get_user_active_orders(user_id)
+
+    if not orders and not active_orders:
+        return Reply("📭 No orders yet!", back_to_main())
+
+    orders_text = "📋 *Your Orders*\n\n"
+
+    # Show active orders first
+    if active_orders:
+        orders_text += "🟡 *Active Orders:*\n"
+        for order in active_orders[:3]:
+            order_id, user_id, account_type, phone_number, otp_code, status, price, purchased_at, completed_at, refund = order
+            status_emoji = {'pending': '⏳', 'otp_ready': '🔔'}.get(status, '❓')
+            orders_text += f"{status_emoji} {account_type} - ₹{price} - {status}\n"
+        orders_text += "\n"
+
+    # Show completed orders
+    if orders:
+        orders_text += "✅ *Completed Orders:*\n"
+        for order in orders[:5]:
+            order_id, user_id, account_type, phone_number, otp_code, status, price, purchased_at, completed_at, refund = order
+            if status in ['completed', 'cancelled']:
+                status_emoji = '✅' if status == 'completed' else '❌'
+                refund_text = f" (Refund: ₹{refund})" if refund > 0 else ""
+                orders_text += f"{status_emoji} {account_type} - ₹{price}{refund_text}\n"
+
+    return Reply(orders_text, back_to_main(), 'Markdown')
+
+# ========== COMMAND HANDLERS ==========
+def start(message):
+    user_id = message.from_user.id
+    username = message.from_user.username or "Unknown"
+
+    db.create_user(user_id, username)
+
+    accounts_count = db.get_available_accounts_count()
+    telegram_count = accounts_count.get('telegram', 0)
+    whatsapp_count = accounts_count.get('whatsapp', 0)
+
+    welcome_message = f"""
+🌟 *Welcome to Account Store Bot!* 🌟
+
+📊 *Available Accounts:*
+📲 Telegram Accounts: {telegram_count}
+💚 WhatsApp Accounts: {whatsapp_count}
+
+💎 *Features:*
+• Buy OTP for Telegram & WhatsApp
+• Purchase ready sessions
+• Instant delivery
+• 24/7 support
+
+Use the buttons below to get started! 🚀
+    """
+    return Reply(welcome_message, main_menu(), 'Markdown')
+
+def help_command(message):
+    help_text = """
+🆘 *Help Menu* 🆘
+
+*Commands:*
+/start - Start bot
+/help - Show help
+/stats - Your statistics
+/balance - Check balance
+
+*Features:*
+📱 Buy OTP - Purchase OTP for accounts
+💳 Buy Session - Buy ready sessions
+💰 Deposit - Add funds to wallet
+
+*Minimum Deposit:* ₹50
+    """
+    return Reply(help_text, parse_mode='Markdown')
+
+def stats_command(message):
+    user = db.get_user(message.from_user.id)
+    if not user:
+        return Reply("❌ User not found!")
+
+    stats_text = f"""
+📊 *Your Statistics*
+
+👤 User ID: `{user.user_id}`
+💰 Balance: ₹{user.balance}
+💳 Total Spent: ₹{user.total_spent}
+📱 Accounts Bought: {user.accounts_bought}
+        """
+    return Reply(stats_text, parse_mode='Markdown')
+
+def balance_command(message):
+    user = db.get_user(message.from_user.id)
+    if not user:
+        return Reply("❌ User not found!")
+    return Reply(f"💳 *Your Balance:* ₹{user.balance}", parse_mode='Markdown')
+
+def ledger_command(message):
+    if not is_admin(message.from_user.id):
+        return Reply()
+    parts = message.text.split()
+    if len(parts) != 2 or not parts[1].isdigit():
+        return Reply("Usage: /ledger <user_id>")
+    user_id = int(parts[1])
+    entries = db.get_ledger(user_id)
+    if not entries:
+        return Reply(f"📜 No balance changes recorded for {user_id}.")
+    return Reply(format_ledger(user_id, entries), parse_mode='Markdown')
+
+def route_stats_command(message):
+    if not is_owner(message.from_user.id):
+        return Reply()
+    hits = callback_router.hit_counts()
+    if not hits:
+        return Reply("📈 No callbacks handled yet.")
+    stats_text = "📈 *Callback Route Hits*\n\n"
+    for pattern, count in list(hits.items())[:25]:
+        stats_text += f"`{pattern}`: {count}\n"
+    return Reply(stats_text, parse_mode='Markdown')
+
+# ========== MENU FUNCTIONS ==========
+def show_main_menu(call):
+    accounts_count = db.get_available_accounts_count()
+    telegram_count = accounts_count.get('telegram', 0)
+    whatsapp_count = accounts_count.get('whatsapp', 0)
+
+    menu_text = f"""
+🏠 *Main Menu*
+
+📊 *Available Accounts:*
+📲 Telegram: {telegram_count}
+💚 WhatsApp: {whatsapp_count}
+    """
+    return Reply(menu_text, main_menu(), 'Markdown')
+
+def show_otp_menu(call):
+    menu_text = """
+📱 *Buy OTP*
+
+• Telegram OTP - ₹10
+• WhatsApp OTP - ₹15
+    """
+    return Reply(menu_text, buy_otp_menu(), 'Markdown')
+
+def show_session_menu(call):
+    menu_text = """
+💳 *Buy Session*
+
+• Telegram Session - ₹25
+• WhatsApp Session - ₹25
+    """
+    return Reply(menu_text, buy_session_menu(), 'Markdown')
+
+def show_deposit_menu(call):
+    menu_text = f"""
+💰 *Deposit Funds*
+
+💳 *Minimum Deposit:* ₹{config.MIN_DEPOSIT}
+    """
+    return Reply(menu_text, deposit_menu(), 'Markdown')
+
+def show_user_stats(call):
+    user = db.get_user(call.from_user.id)
+    if not user:
+        return Reply()
+
+    stats_text = f"""
+📊 *Your Statistics*
+
+👤 User ID: `{user.user_id}`
+💰 Balance: ₹{user.balance}
+📱 Accounts Bought: {user.accounts_bought}
+        """
+    return Reply(stats_text, back_to_main(), 'Markdown')
+
+def show_qr_code(call):
+    qr_text = f"""
+📱 *Payment QR Code*
+
+{config.OWNER_QR_CODE}
+
+*After payment, send UTR number to admin.*
+    """
+    return Reply(qr_text, back_to_main(), 'Markdown')
+
+def show_owner_panel(call):
+    return Reply("👑 *Owner Panel*", owner_panel(), 'Markdown')
+
+# ========== ADMIN MANAGEMENT FUNCTIONS ==========
+def show_manage_admins(call):
+    return Reply("🛡️ *Admin Management*", manage_admins_menu(), 'Markdown')
+
+def start_add_admin(call):
+    user_states[call.from_user.id] = 'awaiting_admin_id'
+    return Reply("👥 *Add New Admin*\n\nSend the user ID you want to make admin:", back_to_main(), 'Markdown')
+
+def show_admin_list(call):
+    admins = db.get_all_admins()
+    if not admins:
+        return Reply("📝 No admins found.", manage_admins_menu())
+
+    admin_text = "🛡️ *Current Admins*\n\n"
+    for admin in admins:
+        user_id, username, is_admin = admin
+        status = "👑 Owner" if user_id == config.OWNER_ID else "🛡️ Admin"
+        name = f"@{username}" if username else f"User {user_id}"
+        admin_text += f"• {name} (`{user_id}`) - {status}\n"
+
+    return Reply(admin_text, admin_list_menu(admins), 'Markdown')
+
+@debounced
+def remove_admin(call):
+    admin_id = int(call.data.split('_')[-1])
+    if admin_id == config.OWNER_ID:
+        return Reply(alert="❌ Cannot remove owner!")
+
+    db.remove_admin(admin_id)
+    return show_admin_list(call)._replace(alert="✅ Admin removed!")
+
+# ========== ACCOUNT MANAGEMENT FUNCTIONS ==========
+def show_account_management(call):
+    accounts_count = db.get_available_accounts_count()
+    menu_text = f"""
+📱 *Account Management*
+
+📊 *Current Inventory:*
+📲 Telegram: {accounts_count.get('telegram', 0)}
+💚 WhatsApp: {accounts_count.get('whatsapp', 0)}
+    """
+    return Reply(menu_text, owner_account_management(), 'Markdown')
+
+def start_add_accounts(call):
+    account_type = "telegram" if "telegram" in call.data else "whatsapp"
+    user_states[call.from_user.id] = f'adding_{account_type}_accounts'
+
+    instruction_text = f"""
+📝 *Adding {account_type.title()} Accounts*
+
+Send accounts in format:
+`phone_number` or `phone_number:otp`
+
+Examples:
+`+1234567890`
+`+1234567891:123456`
+
+For large batches, upload a .txt or .csv file with one account per line.
+
+Send /cancel to stop.
+    """
+    return Reply(instruction_text, parse_mode='Markdown')
+
+def show_all_accounts(call):
+    inventory = db.get_inventory_counts()
+    telegram = inventory.get('telegram', {})
+    whatsapp = inventory.get('whatsapp', {})
+    menu_text = f"""
+📊 *Account Statistics*
+
+📲 Telegram Available: {telegram.get('available', 0)}
+💚 WhatsApp Available: {whatsapp.get('available', 0)}
+🔄 In Use: {telegram.get('in_use', 0)} Telegram / {whatsapp.get('in_use', 0)} WhatsApp
+✅ Sold: {telegram.get('sold', 0)} Telegram / {whatsapp.get('sold', 0)} WhatsApp
+⏳ Pending OTP Deliveries: {otp_delivery.queue_depth()}
+    """
+    return Reply(menu_text, owner_account_management(), 'Markdown')
+
+# ========== ACCOUNT IMPORT ==========
+# Replies for an account file the runtime could not fetch
+FILE_TOO_LARGE = Reply("❌ File is too large!")
+DOWNLOAD_FAILED = Reply("❌ Could not download the file, please send it again.")
+
+def import_target(message) -> Optional[str]:
+    """Account type the owner is currently importing, or None"""
+    state = user_states.get(message.from_user.id, '')
+    if not state.startswith('adding_') or not is_owner(message.from_user.id):
+        return None
+    return state.replace('adding_', '').replace('_accounts', '')
+
+def finish_account_import(message, account_type, lines):
+    price = config.TELEGRAM_OTP_PRICE if account_type == "telegram" else config.WHATSAPP_OTP_PRICE
+    result = import_accounts(db, account_type, lines, price)
+    user_states.pop(message.from_user.id, None)
+    return Reply(result.summary(account_type), owner_account_management())
+
+# ========== USER MANAGEMENT FUNCTIONS ==========
+def show_manage_users(call):
+    return Reply("👥 *User Management*", manage_users_menu(), 'Markdown')
+
+def format_ledger(user_id, entries):
+    ledger_text = f"📜 *Ledger for* `{user_id}`\n\n"
+    for entry in entries:
+        when = datetime.datetime.fromtimestamp(entry.created_at).strftime('%Y-%m-%d %H:%M')
+        ref = f" #{entry.ref_id}" if entry.ref_id else ""
+        ledger_text += f"`{when}` {entry.kind}{ref}: ₹{entry.amount:+g}\n"
+    return ledger_text
+
+def format_user_list(title, users):
+    users_text = f"{title}\n\n"
+    for user in users:
+        user_id, username, balance, is_blocked, is_admin, joined_date = user
+        status = "🚫" if is_blocked else "✅"
+        admin_badge = " 🛡️" if is_admin else ""
+        name = f"@{username}" if username else f"User {user_id}"
+        users_text += f"{status} {name}{admin_badge} - ₹{balance}\n"
+    return users_text
+
+def show_users_page(call, after_user_id=0, before_user_id=None):
+    """One keyset page of users; fetches a single extra row to know whether more follow"""
+    page_size = config.USERS_PAGE_SIZE
+    if before_user_id is not None:
+        users = db.get_users_page(limit=page_size + 1, before_user_id=before_user_id)
+        has_prev, has_next = len(users) > page_size, True
+        users = users[-page_size:]
+    else:
+        users = db.get_users_page(after_user_id, page_size + 1)
+        has_prev, has_next = after_user_id > 0, len(users) > page_size
+        users = users[:page_size]
+
+    if not users:
+        if before_user_id is not None or after_user_id:
+            # The neighbouring users were deleted; start over from the top
+            return show_users_page(call)
+        return Reply("📝 No users found.", manage_users_menu())
+
+    markup = all_users_menu(users,
+                            prev_cursor=users[0][0] if has_prev else None,
+                            next_cursor=users[-1][0] if has_next else None)
+    return Reply(format_user_list("👥 *All Users*", users), markup, 'Markdown')
+
+def show_all_users(call):
+    return show_users_page(call)
+
+def page_users(call):
+    direction, cursor = call.data.split('_')[1:3]
+    if direction == 'prev':
+        return show_users_page(call, before_user_id=int(cursor))
+    return show_users_page(call, after_user_id=int(cursor))
+
+def start_user_search(call):
+    user_states[call.from_user.id] = 'awaiting_user_search'
+    return Reply("🔍 *Search Users*\n\nSend the start of a username (e.g. `@john`):",
+                 manage_users_menu(), 'Markdown')
+
+def show_user_details(call):
+    user_id = int(call.data.split('_')[-1])
+    user = db.get_user(user_id)
+
+    if not user:
+        return Reply(alert="❌ User not found!")
+
+    status = "🚫 Blocked" if user.is_blocked else "✅ Active"
+    role = "🛡️ Admin" if user.is_admin else "👤 User"
+
+    user_text = f"""
+👤 *User Details*
+
+🆔 User ID: `{user_id}`
+👤 Username: @{user.username if user.username else 'N/A'}
+💰 Balance: ₹{user.balance}
+💳 Total Spent: ₹{user.total_spent}
+📱 Accounts Bought: {user.accounts_bought}
+📊 Status: {status}
+🎯 Role: {role}
+📅 Joined: {user.joined_date}
+    """
+    return Reply(user_text, user_actions_menu(user_id), 'Markdown')
+
+@debounced
+def handle_balance_action(call):
+    data = call.data
+    parts = data.split('_')
+    action = parts[0]  # add or deduct
+    target_user_id = int(parts[2])
+    amount = int(parts[3])
+
+    with entity_locks.hold(('user', target_user_id)):
+        target_user = db.get_user(target_user_id)
+        if not target_user:
+            return Reply(alert="❌ User not found!")
+
+        if action == "add":
+            db.update_balance(target_user_id, amount, admin_id=call.from_user.id)
+            action_text = "added to"
+            emoji = "➕"
+        else:  # deduct
+            if target_user.balance < amount:
+                return Reply(alert="❌ User has insufficient balance!", show_alert=True)
+            db.update_balance(target_user_id, -amount, admin_id=call.from_user.id)
+            action_text = "deducted from"
+            emoji = "➖"
+
+    result_text = f"""
+{emoji} *Balance Updated*
+
+💰 Amount: ₹{amount} {action_text} user
+👤 User: {target_user.username or f'User {target_user_id}'}
+✅ Operation successful
+    """
+    # Notify user
+    user_msg = f"💳 Your balance was updated by admin: {emoji} ₹{amount}"
+    return Reply(result_text, parse_mode='Markdown',
+                 notices=(Notice(target_user_id, user_msg, parse_mode='Markdown'),))
+
+@debounced
+def block_user(call):
+    db.block_user(int(call.data.split('_')[-1]))
+    return show_user_details(call)._replace(alert="✅ User blocked!")
+
+@debounced
+def unblock_user(call):
+    db.unblock_user(int(call.data.split('_')[-1]))
+    return show_user_details(call)._replace(alert="✅ User unblocked!")
+
+# ========== BROADCAST FUNCTION ==========
+def start_broadcast(call):
+    user_states[call.from_user.id] = 'awaiting_broadcast'
+    return Reply("📢 *Broadcast Message*\n\nSend the message you want to broadcast to all users:",
+                 back_to_main(), 'Markdown')
+
+# ========== PAYMENT APPROVAL SYSTEM ==========
+def payment_approved_text(amount):
+    return f"""
+✅ *Payment Approved!*
+
+Your payment of ₹{amount} has been approved and added to your balance.
+
+Thank you for your payment! 🎉
+"""
+
+def payment_declined_text(amount):
+    return f"""
+❌ *Payment Declined*
+
+Your payment of ₹{amount} has been declined.
+
+Please contact admin if you believe this is a mistake.
+"""
+
+def payment_notices(payments, approved):
+    """One message per user, with the total of all their payments in the batch"""
+    totals = {}
+    for payment in payments:
+        totals[payment.user_id] = totals.get(payment.user_id, 0) + payment.amount
+    text = payment_approved_text if approved else payment_declined_text
+    return tuple(Notice(user_id, text(total), parse_mode='Markdown') for user_id, total in totals.items())
+
+def show_pending_payments(call, notice=None):
+    pending_payments = db.get_pending_payments(limit=config.PAYMENTS_PAGE_SIZE)
+    header = f"{notice}\n\n" if notice else ""
+
+    if not pending_payments:
+        return Reply(header + "⏳ *No Pending Payments*", back_to_main(), 'Markdown')
+
+    pending_count, pending_total = db.summarise_pending_payments()
+    payments_text = header + f"⏳ *Pending Payment Requests* ({pending_count}, ₹{pending_total:g} in all)\n\n"
+
+    for payment in pending_payments:
+        payment_id, user_id, amount, utr, status, admin_id, created_at, username = payment
+        user_display = f"@{username}" if username else f"User {user_id}"
+        payments_text += f"💰 *Payment #{payment_id}*\n"
+        payments_text += f"👤 {user_display}\n"
+        payments_text += f"💳 Amount: ₹{amount}\n"
+        payments_text += f"🔢 UTR: `{utr}`\n\n"
+
+    selected = frozenset(payment_selections.get(call.from_user.id, ()))
+    return Reply(payments_text, pending_payments_menu(pending_payments, selected), 'Markdown')
+
+@debounced
+def toggle_payment_selection(call):
+    payment_id = int(call.data.split('_')[-1])
+    selected = payment_selections.setdefault(call.from_user.id, set())
+    selected ^= {payment_id}
+    return show_pending_payments(call)
+
+def select_all_payments(call):
+    pending_payments = db.get_pending_payments(limit=config.PAYMENTS_PAGE_SIZE)
+    payment_selections[call.from_user.id] = {payment[0] for payment in pending_payments}
+    return show_pending_payments(call)
+
+def clear_payment_selection(call):
+    payment_selections.pop(call.from_user.id, None)
+    return show_pending_payments(call)
+
+@debounced
+def approve_selected_payments(call):
+    selected = payment_selections.pop(call.from_user.id, None)
+    if not selected:
+        return Reply(alert="❌ No payments selected!")
+    approved = db.approve_payments(sorted(selected), call.from_user.id)
+    total = sum(payment.amount for payment in approved)
+    reply = show_pending_payments(call, notice=f"✅ Approved {len(approved)} payments (₹{total:g})")
+    return reply._replace(notices=payment_notices(approved, approved=True))
+
+@debounced
+def decline_selected_payments(call):
+    selected = payment_selections.pop(call.from_user.id, None)
+    if not selected:
+        return Reply(alert="❌ No payments selected!")
+    declined = db.decline_payments(sorted(selected), call.from_user.id)
+    reply = show_pending_payments(call, notice=f"❌ Declined {len(declined)} payments")
+    return reply._replace(notices=payment_notices(declined, approved=False))
+
+def confirm_bulk_approve(call):
+    max_amount = int(call.data.split('_')[-1])
+    count, total = db.summarise_pending_payments(max_amount, limit=config.PAYMENT_BULK_LIMIT)
+    if not count:
+        return Reply(alert=f"❌ No pending payments up to ₹{max_amount}!")
+    return Reply(f"⚡ *Bulk Approve*\n\nApprove {count} pending payments of up to ₹{max_amount} (₹{total:g} in all)?",
+                 confirm_bulk_approve_menu(max_amount), 'Markdown')
+
+@debounced
+@locked('bulk_approve')
+def bulk_approve_payments(call):
+    max_amount = int(call.data.split('_')[-1])
+    approved = db.approve_payments_up_to(max_amount, call.from_user.id)
+    total = sum(payment.amount for payment in approved)
+    reply = show_pending_payments(call, notice=f"✅ Approved {len(approved)} payments up to ₹{max_amount} (₹{total:g})")
+    return reply._replace(notices=payment_notices(approved, approved=True))
+
+def view_payment_details(call):
+    payment_id = int(call.data.split('_')[-1])
+    payment = db.get_payment(payment_id)
+
+    if not payment:
+        return Reply(alert="❌ Payment not found!")
+
+    payment_id, user_id, amount, utr, status, admin_id, created_at, username = payment
+    user_display = f"@{username}" if username else f"User {user_id}"
+
+    payment_text = f"""
+💰 *Payment Details - #{payment_id}*
+
+👤 *User:* {user_display}
+🆔 User ID: `{user_id}`
+💳 *Amount:* ₹{amount}
+🔢 *UTR:* `{utr}`
+📅 *Submitted:* {created_at}
+
+Choose an action:
+"""
+    return Reply(payment_text, payment_actions_menu(payment_id), 'Markdown')
+
+@debounced
+@locked('payment')
+def approve_payment(call):
+    payment_id = int(call.data.split('_')[-1])
+    payment = db.approve_payment(payment_id, call.from_user.id)
+
+    if not payment:
+        return Reply(alert="❌ Payment not found!")
+
+    target_user_id, amount = payment
+    success_text = f"""
+✅ *Payment Approved!*
+
+💰 Amount: ₹{amount}
+👤 User ID: `{target_user_id}`
+✅ Balance has been added to user's account.
+"""
+    # Notify the user
+    return Reply(success_text, parse_mode='Markdown',
+                 notices=(Notice(target_user_id, payment_approved_text(amount), parse_mode='Markdown'),))
+
+@debounced
+@locked('payment')
+def decline_payment(call):
+    payment_id = int(call.data.split('_')[-1])
+    payment = db.get_payment(payment_id)
+
+    if not (payment and payment[4] == 'pending' and db.decline_payment(payment_id, call.from_user.id)):
+        return Reply(alert="❌ Payment not found!")
+
+    target_user_id = payment[1]
+    amount = payment[2]
+    decline_text = f"""
+❌ *Payment Declined*
+
+💰 Amount: ₹{amount}
+👤 User ID: `{target_user_id}`
+❌ Payment request has been declined.
+"""
+    # Notify the user
+    return Reply(decline_text, parse_mode='Markdown',
+                 notices=(Notice(target_user_id, payment_declined_text(amount), parse_mode='Markdown'),))
+
+# ========== CALLBACK ROUTES ==========
+def user_level(user_id: int) -> int:
+    if is_owner(user_id):
+        return OWNER
+    if is_admin(user_id):
+        return ADMIN
+    return PUBLIC
+
+def deny_callback(call, level: int):
+    if level == OWNER:
+        return Reply(alert="❌ Owner access required!")
+    return Reply(alert="❌ Admin access required!")
+
+callback_router = CallbackRouter(user_level, deny_callback)
+
+# (callback data, handler, permission level)
+EXACT_ROUTES = [
+    # Main menu navigation
+    ("main_menu", show_main_menu, PUBLIC),
+    ("buy_otp", show_otp_menu, PUBLIC),
+    ("buy_session", show_session_menu, PUBLIC),
+    ("deposit", show_deposit_menu, PUBLIC),
+    ("show_qr", show_qr_code, PUBLIC),
+    ("stats", show_user_stats, PUBLIC),
+    ("my_orders", view_user_orders, PUBLIC),
+    ("none", lambda call: Reply(alert=''), PUBLIC),
+
+    # Owner panel functions
+    ("owner_panel", show_owner_panel, OWNER),
+    ("manage_admins", show_manage_admins, OWNER),
+    ("add_admin", start_add_admin, OWNER),
+    ("list_admins", show_admin_list, OWNER),
+
+    # Account management
+    ("owner_account_management", show_account_management, OWNER),
+    ("add_telegram_accounts", start_add_accounts, OWNER),
+    ("add_whatsapp_accounts", start_add_accounts, OWNER),
+    ("view_all_accounts", show_all_accounts, OWNER),
+
+    # User management
+    ("manage_users", show_manage_users, ADMIN),
+    ("list_all_users", show_all_users, ADMIN),
+    ("search_users", start_user_search, ADMIN),
+
+    # Broadcast
+    ("broadcast", start_broadcast, OWNER),
+
+    # Payment approval system
+    ("pending_payments", show_pending_payments, ADMIN),
+    ("select_all_payments", select_all_payments, ADMIN),
+    ("clear_payment_selection", clear_payment_selection, ADMIN),
+    ("approve_selected_payments", approve_selected_payments, ADMIN),
+    ("decline_selected_payments", decline_selected_payments, ADMIN),
+]
+
+PREFIX_ROUTES = [
+    # Purchase handling
+    ("buy_", handle_purchase, PUBLIC),
+
+    # OTP viewing and cancellation
+    ("view_otp_", view_otp, PUBLIC),
+    ("cancel_otp_", cancel_otp_purchase, PUBLIC),
+    ("confirm_otp_", confirm_otp_received, PUBLIC),
+    ("refresh_otp_", refresh_otp_status, PUBLIC),
+
+    # Owner panel functions
+    ("remove_admin_", remove_admin, OWNER),
+
+    # User management
+    ("view_user_", show_user_details, ADMIN),
+    ("users_next_", page_users, ADMIN),
+    ("users_prev_", page_users, ADMIN),
+    ("add_balance_", handle_balance_action, ADMIN),
+    ("deduct_balance_", handle_balance_action, ADMIN),
+    ("block_user_", block_user, ADMIN),
+    ("unblock_user_", unblock_user, ADMIN),
+
+    # Payment approval system
+    ("view_payment_", view_payment_details, ADMIN),
+    ("approve_payment_", approve_payment, ADMIN),
+    ("decline_payment_", decline_payment, ADMIN),
+    ("toggle_payment_", toggle_payment_selection, ADMIN),
+    ("approve_payments_upto_", confirm_bulk_approve, ADMIN),
+    ("confirm_payments_upto_", bulk_approve_payments, ADMIN),
+]
+
+for key, handler, level in EXACT_ROUTES:
+    callback_router.add_exact(key, handler, level)
+for prefix, handler, level in PREFIX_ROUTES:
+    callback_router.add_prefix(prefix, handler, level)
+
+# (commands, handler) registered as message handlers by both runtimes
+COMMANDS = [
+    (['start'], start),
+    (['help'], help_command),
+    (['stats'], stats_command),
+    (['balance', 'mybalance'], balance_command),
+    (['ledger'], ledger_command),
+    (['routestats'], route_stats_command),
+]
+
+# ========== BUTTON HANDLER ==========
+def handle_callback(call):
+    """Check the route's permission level and run its handler"""
+    reply = callback_router.dispatch(call)
+    if reply is None:
+        logger.warning(f"Unhandled callback data: {call.data}")
+        return Reply(alert='')
+    return reply
+
+# ========== MESSAGE HANDLER FOR TEXT INPUT ==========
+def handle_text(message):
+    user_id = message.from_user.id
+    text = message.text.strip()
+    state = user_states.get(user_id, '')
+
+    # Handle commands
+    if text.startswith('/'):
+        if text == '/cancel':
+            user_states.pop(user_id, None)
+            return Reply("❌ Operation cancelled.", main_menu())
+        return Reply()
+
+    # Handle admin ID input
+    if state == 'awaiting_admin_id':
+        if not is_owner(user_id):
+            return Reply()
+        try:
+            new_admin_id = int(text)
+        except ValueError:
+            return Reply("❌ Invalid user ID! Send numbers only.")
+
+        if not db.get_user(new_admin_id):
+            db.create_user(new_admin_id, "Unknown")
+        db.add_admin(new_admin_id)
+        del user_states[user_id]
+
+        # Notify new admin
+        return Reply(f"✅ Admin added: {new_admin_id}", manage_admins_menu(),
+                     notices=(Notice(new_admin_id, "🎉 You are now an admin!", parse_mode='Markdown'),))
+
+    # Handle account addition
+    if state.startswith('adding_'):
+        account_type = import_target(message)
+        if not account_type:
+            return Reply()
+        return finish_account_import(message, account_type, text.split('\n'))
+
+    # Handle user search
+    if state == 'awaiting_user_search':
+        if not is_admin(user_id):
+            return Reply()
+        del user_states[user_id]
+        users = db.search_users(text, limit=config.USERS_PAGE_SIZE)
+        if not users:
+            return Reply(f"📝 No users found starting with {text}", manage_users_menu())
+
+        title = f"🔍 *Users starting with* `{text.lstrip('@')}`"
+        if len(users) == config.USERS_PAGE_SIZE:
+            title += "\n_Showing the first matches; type more letters to narrow down._"
+        return Reply(format_user_list(title, users), all_users_menu(users), 'Markdown')
+
+    # Handle broadcast
+    if state == 'awaiting_broadcast':
+        if is_owner(user_id):
+            del user_states[user_id]
+            # Runs in the background; progress is reported by editing a status message
+            broadcaster.start(text, created_by=user_id, chat_id=message.chat.id)
+        return Reply()
+
+    # Handle UTR payments (default case)
+    parts = text.split()
+    if len(parts) >= 2 and parts[-1].isdigit():
+        utr_text = ' '.join(parts[:-1])
+        amount = int(parts[-1])
+    else:
+        utr_text = text
+        amount = config.MIN_DEPOSIT
+
+    if amount < config.MIN_DEPOSIT:
+        amount = config.MIN_DEPOSIT
+
+    if len(utr_text) < 10 or not normalise_utr(utr_text):
+        return Reply("❌ Invalid UTR format! Send: `UTR1234567890 500`", back_to_main(), 'Markdown')
+
+    # Create payment request
+    payment_id = db.create_payment_request(user_id, amount, utr_text)
+    if payment_id is None:
+        # Resubmission: the first request is already with the admins
+        return Reply("⚠️ This UTR has already been submitted and is being reviewed.", back_to_main())
+
+    # Notify all admins
+    admin_message = f"""
+💰 *New Payment Request - #{payment_id}*
+
+👤 User: {message.from_user.username or 'N/A'} (ID: `{user_id}`)
+💳 Amount: ₹{amount}
+🔢 UTR: `{utr_text}`
+📅 Time: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+
+Click below to review this payment.
+"""
+    notices = tuple(Notice(admin[0], admin_message, review_payment_menu(payment_id), 'Markdown')
+                    for admin in db.get_all_admins())
+
+    # Confirm to user
+    user_message = f"""
+✅ *Payment Request Submitted!*
+
+💰 Amount: ₹{amount}
+🔢 Your UTR: `{utr_text}`
+📊 Payment ID: `{payment_id}`
+
+Your payment is under review. You'll be notified once approved.
+"""
+    return Reply(user_message, back_to_main(), 'Markdown', notices=notices)
+
+# ========== BACKGROUND WORK ==========
+def prune_processed_updates(scheduler):
+    try:
+        pruned = db.prune_processed_updates(config.DEDUP_RETENTION)
+        logger.info(f"Pruned {pruned} processed update ids")
+    except Exception as e:
+        logger.error(f"Pruning processed update ids failed: {e}")
+    scheduler.schedule('prune-updates', 3600, prune_processed_updates, scheduler)
+
+def checkpoint_ledger(scheduler):
+    try:
+        checkpoint = db.checkpoint_ledger()
+        if checkpoint.entries:
+            logger.info(f"Ledger checkpoint folded {checkpoint.entries} entries")
+    except Exception as e:
+        logger.error(f"Ledger checkpoint failed: {e}")
+    scheduler.schedule('ledger-checkpoint', config.LEDGER_CHECKPOINT_INTERVAL, checkpoint_ledger, scheduler)
+
+def recount_inventory(scheduler):
+    # Audits the trigger-maintained stock counters; drift is logged and repaired
+    try:
+        db.recount_inventory()
+    except Exception as e:
+        logger.error(f"Inventory recount failed: {e}")
+    scheduler.schedule('inventory-recount', config.INVENTORY_RECOUNT_INTERVAL, recount_inventory, scheduler)
+
+def resume_background_work(scheduler):
+    """Repair counters, pick up persisted OTP jobs and broadcasts, and arm the periodic jobs"""
+    recount_inventory(scheduler)
+    checkpoint_ledger(scheduler)
+    otp_delivery.resume()
+    broadcaster.resume()
+    if config.DEDUP_PERSIST:
+        prune_processed_updates(scheduler)
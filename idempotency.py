@@ -0,0 +1,116 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Hashable, List, Optional
+
+import telebot
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class SeenKeys:
+    """Bounded LRU of recently seen keys, with an optional time window
+
+    ``first_seen(key)`` records the key and says whether it is new. Keys
+    drop out once ``maxsize`` newer keys arrived or, with a ``ttl``, once
+    they are older than that. An optional ``persist`` callable (returning
+    False for a key that was already stored) makes the check survive
+    restarts and work across processes; the LRU still answers repeats
+    without touching it.
+    """
+
+    def __init__(self, maxsize: int = config.DEDUP_CACHE_SIZE, ttl: Optional[float] = None,
+                 persist: Optional[Callable[[str], bool]] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.persist = persist
+        self._keys: 'OrderedDict[Hashable, float]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def first_seen(self, key: Hashable) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            seen_at = self._keys.get(key)
+            if seen_at is not None and (self.ttl is None or now - seen_at < self.ttl):
+                self._keys.move_to_end(key)
+                return False
+            self._keys[key] = now
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.maxsize:
+                self._keys.popitem(last=False)
+
+        if self.persist:
+            try:
+                return self.persist(str(key))
+            except Exception as e:
+                # Fail open: better to risk a duplicate than to drop an update
+                logger.error(f"Persistent de-duplication failed for {key!r}: {e}")
+        return True
+
+
+class KeyedLocks:
+    """One re-entrant lock per entity (payment, order, user), created on demand
+
+    Locks are reference counted and dropped when nobody holds or waits for
+    them, so the table only ever contains entities being worked on.
+    """
+
+    def __init__(self):
+        self._locks: Dict[Hashable, List] = {}  # key -> [lock, holders]
+        self._guard = threading.Lock()
+
+    @contextmanager
+    def hold(self, key: Hashable):
+        with self._guard:
+            entry = self._locks.setdefault(key, [threading.RLock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+
+def update_keys(update) -> List[str]:
+    """Identities under which Telegram may deliver the same update twice"""
+    keys = [f"update:{update.update_id}"]
+    if update.callback_query:
+        keys.append(f"callback:{update.callback_query.id}")
+    return keys
+
+
+def filter_new_updates(updates, seen: SeenKeys) -> list:
+    """Drop updates that were already processed (redelivered after a timeout or retry)"""
+    fresh = []
+    for update in updates:
+        # Record every key, even after a hit, so each identity is remembered
+        new = [seen.first_seen(key) for key in update_keys(update)]
+        if all(new):
+            fresh.append(update)
+        else:
+            logger.info(f"Skipping duplicate update {update.update_id}")
+    return fresh
+
+
+class DedupTeleBot(telebot.TeleBot):
+    """TeleBot that processes each update once, however often it is delivered
+
+    Both polling and the webhook queue hand updates to process_new_updates,
+    so filtering here covers every source.
+    """
+
+    def __init__(self, token: str, seen: SeenKeys, **kwargs):
+        super().__init__(token, **kwargs)
+        self.seen = seen
+
+    def process_new_updates(self, updates):
+        updates = filter_new_updates(updates, self.seen)
+        if updates:
+            super().process_new_updates(updates)
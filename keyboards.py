@@ -1,121 +1,84 @@
-from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
-import config
-from database import db
+from functools import lru_cache
 
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
 import config
 from database import db
 
 
-# ========== OTP ACTIONS MENUS ==========
-def otp_actions_menu(order_id):
-    """Menu for OTP purchase actions"""
-    keyboard = [
-        [
-            InlineKeyboardButton("👀 View OTP", callback_data=f"view_otp_{order_id}"),
-            InlineKeyboardButton("❌ Cancel", callback_data=f"cancel_otp_{order_id}")
-        ],
-        [InlineKeyboardButton("🔄 Refresh Status", callback_data=f"refresh_otp_{order_id}")],
-        [InlineKeyboardButton("🔙 Main Menu", callback_data="main_menu")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+# Keyboards are serialised to JSON once: telebot passes a str reply_markup
+# through untouched, so static menus cost nothing per message and
+# parameterised ones are served from an LRU cache keyed by their arguments.
+def _serialise(keyboard):
+    return InlineKeyboardMarkup(keyboard).to_json()
 
-def otp_received_menu(order_id):
-    """Menu after OTP is received"""
-    keyboard = [
-        [InlineKeyboardButton("✅ Confirm OTP Received", callback_data=f"confirm_otp_{order_id}")],
-        [InlineKeyboardButton("🔙 Main Menu", callback_data="main_menu")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
 
-def otp_pending_menu(order_id):
-    """Menu when OTP is still pending"""
-    keyboard = [
-        [InlineKeyboardButton("⏳ OTP Pending...", callback_data="none")],
-        [
-            InlineKeyboardButton("👀 View OTP", callback_data=f"view_otp_{order_id}"),
-            InlineKeyboardButton("❌ Cancel", callback_data=f"cancel_otp_{order_id}")
-        ],
-        [InlineKeyboardButton("🔙 Main Menu", callback_data="main_menu")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+# ========== MAIN MENUS ==========
+_MAIN_MENU = _serialise([
+    [InlineKeyboardButton("📱 Buy OTP", callback_data="buy_otp")],
+    [InlineKeyboardButton("💳 Buy Session", callback_data="buy_session")],
+    [InlineKeyboardButton("💰 Deposit", callback_data="deposit")],
+    [InlineKeyboardButton("📊 Stats", callback_data="stats")],
+    [InlineKeyboardButton("📋 My Orders", callback_data="my_orders")],
+    [InlineKeyboardButton("👑 Owner Panel", callback_data="owner_panel")]
+])
 
-# ========== BUY MENUS ==========
-def buy_otp_menu():
-    keyboard = [
-        [InlineKeyboardButton("📲 Telegram OTP", callback_data="buy_telegram_otp")],
-        [InlineKeyboardButton("💚 WhatsApp OTP", callback_data="buy_whatsapp_otp")],
-        [InlineKeyboardButton("🔙 Back", callback_data="main_menu")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+_BACK_TO_MAIN = _serialise([[InlineKeyboardButton("🔙 Back to Main", callback_data="main_menu")]])
 
-def buy_session_menu():
-    keyboard = [
-        [InlineKeyboardButton("📲 Telegram Session", callback_data="buy_telegram_session")],
-        [InlineKeyboardButton("💚 WhatsApp Session", callback_data="buy_whatsapp_session")],
-        [InlineKeyboardButton("🔙 Back", callback_data="main_menu")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
-
-# ... (rest of your existing keyboard functions remain the same) ...
-# ========== MAIN MENUS ==========
 def main_menu():
-    keyboard = [
-        [InlineKeyboardButton("📱 Buy OTP", callback_data="buy_otp")],
-        [InlineKeyboardButton("💳 Buy Session", callback_data="buy_session")],
-        [InlineKeyboardButton("💰 Deposit", callback_data="deposit")],
-        [InlineKeyboardButton("📊 Stats", callback_data="stats")],
-        [InlineKeyboardButton("📋 My Orders", callback_data="my_orders")],
-        [InlineKeyboardButton("👑 Owner Panel", callback_data="owner_panel")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    return _MAIN_MENU
 
 def back_to_main():
-    return InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back to Main", callback_data="main_menu")]])
+    return _BACK_TO_MAIN
+
+# ========== BUY MENUS ==========
+_BUY_OTP_MENU = _serialise([
+    [InlineKeyboardButton("📲 Telegram OTP", callback_data="buy_telegram_otp")],
+    [InlineKeyboardButton("💚 WhatsApp OTP", callback_data="buy_whatsapp_otp")],
+    [InlineKeyboardButton("🔙 Back", callback_data="main_menu")]
+])
+
+_BUY_SESSION_MENU = _serialise([
+    [InlineKeyboardButton("📲 Telegram Session", callback_data="buy_telegram_session")],
+    [InlineKeyboardButton("💚 WhatsApp Session", callback_data="buy_whatsapp_session")],
+    [InlineKeyboardButton("🔙 Back", callback_data="main_menu")]
+])
+
+_DEPOSIT_MENU = _serialise([
+    [InlineKeyboardButton("📱 Pay via QR", callback_data="show_qr")],
+    [InlineKeyboardButton("🔙 Back", callback_data="main_menu")]
+])
 
 def buy_otp_menu():
-    keyboard = [
-        [InlineKeyboardButton("📲 Telegram OTP", callback_data="buy_telegram_otp")],
-        [InlineKeyboardButton("💚 WhatsApp OTP", callback_data="buy_whatsapp_otp")],
-        [InlineKeyboardButton("🔙 Back", callback_data="main_menu")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    return _BUY_OTP_MENU
 
 def buy_session_menu():
-    keyboard = [
-        [InlineKeyboardButton("📲 Telegram Session", callback_data="buy_telegram_session")],
-        [InlineKeyboardButton("💚 WhatsApp Session", callback_data="buy_whatsapp_session")],
-        [InlineKeyboardButton("🔙 Back", callback_data="main_menu")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    return _BUY_SESSION_MENU
 
 def deposit_menu():
-    keyboard = [
-        [InlineKeyboardButton("📱 Pay via QR", callback_data="show_qr")],
-        [InlineKeyboardButton("🔙 Back", callback_data="main_menu")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    return _DEPOSIT_MENU
 
 # ========== OWNER & ADMIN PANELS ==========
+_OWNER_PANEL = _serialise([
+    [InlineKeyboardButton("⏳ Pending Payments", callback_data="pending_payments")],
+    [InlineKeyboardButton("👥 Manage Users", callback_data="manage_users")],
+    [InlineKeyboardButton("🛡️ Manage Admins", callback_data="manage_admins")],
+    [InlineKeyboardButton("📢 Broadcast", callback_data="broadcast")],
+    [InlineKeyboardButton("📱 Manage Accounts", callback_data="owner_account_management")],
+    [InlineKeyboardButton("🔙 Back to Main", callback_data="main_menu")]
+])
+
 def owner_panel():
-    keyboard = [
-        [InlineKeyboardButton("⏳ Pending Payments", callback_data="pending_payments")],
-        [InlineKeyboardButton("👥 Manage Users", callback_data="manage_users")],
-        [InlineKeyboardButton("🛡️ Manage Admins", callback_data="manage_admins")],
-        [InlineKeyboardButton("📢 Broadcast", callback_data="broadcast")],
-        [InlineKeyboardButton("📱 Manage Accounts", callback_data="owner_account_management")],
-        [InlineKeyboardButton("🔙 Back to Main", callback_data="main_menu")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    return _OWNER_PANEL
 
 # ========== ADMIN MANAGEMENT ==========
+_MANAGE_ADMINS_MENU = _serialise([
+    [InlineKeyboardButton("👥 Add Admin", callback_data="add_admin")],
+    [InlineKeyboardButton("📋 List Admins", callback_data="list_admins")],
+    [InlineKeyboardButton("🔙 Back", callback_data="owner_panel")]
+])
+
 def manage_admins_menu():
-    keyboard = [
-        [InlineKeyboardButton("👥 Add Admin", callback_data="add_admin")],
-        [InlineKeyboardButton("📋 List Admins", callback_data="list_admins")],
-        [InlineKeyboardButton("🔙 Back", callback_data="owner_panel")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    return _MANAGE_ADMINS_MENU
 
 def admin_list_menu(admins):
     keyboard = []
@@ -123,46 +86,59 @@ def admin_list_menu(admins):
         user_id, username, is_admin = admin
         status = "👑 Owner" if user_id == config.OWNER_ID else "🛡️ Admin"
         name = f"@{username}" if username else f"User {user_id}"
-        
+
         if user_id != config.OWNER_ID:  # Don't show remove button for owner
             keyboard.append([InlineKeyboardButton(f"{name} - {status}", callback_data=f"remove_admin_{user_id}")])
         else:
             keyboard.append([InlineKeyboardButton(f"{name} - {status}", callback_data="none")])
-    
+
     keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="manage_admins")])
     return InlineKeyboardMarkup(keyboard)
 
 # ========== ACCOUNT MANAGEMENT ==========
+_OWNER_ACCOUNT_MANAGEMENT = _serialise([
+    [InlineKeyboardButton("➕ Add Telegram Accounts", callback_data="add_telegram_accounts")],
+    [InlineKeyboardButton("➕ Add WhatsApp Accounts", callback_data="add_whatsapp_accounts")],
+    [InlineKeyboardButton("📋 View All Accounts", callback_data="view_all_accounts")],
+    [InlineKeyboardButton("🔙 Back", callback_data="owner_panel")]
+])
+
 def owner_account_management():
-    keyboard = [
-        [InlineKeyboardButton("➕ Add Telegram Accounts", callback_data="add_telegram_accounts")],
-        [InlineKeyboardButton("➕ Add WhatsApp Accounts", callback_data="add_whatsapp_accounts")],
-        [InlineKeyboardButton("📋 View All Accounts", callback_data="view_all_accounts")],
-        [InlineKeyboardButton("🔙 Back", callback_data="owner_panel")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    return _OWNER_ACCOUNT_MANAGEMENT
 
 # ========== USER MANAGEMENT ==========
+_MANAGE_USERS_MENU = _serialise([
+    [InlineKeyboardButton("📋 All Users", callback_data="list_all_users")],
+    [InlineKeyboardButton("🔍 Search Users", callback_data="search_users")],
+    [InlineKeyboardButton("🔙 Back", callback_data="owner_panel")]
+])
+
 def manage_users_menu():
-    keyboard = [
-        [InlineKeyboardButton("📋 All Users", callback_data="list_all_users")],
-        [InlineKeyboardButton("🔙 Back", callback_data="owner_panel")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    return _MANAGE_USERS_MENU
 
-def all_users_menu(users):
+def all_users_menu(users, prev_cursor=None, next_cursor=None):
+    """One page of users; the cursors are the user_ids the prev/next pages continue from"""
     keyboard = []
-    for user in users[:15]:  # Show first 15 users
+    for user in users:
         user_id, username, balance, is_blocked, is_admin, joined_date = user
         name = f"@{username}" if username else f"User {user_id}"
         status = "🚫" if is_blocked else "✅"
         keyboard.append([InlineKeyboardButton(f"{status} {name} - ₹{balance}", callback_data=f"view_user_{user_id}")])
-    
+
+    navigation = []
+    if prev_cursor is not None:
+        navigation.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"users_prev_{prev_cursor}"))
+    if next_cursor is not None:
+        navigation.append(InlineKeyboardButton("Next ➡️", callback_data=f"users_next_{next_cursor}"))
+    if navigation:
+        keyboard.append(navigation)
+
     keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="manage_users")])
     return InlineKeyboardMarkup(keyboard)
 
+@lru_cache(maxsize=config.KEYBOARD_CACHE_SIZE)
 def user_actions_menu(user_id):
-    keyboard = [
+    return _serialise([
         [
             InlineKeyboardButton("➕ ₹100", callback_data=f"add_balance_{user_id}_100"),
             InlineKeyboardButton("➕ ₹500", callback_data=f"add_balance_{user_id}_500")
@@ -176,64 +152,89 @@ def user_actions_menu(user_id):
             InlineKeyboardButton("✅ Unblock", callback_data=f"unblock_user_{user_id}")
         ],
         [InlineKeyboardButton("🔙 Back to Users", callback_data="list_all_users")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    ])
 
 # ========== PAYMENT APPROVAL SYSTEM ==========
-def pending_payments_menu(payments):
+def pending_payments_menu(payments, selected=frozenset()):
+    """Review list: tap a payment to tick it, 👀 to open it on its own"""
     keyboard = []
-    
-    for payment in payments[:10]:
+
+    for payment in payments:
         payment_id, user_id, amount, utr, status, admin_id, created_at, username = payment
-        display_text = f"💰 ₹{amount} - User {user_id}"
-        if username:
-            display_text = f"💰 ₹{amount} - @{username}"
-            
-        keyboard.append([InlineKeyboardButton(display_text, callback_data=f"view_payment_{payment_id}")])
-    
+        name = f"@{username}" if username else f"User {user_id}"
+        tick = "☑️" if payment_id in selected else "⬜"
+        keyboard.append([
+            InlineKeyboardButton(f"{tick} ₹{amount} - {name}", callback_data=f"toggle_payment_{payment_id}"),
+            InlineKeyboardButton("👀", callback_data=f"view_payment_{payment_id}")
+        ])
+
+    keyboard.append([
+        InlineKeyboardButton("☑️ Select All", callback_data="select_all_payments"),
+        InlineKeyboardButton("✖️ Clear", callback_data="clear_payment_selection")
+    ])
+    if selected:
+        keyboard.append([
+            InlineKeyboardButton(f"✅ Approve {len(selected)}", callback_data="approve_selected_payments"),
+            InlineKeyboardButton(f"❌ Decline {len(selected)}", callback_data="decline_selected_payments")
+        ])
+    if config.PAYMENT_BULK_THRESHOLDS:
+        keyboard.append([InlineKeyboardButton(f"⚡ All ≤ ₹{amount}", callback_data=f"approve_payments_upto_{amount}")
+                         for amount in config.PAYMENT_BULK_THRESHOLDS])
+
     keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="owner_panel")])
     return InlineKeyboardMarkup(keyboard)
 
+@lru_cache(maxsize=config.KEYBOARD_CACHE_SIZE)
+def confirm_bulk_approve_menu(max_amount):
+    return _serialise([
+        [InlineKeyboardButton(f"✅ Yes, approve all ≤ ₹{max_amount}", callback_data=f"confirm_payments_upto_{max_amount}")],
+        [InlineKeyboardButton("🔙 Back to Payments", callback_data="pending_payments")]
+    ])
+
+@lru_cache(maxsize=config.KEYBOARD_CACHE_SIZE)
 def payment_actions_menu(payment_id):
-    keyboard = [
+    return _serialise([
         [
             InlineKeyboardButton("✅ Approve Payment", callback_data=f"approve_payment_{payment_id}"),
             InlineKeyboardButton("❌ Decline Payment", callback_data=f"decline_payment_{payment_id}")
         ],
         [InlineKeyboardButton("🔙 Back to Payments", callback_data="pending_payments")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    ])
+
+@lru_cache(maxsize=config.KEYBOARD_CACHE_SIZE)
+def review_payment_menu(payment_id):
+    """Button attached to the new-payment notification sent to admins"""
+    return _serialise([[InlineKeyboardButton("👀 Review Payment", callback_data=f"view_payment_{payment_id}")]])
 
 # ========== OTP ACTIONS MENUS ==========
+@lru_cache(maxsize=config.KEYBOARD_CACHE_SIZE)
 def otp_actions_menu(order_id):
     """Menu for OTP purchase actions"""
-    keyboard = [
+    return _serialise([
         [
             InlineKeyboardButton("👀 View OTP", callback_data=f"view_otp_{order_id}"),
             InlineKeyboardButton("❌ Cancel", callback_data=f"cancel_otp_{order_id}")
         ],
         [InlineKeyboardButton("🔄 Refresh Status", callback_data=f"refresh_otp_{order_id}")],
         [InlineKeyboardButton("🔙 Main Menu", callback_data="main_menu")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    ])
 
+@lru_cache(maxsize=config.KEYBOARD_CACHE_SIZE)
 def otp_received_menu(order_id):
     """Menu after OTP is received"""
-    keyboard = [
+    return _serialise([
         [InlineKeyboardButton("✅ Confirm OTP Received", callback_data=f"confirm_otp_{order_id}")],
         [InlineKeyboardButton("🔙 Main Menu", callback_data="main_menu")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    ])
 
+@lru_cache(maxsize=config.KEYBOARD_CACHE_SIZE)
 def otp_pending_menu(order_id):
     """Menu when OTP is still pending"""
-    keyboard = [
+    return _serialise([
         [InlineKeyboardButton("⏳ OTP Pending...", callback_data="none")],
         [
             InlineKeyboardButton("👀 View OTP", callback_data=f"view_otp_{order_id}"),
             InlineKeyboardButton("❌ Cancel", callback_data=f"cancel_otp_{order_id}")
         ],
         [InlineKeyboardButton("🔙 Main Menu", callback_data="main_menu")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
-
+    ])
@@ -0,0 +1,304 @@
+import logging
+import re
+import sqlite3
+from typing import Callable, List, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# A step is either a SQL statement or a callable that receives the cursor
+Step = Union[str, Callable[[sqlite3.Cursor], None]]
+
+# ========== DATA MIGRATIONS ==========
+def backfill_utr_normalized(cursor: sqlite3.Cursor):
+    """Fill payments.utr_normalized; later repeats of a live UTR are left NULL
+
+    Same rules as database.normalise_utr at the time of writing (kept
+    here so this migration never changes behaviour). Keys without a digit
+    are junk, not UTRs, and stay NULL.
+    """
+    seen = set()
+    updates = []
+    cursor.execute("SELECT id, utr, status FROM payments ORDER BY id")
+    for payment_id, utr, status in cursor.fetchall():
+        key = re.sub(r'[^0-9A-Za-z]', '', utr or '').upper()
+        if key.startswith('UTR') and len(key) > 3:
+            key = key[3:]
+        if not re.search(r'[0-9]', key) or (status != 'declined' and key in seen):
+            continue
+        if status != 'declined':
+            seen.add(key)
+        updates.append((key, payment_id))
+    cursor.executemany('UPDATE payments SET utr_normalized = ? WHERE id = ?', updates)
+
+
+# ========== MIGRATIONS ==========
+# Append new migrations to the end with the next version number.
+# Never edit or reorder a migration once it has been deployed.
+MIGRATIONS: List[Tuple[int, str, List[Step]]] = [
+    (1, "base tables", [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            balance REAL DEFAULT 0,
+            total_spent REAL DEFAULT 0,
+            accounts_bought INTEGER DEFAULT 0,
+            is_blocked BOOLEAN DEFAULT FALSE,
+            is_admin BOOLEAN DEFAULT FALSE,
+            joined_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            total_refund REAL DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS accounts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT NOT NULL,
+            phone_number TEXT UNIQUE,
+            otp_code TEXT,
+            status TEXT DEFAULT 'available',  -- available, in_use, sold
+            price REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS account_orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            account_type TEXT,
+            phone_number TEXT,
+            otp_code TEXT,
+            status TEXT DEFAULT 'pending',  -- pending, otp_ready, completed, cancelled
+            price REAL,
+            purchased_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            completed_at TIMESTAMP,
+            refund_amount REAL DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            amount REAL,
+            utr TEXT,
+            status TEXT DEFAULT 'pending',
+            admin_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (2, "indexes for hot queries", [
+        # Inventory allocator (Database._claim_phone_number) and stock counts
+        '''
+        CREATE INDEX IF NOT EXISTS idx_accounts_type_status_id
+        ON accounts (type, status, id)
+        ''',
+        # Order history and active orders per user
+        '''
+        CREATE INDEX IF NOT EXISTS idx_account_orders_user_status_purchased
+        ON account_orders (user_id, status, purchased_at)
+        ''',
+        # Pending payments screen
+        '''
+        CREATE INDEX IF NOT EXISTS idx_payments_status_created
+        ON payments (status, created_at)
+        ''',
+        'ANALYZE',
+    ]),
+    (3, "durable OTP delivery jobs", [
+        '''
+        CREATE TABLE IF NOT EXISTS otp_jobs (
+            order_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            phone_number TEXT NOT NULL,
+            status TEXT DEFAULT 'queued',  -- queued, leased, failed
+            due_at REAL NOT NULL,  -- unix time
+            attempts INTEGER DEFAULT 0,
+            lease_owner TEXT,
+            lease_expires_at REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_otp_jobs_status_due
+        ON otp_jobs (status, due_at)
+        ''',
+        # Orders left pending by a restart before this table existed
+        '''
+        INSERT OR IGNORE INTO otp_jobs (order_id, user_id, phone_number, due_at)
+        SELECT id, user_id, phone_number, CAST(strftime('%s', 'now') AS REAL)
+        FROM account_orders WHERE status = 'pending'
+        ''',
+    ]),
+    (4, "purchase message reference on orders", [
+        'ALTER TABLE account_orders ADD COLUMN chat_id INTEGER',
+        'ALTER TABLE account_orders ADD COLUMN message_id INTEGER',
+    ]),
+    (5, "resumable broadcasts", [
+        '''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            created_by INTEGER,
+            chat_id INTEGER,  -- where progress is reported
+            message_id INTEGER,
+            status TEXT DEFAULT 'running',  -- running, done
+            last_user_id INTEGER DEFAULT 0,  -- every user up to here has been handled
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            total INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        ''',
+    ]),
+    (6, "username prefix search index", [
+        # Case-insensitive range scans for the admin user search
+        'CREATE INDEX IF NOT EXISTS idx_users_username_nocase ON users(username COLLATE NOCASE, user_id)',
+    ]),
+    (7, "processed update ids", [
+        '''
+        CREATE TABLE IF NOT EXISTS processed_updates (
+            key TEXT PRIMARY KEY,  -- update:<update_id> or callback:<callback_query_id>
+            seen_at REAL NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_processed_updates_seen_at ON processed_updates(seen_at)',
+    ]),
+    (8, "inventory counters", [
+        # Accounts per (type, status), kept exact by the triggers below
+        '''
+        CREATE TABLE IF NOT EXISTS inventory_counts (
+            type TEXT NOT NULL,
+            status TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (type, status)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        INSERT OR REPLACE INTO inventory_counts (type, status, count)
+        SELECT type, status, COUNT(*) FROM accounts WHERE status IS NOT NULL GROUP BY type, status
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_accounts_count_insert AFTER INSERT ON accounts
+        WHEN NEW.status IS NOT NULL
+        BEGIN
+            INSERT INTO inventory_counts (type, status, count) VALUES (NEW.type, NEW.status, 1)
+            ON CONFLICT (type, status) DO UPDATE SET count = count + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_accounts_count_delete AFTER DELETE ON accounts
+        BEGIN
+            UPDATE inventory_counts SET count = count - 1 WHERE type = OLD.type AND status = OLD.status;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_accounts_count_update AFTER UPDATE OF type, status ON accounts
+        WHEN OLD.type IS NOT NEW.type OR OLD.status IS NOT NEW.status
+        BEGIN
+            UPDATE inventory_counts SET count = count - 1 WHERE type = OLD.type AND status = OLD.status;
+            INSERT INTO inventory_counts (type, status, count)
+            SELECT NEW.type, NEW.status, 1 WHERE NEW.status IS NOT NULL
+            ON CONFLICT (type, status) DO UPDATE SET count = count + 1;
+        END
+        ''',
+    ]),
+    (9, "balance ledger", [
+        # Append-only record of every balance change; users.balance is derived from it
+        '''
+        CREATE TABLE IF NOT EXISTS ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            amount REAL NOT NULL,  -- credit to the user (negative = debit)
+            kind TEXT NOT NULL,  -- opening, deposit, purchase, refund, adjust
+            ref_id INTEGER,  -- payment id (deposit) or order id (purchase, refund)
+            actor_id INTEGER,  -- admin who made the change, if any
+            created_at REAL NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_ledger_user_id ON ledger(user_id, id)',
+        # Per-user ledger sums, advanced by Database.checkpoint_ledger
+        '''
+        CREATE TABLE IF NOT EXISTS ledger_balances (
+            user_id INTEGER PRIMARY KEY,
+            balance REAL NOT NULL DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS ledger_checkpoint (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_entry_id INTEGER NOT NULL  -- every entry up to here is in ledger_balances
+        )
+        ''',
+        'INSERT OR IGNORE INTO ledger_checkpoint (id, last_entry_id) VALUES (1, 0)',
+        # Balances from before the ledger existed
+        '''
+        INSERT INTO ledger (user_id, amount, kind, created_at) 
+        SELECT user_id, balance, 'opening', CAST(strftime('%s', 'now') AS REAL) FROM users WHERE balance != 0
+        ''',
+    ]),
+    (10, "unique normalised UTRs", [
+        'ALTER TABLE payments ADD COLUMN utr_normalized TEXT',
+        backfill_utr_normalized,
+        # A UTR can be pending or approved once; declining it frees it for a corrected resubmission
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_utr_normalized 
+        ON payments (utr_normalized) WHERE status != 'declined'
+        ''',
+    ]),
+]
+
+
+def get_schema_version(cursor: sqlite3.Cursor) -> int:
+    """Return the highest applied migration version (0 for a fresh database)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('SELECT MAX(version) FROM schema_version')
+    return cursor.fetchone()[0] or 0
+
+
+def run_migrations(conn: sqlite3.Connection) -> int:
+    """Apply pending migrations in order, each in its own transaction"""
+    cursor = conn.cursor()
+    current = get_schema_version(cursor)
+    conn.commit()
+
+    latest = MIGRATIONS[-1][0] if MIGRATIONS else 0
+    if current >= latest:
+        return current
+
+    for version, description, steps in MIGRATIONS:
+        if version <= current:
+            continue
+
+        logger.info(f"Applying schema migration {version}: {description}")
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            # Another process may have migrated while we waited for the lock
+            cursor.execute('SELECT 1 FROM schema_version WHERE version = ?', (version,))
+            if cursor.fetchone():
+                conn.rollback()
+                continue
+
+            for step in steps:
+                if callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(step)
+
+            cursor.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                           (version, description))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.error(f"Schema migration {version} failed")
+            raise
+
+        current = version
+
+    return current
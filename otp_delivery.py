@@ -0,0 +1,161 @@
+import logging
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import config
+from database import CancelledOrder, Database, OtpDelivery, OtpJob
+from otp_providers import OtpProvider
+from scheduler import TimerScheduler
+
+logger = logging.getLogger(__name__)
+
+DRAIN_KEY = 'otp-drain'
+
+
+class OtpDeliveryPool:
+    """Drains the durable otp_jobs queue by polling an OtpProvider in batches
+
+    The otp_jobs table is the source of truth; timers are only wake-ups.
+    A job's timer does not poll on its own: it arms one shared drain a
+    short batching window later, and the drain leases *all* due jobs, polls
+    the provider with as many numbers per request as it accepts (several
+    requests in parallel), stores every code that arrived in one
+    transaction and re-queues the rest with exponential backoff.
+
+    Leases make a restart safe: resume() drains the backlog in bulk and a
+    job held by a dead worker is picked up again once its lease expires.
+    A job still without a code after ``max_attempts`` polls is given up:
+    the database refunds the order and ``on_failed`` tells the buyer.
+    """
+
+    def __init__(self, database: Database, scheduler: TimerScheduler, provider: OtpProvider,
+                 on_delivered: Callable[[OtpDelivery], None],
+                 on_failed: Optional[Callable[[CancelledOrder], None]] = None,
+                 batch_size: int = config.OTP_JOB_BATCH_SIZE,
+                 lease_seconds: int = config.OTP_JOB_LEASE_SECONDS,
+                 max_attempts: int = config.OTP_JOB_MAX_ATTEMPTS,
+                 batch_window: float = config.OTP_POLL_BATCH_WINDOW,
+                 concurrency: int = config.OTP_POLL_CONCURRENCY,
+                 backoff_base: float = config.OTP_POLL_BACKOFF_BASE,
+                 backoff_max: float = config.OTP_POLL_BACKOFF_MAX):
+        self.db = database
+        self.scheduler = scheduler
+        self.provider = provider
+        self.on_delivered = on_delivered
+        self.on_failed = on_failed
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.batch_window = batch_window
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._pollers = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='otp-poll')
+
+    def submit(self, order_id: int, delay: float):
+        """Wake up when the job queued by Database.purchase_otp becomes due"""
+        self.scheduler.schedule(('otp', order_id), delay, self._wake)
+
+    def cancel(self, order_id: int, phone_number: Optional[str] = None):
+        """Drop the wake-up; the job row itself is deleted by Database.cancel_otp_order"""
+        self.scheduler.cancel(('otp', order_id))
+        if phone_number:
+            self.provider.release(phone_number)
+
+    def resume(self):
+        """Deliver everything that came due while we were down, then re-arm the rest"""
+        for order in self.db.refund_failed_otp_jobs():
+            self._give_up(order)
+        delivered = self.drain()
+        now = time.time()
+        pending = self.db.get_open_otp_job_deadlines()
+        for order_id, claimable_at in pending:
+            self.submit(order_id, max(0.0, claimable_at - now))
+        logger.info(f"OTP delivery resumed: {delivered} delivered, {len(pending)} still pending")
+
+    def queue_depth(self) -> int:
+        """Orders waiting for their OTP; the drain and housekeeping timers share the scheduler"""
+        return self.scheduler.queue_depth('otp')
+
+    def _wake(self):
+        # Coalesce: jobs coming due within the window share one drain
+        self.scheduler.schedule(DRAIN_KEY, self.batch_window, self.drain, replace=False)
+
+    def backoff(self, attempts: int) -> float:
+        return min(self.backoff_max, self.backoff_base * (2 ** max(0, attempts - 1)))
+
+    def drain(self) -> int:
+        """Poll every due job until none are left; returns how many OTPs were delivered"""
+        delivered = 0
+        while True:
+            jobs = self.db.claim_due_otp_jobs(self.worker_id, self.batch_size, self.lease_seconds)
+            if not jobs:
+                return delivered
+
+            try:
+                delivered += self._poll(jobs)
+            except Exception as e:
+                # Leases stay in place; look at these jobs again once they expire
+                logger.error(f"OTP drain failed for {len(jobs)} jobs: {e}")
+                for job in jobs:
+                    self.submit(job.order_id, self.lease_seconds)
+                return delivered
+
+            if len(jobs) < self.batch_size:
+                return delivered
+
+    def _poll(self, jobs: List[OtpJob]) -> int:
+        by_phone: Dict[str, OtpJob] = {}
+        for job in jobs:
+            # A job claimed ahead of its own timer must not wake another drain
+            self.scheduler.cancel(('otp', job.order_id))
+            by_phone[job.phone_number] = job
+
+        phones = list(by_phone)
+        step = max(1, self.provider.max_batch_size)
+        batches = [phones[i:i + step] for i in range(0, len(phones), step)]
+
+        codes: Dict[str, str] = {}
+        for batch, future in [(batch, self._pollers.submit(self.provider.fetch_codes, batch))
+                              for batch in batches]:
+            try:
+                codes.update(future.result())
+            except Exception as e:
+                # The whole batch is retried with backoff like a miss
+                logger.error(f"OTP provider {self.provider.name} failed for {len(batch)} numbers: {e}")
+
+        arrived = [(by_phone[phone].order_id, code) for phone, code in codes.items() if phone in by_phone]
+        delivered = self.db.update_otp_codes(arrived)
+
+        now = time.time()
+        retry = [(job.order_id, now + self.backoff(job.attempts))
+                 for job in jobs if job.phone_number not in codes]
+        failed = self.db.reschedule_otp_jobs(retry, self.max_attempts)
+        for order in failed:
+            self._give_up(order)
+        given_up = {order.order_id for order in failed}
+        for order_id, due_at in retry:
+            if order_id not in given_up:
+                self.submit(order_id, max(0.0, due_at - now))
+
+        for delivery in delivered:
+            try:
+                self.on_delivered(delivery)
+            except Exception as e:
+                logger.error(f"OTP delivered for order {delivery.order_id} but notification failed: {e}")
+
+        return len(delivered)
+
+    def _give_up(self, order: CancelledOrder):
+        # The order is already cancelled and refunded; hand the number back and tell the buyer
+        logger.error(f"Gave up on OTP delivery for order {order.order_id} after {self.max_attempts} polls, "
+                     f"refunded ₹{order.price}")
+        try:
+            self.provider.release(order.phone_number)
+            if self.on_failed:
+                self.on_failed(order)
+        except Exception as e:
+            logger.error(f"Order {order.order_id} was refunded but the release or notification failed: {e}")
@@ -0,0 +1,73 @@
+import logging
+import random
+import threading
+import time
+from typing import Dict, List
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class OtpProvider:
+    """Interface for SMS backends that receive OTPs on our numbers
+
+    A provider is polled with many outstanding numbers at once and answers
+    with the codes that have arrived so far. Implementations must be
+    thread-safe: OtpDeliveryPool polls several batches concurrently.
+    """
+
+    name = 'base'
+    # Largest number of phone numbers accepted by one fetch_codes call
+    max_batch_size = 50
+
+    def fetch_codes(self, phone_numbers: List[str]) -> Dict[str, str]:
+        """Return ``{phone_number: otp_code}`` for numbers whose OTP has arrived"""
+        raise NotImplementedError
+
+    def release(self, phone_number: str):
+        """Stop watching a number (order cancelled); optional"""
+
+
+class FakeOtpProvider(OtpProvider):
+    """Local provider: each number receives a random code after a random delay
+
+    The delay starts when a number is first polled, so the end-to-end time
+    is OTP_POLL_INITIAL_DELAY plus a value in [0, max_delay].
+    """
+
+    name = 'fake'
+    max_batch_size = 200
+
+    def __init__(self, max_delay: float = config.OTP_DELIVERY_MAX_TIME - config.OTP_DELIVERY_MIN_TIME):
+        self.max_delay = max(0.0, max_delay)
+        self._arrivals: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def fetch_codes(self, phone_numbers: List[str]) -> Dict[str, str]:
+        now = time.time()
+        codes = {}
+        with self._lock:
+            for phone_number in phone_numbers:
+                arrival = self._arrivals.setdefault(phone_number, now + random.uniform(0, self.max_delay))
+                if arrival <= now:
+                    del self._arrivals[phone_number]
+                    codes[phone_number] = str(random.randint(100000, 999999))
+        return codes
+
+    def release(self, phone_number: str):
+        with self._lock:
+            self._arrivals.pop(phone_number, None)
+
+
+PROVIDERS = {
+    FakeOtpProvider.name: FakeOtpProvider,
+}
+
+
+def get_provider(name: str = config.OTP_PROVIDER) -> OtpProvider:
+    """Instantiate the provider configured by OTP_PROVIDER"""
+    try:
+        return PROVIDERS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown OTP provider '{name}' (available: {', '.join(PROVIDERS)})")
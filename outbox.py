@@ -0,0 +1,176 @@
+import itertools
+import logging
+import queue
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from telebot.apihelper import ApiTelegramException
+
+import config
+from ratelimit import TokenBucket, retry_after
+from scheduler import TimerScheduler
+
+logger = logging.getLogger(__name__)
+
+# Telegram errors that will not go away by retrying (bad request, bot blocked by the user)
+PERMANENT_ERROR_CODES = {400, 403}
+
+
+class _Message:
+    __slots__ = ('id', 'method', 'chat_id', 'args', 'kwargs', 'edit_key', 'attempts', 'on_success', 'on_failure')
+
+    def __init__(self, id: int, method: str, chat_id: int, args: tuple, kwargs: dict,
+                 edit_key: Optional[Tuple[int, int]], on_success: Optional[Callable],
+                 on_failure: Optional[Callable]):
+        self.id = id
+        self.method = method
+        self.chat_id = chat_id
+        self.args = args
+        self.kwargs = kwargs
+        self.edit_key = edit_key
+        self.attempts = 0
+        self.on_success = on_success
+        self.on_failure = on_failure
+
+
+class Outbox:
+    """Queues outgoing Bot API calls and sends them from a pool of worker threads
+
+    ``send_message`` and ``edit_message_text`` mirror telebot's signatures
+    but return immediately. Each chat is pinned to one worker so messages
+    to a chat keep their order. While an edit of a given (chat_id,
+    message_id) is waiting, a newer edit of the same message replaces it,
+    so only the latest text is sent.
+
+    Failed calls are retried with exponential backoff from a timer. A 429
+    pauses the shared token bucket for the ``retry_after`` Telegram
+    returns. Permanent errors (400/403) are dropped. ``on_success`` and
+    ``on_failure`` callbacks run on the worker thread.
+
+    Pass the process-wide ``bucket`` that the Broadcaster also draws
+    from, so that together they stay under Telegram's global limit.
+    """
+
+    def __init__(self, bot,
+                 bucket: Optional[TokenBucket] = None,
+                 workers: int = config.OUTBOX_WORKERS,
+                 max_retries: int = config.OUTBOX_MAX_RETRIES,
+                 backoff_base: float = config.OUTBOX_BACKOFF_BASE,
+                 backoff_max: float = config.OUTBOX_BACKOFF_MAX):
+        self.bot = bot
+        self.bucket = bucket or TokenBucket(config.BOT_API_RATE)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._ids = itertools.count(1)
+        self._pending_edits: Dict[Tuple[int, int], _Message] = {}
+        self._latest_edits: Dict[Tuple[int, int], int] = {}  # newest edit id per message, until it settles
+        self._lock = threading.Lock()
+        self._retries = TimerScheduler('outbox-retry', workers=1)
+        self._queues: List[queue.Queue] = [queue.Queue() for _ in range(max(1, workers))]
+        self._workers = [threading.Thread(target=self._run, args=(q,), name=f'outbox-{i}', daemon=True)
+                         for i, q in enumerate(self._queues)]
+        for worker in self._workers:
+            worker.start()
+
+    # ========== ENQUEUE ==========
+    def send_message(self, chat_id: int, text: str, on_success: Optional[Callable] = None,
+                     on_failure: Optional[Callable] = None, **kwargs):
+        message = _Message(next(self._ids), 'send_message', chat_id, (chat_id, text), kwargs,
+                           None, on_success, on_failure)
+        self._queue_for(chat_id).put(message)
+
+    def edit_message_text(self, text: str, chat_id: int, message_id: int, on_success: Optional[Callable] = None,
+                          on_failure: Optional[Callable] = None, **kwargs):
+        key = (chat_id, message_id)
+        message = _Message(next(self._ids), 'edit_message_text', chat_id, (text, chat_id, message_id), kwargs,
+                           key, on_success, on_failure)
+        with self._lock:
+            already_queued = key in self._pending_edits
+            self._pending_edits[key] = message
+            self._latest_edits[key] = message.id
+        if not already_queued:
+            # The worker picks up whatever edit is latest when it gets to the key
+            self._queue_for(chat_id).put(key)
+
+    def queue_depth(self) -> int:
+        return sum(q.qsize() for q in self._queues) + self._retries.queue_depth()
+
+    def _queue_for(self, chat_id: int) -> queue.Queue:
+        return self._queues[hash(chat_id) % len(self._queues)]
+
+    # ========== DELIVERY ==========
+    def _run(self, work: queue.Queue):
+        while True:
+            item = work.get()
+            if isinstance(item, tuple):
+                with self._lock:
+                    message = self._pending_edits.pop(item, None)
+                if message is None:
+                    continue
+            else:
+                message = item
+            try:
+                self._deliver(message)
+            except Exception as e:
+                logger.error(f"Outbox worker error for chat {message.chat_id}: {e}")
+
+    def _deliver(self, message: _Message):
+        self.bucket.acquire()
+        message.attempts += 1
+        try:
+            result = getattr(self.bot, message.method)(*message.args, **message.kwargs)
+        except ApiTelegramException as e:
+            wait = retry_after(e)
+            if wait is not None:
+                # Slow every worker down; a rate limit is not the message's fault
+                self.bucket.pause(wait)
+                message.attempts -= 1
+                self._retry_later(message, wait)
+            elif 'message is not modified' in str(e):
+                self._finish(message, message.on_success, None)
+            elif e.error_code in PERMANENT_ERROR_CODES:
+                logger.warning(f"Dropping {message.method} to chat {message.chat_id}: {e}")
+                self._finish(message, message.on_failure, e)
+            else:
+                self._retry_or_fail(message, e)
+        except Exception as e:
+            self._retry_or_fail(message, e)
+        else:
+            self._finish(message, message.on_success, result)
+
+    def _retry_or_fail(self, message: _Message, error: Exception):
+        if message.attempts > self.max_retries:
+            logger.error(f"Giving up on {message.method} to chat {message.chat_id} "
+                         f"after {message.attempts} attempts: {error}")
+            self._finish(message, message.on_failure, error)
+            return
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (message.attempts - 1)))
+        logger.warning(f"{message.method} to chat {message.chat_id} failed, retrying in {delay}s: {error}")
+        self._retry_later(message, delay)
+
+    def _retry_later(self, message: _Message, delay: float):
+        self._retries.schedule(('outbox', message.id), delay, self._requeue, message)
+
+    def _requeue(self, message: _Message):
+        if message.edit_key is None:
+            self._queue_for(message.chat_id).put(message)
+            return
+        with self._lock:
+            if self._latest_edits.get(message.edit_key) != message.id:
+                # A newer edit of the same message is queued or already sent
+                return
+            self._pending_edits[message.edit_key] = message
+        self._queue_for(message.chat_id).put(message.edit_key)
+
+    def _finish(self, message: _Message, callback: Optional[Callable], value):
+        if message.edit_key is not None:
+            with self._lock:
+                if self._latest_edits.get(message.edit_key) == message.id:
+                    del self._latest_edits[message.edit_key]
+        if callback is None:
+            return
+        try:
+            callback(value)
+        except Exception as e:
+            logger.error(f"Outbox callback failed: {e}")
@@ -0,0 +1,63 @@
+import threading
+import time
+from typing import Optional
+
+from telebot.apihelper import ApiTelegramException
+
+
+class TokenBucket:
+    """Thread-safe token bucket: ``rate`` tokens per second, bursts up to ``capacity``
+
+    ``pause()`` empties the bucket until a given time, which is how a 429
+    from Telegram throttles every sender sharing the bucket at once.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        if now < self._paused_until:
+            self._updated = now
+            return
+        elapsed = now - max(self._updated, self._paused_until)
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """Take tokens if available; otherwise return how long to wait (0 on success)"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens: float = 1):
+        """Block until ``tokens`` are available"""
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens for ``seconds`` (e.g. Telegram's retry_after)"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Seconds Telegram asked us to wait, if ``error`` is a 429 Too Many Requests"""
+    if isinstance(error, ApiTelegramException) and error.error_code == 429:
+        parameters = (error.result_json or {}).get('parameters') or {}
+        return float(parameters.get('retry_after', 1))
+    return None
@@ -0,0 +1,105 @@
+import threading
+from collections import Counter
+from typing import Callable, Dict, NamedTuple, Optional
+
+# Permission levels, ordered so that a higher level includes the lower ones
+PUBLIC = 0
+ADMIN = 1
+OWNER = 2
+
+
+class Route(NamedTuple):
+    pattern: str
+    handler: Callable
+    level: int
+
+
+class _TrieNode:
+    __slots__ = ('children', 'route')
+
+    def __init__(self):
+        self.children: Dict[str, '_TrieNode'] = {}
+        self.route: Optional[Route] = None
+
+
+class CallbackRouter:
+    """Dispatches callback queries by exact key or by the longest registered prefix
+
+    Exact keys are a dict lookup; prefixes live in a character trie, so the
+    cost of a dispatch depends on the length of the callback data rather
+    than on the number of routes. Each route declares the permission level
+    it needs, and the caller's level is resolved at most once per dispatch.
+    """
+
+    def __init__(self, resolve_level: Callable[[int], int], on_denied: Callable[[object, int], object]):
+        self._resolve_level = resolve_level
+        self._on_denied = on_denied
+        self._exact: Dict[str, Route] = {}
+        self._prefixes = _TrieNode()
+        self._hits = Counter()
+        self._hits_lock = threading.Lock()
+
+    def add_exact(self, key: str, handler: Callable, level: int = PUBLIC):
+        self._exact[key] = Route(key, handler, level)
+
+    def add_prefix(self, prefix: str, handler: Callable, level: int = PUBLIC):
+        node = self._prefixes
+        for char in prefix:
+            node = node.children.setdefault(char, _TrieNode())
+        node.route = Route(prefix + '*', handler, level)
+
+    def exact(self, key: str, level: int = PUBLIC):
+        """Decorator form of add_exact"""
+        def decorator(handler):
+            self.add_exact(key, handler, level)
+            return handler
+        return decorator
+
+    def prefix(self, prefix: str, level: int = PUBLIC):
+        """Decorator form of add_prefix"""
+        def decorator(handler):
+            self.add_prefix(prefix, handler, level)
+            return handler
+        return decorator
+
+    def resolve(self, data: str) -> Optional[Route]:
+        route = self._exact.get(data)
+        if route:
+            return route
+
+        node = self._prefixes
+        for char in data:
+            node = node.children.get(char)
+            if node is None:
+                break
+            if node.route:
+                route = node.route
+        return route
+
+    def match(self, call) -> Optional[Route]:
+        """Resolve ``call.data`` and count the hit, without running anything"""
+        route = self.resolve(call.data or '')
+        if route:
+            with self._hits_lock:
+                self._hits[route.pattern] += 1
+        return route
+
+    def dispatch(self, call):
+        """Run the handler for ``call.data`` and return its result
+
+        A caller below the route's level gets the result of ``on_denied``
+        instead; None means no route matches.
+        """
+        route = self.match(call)
+        if not route:
+            return None
+
+        if route.level > PUBLIC and self._resolve_level(call.from_user.id) < route.level:
+            return self._on_denied(call, route.level)
+
+        return route.handler(call)
+
+    def hit_counts(self) -> Dict[str, int]:
+        """Dispatch count per route pattern, most used first"""
+        with self._hits_lock:
+            return dict(self._hits.most_common())
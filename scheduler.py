@@ -0,0 +1,212 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class _Timer:
+    __slots__ = ('due', 'seq', 'key', 'fn', 'args', 'cancelled', 'handle')
+
+    def __init__(self, due: float, seq: int, key: Hashable, fn: Callable, args: tuple):
+        self.due = due
+        self.seq = seq
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.cancelled = False
+        self.handle = None
+
+    def __lt__(self, other: '_Timer') -> bool:
+        return (self.due, self.seq) < (other.due, other.seq)
+
+
+def _count_timers(timers: Dict[Hashable, _Timer], kind: Optional[Hashable]) -> int:
+    if kind is None:
+        return len(timers)
+    return sum(1 for key in timers if isinstance(key, tuple) and key and key[0] == kind)
+
+
+class TimerScheduler:
+    """Runs delayed callbacks from one timer thread and a small worker pool
+
+    Pending timers are kept in a heap keyed by due time, so thousands of
+    outstanding timers cost a few objects each instead of a sleeping thread.
+    Every timer has a key; scheduling an existing key replaces it and
+    ``cancel(key)`` drops it before it fires.
+    """
+
+    def __init__(self, name: str = 'scheduler', workers: int = config.SCHEDULER_WORKERS):
+        self.name = name
+        self._heap = []
+        self._timers: Dict[Hashable, _Timer] = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=name)
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name=f'{name}-timer', daemon=True)
+        self._thread.start()
+
+    def schedule(self, key: Hashable, delay: float, fn: Callable, *args: Any, replace: bool = True) -> bool:
+        """Run ``fn(*args)`` after ``delay`` seconds
+
+        An existing timer with the same key is replaced, or kept as is when
+        ``replace`` is False. Returns whether a new timer was armed.
+        """
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError(f"Scheduler {self.name} is shut down")
+            previous = self._timers.get(key)
+            if previous:
+                if not replace:
+                    return False
+                previous.cancelled = True
+            timer = _Timer(time.monotonic() + max(0.0, delay), next(self._seq), key, fn, args)
+            self._timers[key] = timer
+            heapq.heappush(self._heap, timer)
+            # Only wake the timer thread if this is now the earliest deadline
+            if self._heap[0] is timer:
+                self._cond.notify()
+            return True
+
+    def cancel(self, key: Hashable) -> bool:
+        """Drop a pending timer; returns False if it already fired or never existed"""
+        with self._cond:
+            timer = self._timers.pop(key, None)
+            if not timer:
+                return False
+            timer.cancelled = True
+            return True
+
+    def is_scheduled(self, key: Hashable) -> bool:
+        with self._cond:
+            return key in self._timers
+
+    def queue_depth(self, kind: Optional[Hashable] = None) -> int:
+        """Number of timers waiting to fire; only keys of the form (kind, ...) if ``kind`` is given"""
+        with self._cond:
+            return _count_timers(self._timers, kind)
+
+    def shutdown(self, wait: bool = False):
+        with self._cond:
+            self._stopped = True
+            self._timers.clear()
+            self._heap.clear()
+            self._cond.notify()
+        self._executor.shutdown(wait=wait)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    # Lazily discard cancelled or replaced timers
+                    while self._heap and self._heap[0].cancelled:
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    timeout = self._heap[0].due - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                if self._stopped:
+                    return
+                timer = heapq.heappop(self._heap)
+                del self._timers[timer.key]
+
+            try:
+                self._executor.submit(self._fire, timer)
+            except RuntimeError:
+                # Executor shut down between the check above and here
+                return
+
+    def _fire(self, timer: _Timer):
+        try:
+            timer.fn(*timer.args)
+        except Exception as e:
+            logger.error(f"Scheduled task {timer.key!r} in {self.name} failed: {e}")
+
+
+class AsyncioTimerScheduler:
+    """TimerScheduler with the same interface, driven by an asyncio event loop
+
+    Timers are ``loop.call_later`` handles instead of a heap and a thread;
+    when one fires, ``fn`` runs on ``executor`` so blocking work (database,
+    provider polls) never stalls the loop. Safe to call from any thread.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, executor: Executor, name: str = 'scheduler'):
+        self.name = name
+        self._loop = loop
+        self._executor = executor
+        self._timers: Dict[Hashable, _Timer] = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def schedule(self, key: Hashable, delay: float, fn: Callable, *args: Any, replace: bool = True) -> bool:
+        with self._lock:
+            if self._stopped:
+                raise RuntimeError(f"Scheduler {self.name} is shut down")
+            previous = self._timers.get(key)
+            if previous:
+                if not replace:
+                    return False
+                self._cancel_timer(previous)
+            timer = _Timer(time.monotonic() + max(0.0, delay), next(self._seq), key, fn, args)
+            self._timers[key] = timer
+        self._loop.call_soon_threadsafe(self._arm, timer)
+        return True
+
+    def cancel(self, key: Hashable) -> bool:
+        with self._lock:
+            timer = self._timers.pop(key, None)
+            if not timer:
+                return False
+            self._cancel_timer(timer)
+            return True
+
+    def is_scheduled(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._timers
+
+    def queue_depth(self, kind: Optional[Hashable] = None) -> int:
+        with self._lock:
+            return _count_timers(self._timers, kind)
+
+    def shutdown(self, wait: bool = False):
+        with self._lock:
+            self._stopped = True
+            for timer in self._timers.values():
+                self._cancel_timer(timer)
+            self._timers.clear()
+
+    def _cancel_timer(self, timer: _Timer):
+        timer.cancelled = True
+        if timer.handle:
+            self._loop.call_soon_threadsafe(timer.handle.cancel)
+
+    def _arm(self, timer: _Timer):
+        # Runs on the loop thread
+        if not timer.cancelled:
+            timer.handle = self._loop.call_later(max(0.0, timer.due - time.monotonic()), self._fire, timer)
+
+    def _fire(self, timer: _Timer):
+        with self._lock:
+            if timer.cancelled or self._timers.get(timer.key) is not timer:
+                return
+            del self._timers[timer.key]
+        self._loop.run_in_executor(self._executor, self._run_timer, timer)
+
+    def _run_timer(self, timer: _Timer):
+        try:
+            timer.fn(*timer.args)
+        except Exception as e:
+            logger.error(f"Scheduled task {timer.key!r} in {self.name} failed: {e}")
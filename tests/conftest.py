@@ -0,0 +1,42 @@
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+# config reads the environment at import time (load_dotenv keeps what is set
+# here), so the module-level db must already point at a scratch file
+os.environ['DB_NAME'] = os.path.join(tempfile.mkdtemp(prefix='bot-tests-'), 'bot.db')
+os.environ['OWNER_ID'] = '1000'
+os.environ.setdefault('BOT_TOKEN', '123456:test')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from account_import import import_accounts
+from database import Database
+
+OWNER_ID = 1000
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(str(tmp_path / 'bot.db'))
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def make_call():
+    """Builds a button press the way handlers read it"""
+    def make_call(data, user_id=1, message_id=50):
+        return SimpleNamespace(id='q', data=data, from_user=SimpleNamespace(id=user_id),
+                               message=SimpleNamespace(chat=SimpleNamespace(id=user_id), message_id=message_id),
+                               inline_message_id=None)
+    return make_call
+
+
+@pytest.fixture
+def stocked(database):
+    """A database with ten Telegram numbers in stock"""
+    import_accounts(database, 'telegram', [f'+1555000{i:04d}' for i in range(10)], 10)
+    return database
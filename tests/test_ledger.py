@@ -0,0 +1,37 @@
+def balance_column(database, user_id):
+    with database.pool.connection() as conn:
+        return conn.execute('SELECT balance FROM users WHERE user_id = ?', (user_id,)).fetchone()[0]
+
+
+def test_checkpoint_folds_new_entries_in_batches(database):
+    database.create_user(1, 'a')
+    database.create_user(2, 'b')
+    for amount in (100, -30, 5):
+        database.update_balance(1, amount)
+    database.update_balance(2, 40)
+
+    checkpoint = database.checkpoint_ledger(batch_size=2)
+
+    assert checkpoint.entries == 4
+    assert checkpoint.repaired == []
+    with database.pool.connection() as conn:
+        balances = dict(conn.execute('SELECT user_id, balance FROM ledger_balances').fetchall())
+    assert balances == {1: 75, 2: 40}
+    # Nothing new since the last run
+    assert database.checkpoint_ledger().entries == 0
+
+
+def test_checkpoint_repairs_a_balance_that_disagrees_with_the_ledger(database):
+    database.create_user(1, 'a')
+    database.update_balance(1, 100)
+    database.checkpoint_ledger()
+    with database.pool.connection() as conn:
+        conn.execute('UPDATE users SET balance = 999 WHERE user_id = 1')
+        conn.commit()
+
+    database.update_balance(1, 10)
+    checkpoint = database.checkpoint_ledger()
+
+    assert checkpoint.repaired == [1]
+    assert balance_column(database, 1) == 110
+    assert database.get_user(1).balance == 110
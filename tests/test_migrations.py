@@ -0,0 +1,61 @@
+import sqlite3
+
+import pytest
+
+from database import Database
+from migrations import MIGRATIONS
+
+
+@pytest.fixture
+def baseline_path(tmp_path):
+    """A database written by the bot before versioned migrations existed"""
+    path = str(tmp_path / 'baseline.db')
+    conn = sqlite3.connect(path)
+    # Migration 1 is the baseline schema, minus the schema_version table
+    for step in MIGRATIONS[0][2]:
+        conn.execute(step)
+    conn.executemany('INSERT INTO users (user_id, username, balance) VALUES (?, ?, ?)',
+                     [(1, 'a', 150), (2, 'b', 0), (3, 'c', 25.5)])
+    conn.executemany('INSERT INTO accounts (type, phone_number, status, price) VALUES (?, ?, ?, 10)',
+                     [('telegram', '+15550001', 'available'),
+                      ('telegram', '+15550002', 'available'),
+                      ('telegram', '+15550003', 'in_use'),
+                      ('whatsapp', '+15550004', 'sold'),
+                      ('whatsapp', '+15550005', 'available')])
+    conn.executemany('INSERT INTO account_orders (user_id, account_type, phone_number, status, price) '
+                     'VALUES (?, ?, ?, ?, 10)',
+                     [(1, 'telegram', '+15550003', 'pending'),
+                      (2, 'whatsapp', '+15550004', 'completed')])
+    conn.executemany('INSERT INTO payments (user_id, amount, utr, status) VALUES (?, 100, ?, ?)',
+                     [(1, 'UTR 1234-5678', 'approved'), (2, 'utr12345678', 'pending'), (3, 'UTR-----', 'pending')])
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_baseline_database_is_migrated_to_the_latest_version(baseline_path):
+    database = Database(baseline_path)
+    try:
+        with database.pool.connection() as conn:
+            version = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0]
+            jobs = conn.execute('SELECT order_id, user_id, phone_number, status FROM otp_jobs').fetchall()
+            opening = conn.execute("SELECT user_id, amount FROM ledger WHERE kind = 'opening' "
+                                   "ORDER BY user_id").fetchall()
+            utr_keys = conn.execute('SELECT utr_normalized FROM payments ORDER BY id').fetchall()
+
+        assert version == MIGRATIONS[-1][0]
+        # Only the order still waiting for its OTP gets a delivery job
+        assert jobs == [(1, 1, '+15550003', 'queued')]
+        # A repeat of a live UTR and a UTR without digits are left unkeyed
+        assert utr_keys == [('12345678',), (None,), (None,)]
+        assert database.get_inventory_counts() == {
+            'telegram': {'available': 2, 'in_use': 1},
+            'whatsapp': {'available': 1, 'sold': 1},
+        }
+        assert not database.recount_inventory()
+        # Existing balances open the ledger, so the first checkpoint repairs nothing
+        assert opening == [(1, 150), (3, 25.5)]
+        assert database.checkpoint_ledger().repaired == []
+        assert database.get_user(1).balance == 150
+    finally:
+        database.close()
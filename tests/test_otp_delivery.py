@@ -0,0 +1,35 @@
+import pytest
+
+import config
+import handlers
+from idempotency import SeenKeys
+
+
+@pytest.fixture
+def delivery(stocked, monkeypatch):
+    """An order whose OTP has arrived but has not been shown yet"""
+    monkeypatch.setattr(handlers, 'db', stocked)
+    monkeypatch.setattr(handlers, 'recent_taps', SeenKeys(ttl=config.DEDUP_TAP_WINDOW))
+    stocked.create_user(1, 'buyer')
+    stocked.update_balance(1, 30)
+    order = stocked.purchase_otp(1, 'telegram', 10, chat_id=1, message_id=50)
+    [delivery] = stocked.update_otp_codes([(order.order_id, '12345')])
+    return delivery
+
+
+@pytest.mark.parametrize('view_first', [True, False])
+def test_pushed_otp_and_view_tap_complete_the_order_once(stocked, delivery, make_call, view_first):
+    def view():
+        return handlers.handle_callback(make_call(f'view_otp_{delivery.order_id}'))
+
+    if view_first:
+        assert '12345' in view().text
+        handlers.otp_shown(delivery)
+    else:
+        handlers.otp_shown(delivery)
+        view()
+
+    assert stocked.get_order(delivery.order_id)[5] == 'completed'
+    assert stocked.get_user(1).accounts_bought == 1
+    assert stocked.get_inventory_counts()['telegram'] == {'available': 9, 'in_use': 0, 'sold': 1}
+    assert not stocked.complete_otp_order(delivery.order_id)
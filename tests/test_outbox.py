@@ -0,0 +1,87 @@
+import threading
+import time
+
+from telebot.apihelper import ApiTelegramException
+
+from outbox import Outbox
+from ratelimit import TokenBucket
+
+
+class FakeBot:
+    """Records Bot API calls; ``failures`` are raised, in order, by the first calls"""
+
+    def __init__(self, failures=()):
+        self.calls = []
+        self.failures = list(failures)
+        self.gate = threading.Event()
+        self.gate.set()
+        self._changed = threading.Condition()
+
+    def _call(self, method, chat_id, text):
+        self.gate.wait()
+        with self._changed:
+            if self.failures:
+                raise self.failures.pop(0)
+            self.calls.append((method, chat_id, text, time.monotonic()))
+            self._changed.notify_all()
+
+    def send_message(self, chat_id, text, **kwargs):
+        self._call('send', chat_id, text)
+
+    def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        self._call('edit', chat_id, text)
+
+    def wait_for(self, count, timeout=5):
+        with self._changed:
+            assert self._changed.wait_for(lambda: len(self.calls) >= count, timeout)
+        return [call[:3] for call in self.calls]
+
+
+def too_many_requests(retry_after):
+    return ApiTelegramException('sendMessage', None, {
+        'error_code': 429, 'description': 'Too Many Requests', 'parameters': {'retry_after': retry_after}})
+
+
+def test_queued_edits_of_a_message_are_coalesced():
+    bot = FakeBot()
+    outbox = Outbox(bot, TokenBucket(1000), workers=1)
+    bot.gate.clear()
+    outbox.send_message(1, 'purchase')
+    for status in ('waiting', 'still waiting', 'code 12345'):
+        outbox.edit_message_text(status, 1, 7)
+    bot.gate.set()
+
+    assert bot.wait_for(2) == [('send', 1, 'purchase'), ('edit', 1, 'code 12345')]
+    time.sleep(0.1)
+    assert len(bot.calls) == 2
+
+
+def test_messages_to_a_chat_keep_their_order():
+    bot = FakeBot()
+    outbox = Outbox(bot, TokenBucket(1000), workers=4)
+    for i in range(30):
+        outbox.send_message(i % 3, f'message {i}')
+
+    calls = bot.wait_for(30)
+
+    for chat_id in range(3):
+        assert [text for _, chat, text in calls if chat == chat_id] == [f'message {i}' for i in range(chat_id, 30, 3)]
+
+
+def test_rate_limit_pauses_the_bucket_and_retries():
+    bot = FakeBot(failures=[too_many_requests(0.3)])
+    bucket = TokenBucket(1000)
+    delivered = []
+    outbox = Outbox(bot, bucket, workers=1, backoff_base=10)
+    started = time.monotonic()
+
+    outbox.send_message(1, 'approved', on_success=delivered.append)
+    time.sleep(0.1)
+    # Every sender sharing the bucket waits out Telegram's retry_after
+    assert bucket.try_acquire() > 0
+
+    assert bot.wait_for(1) == [('send', 1, 'approved')]
+    assert bot.calls[0][3] - started >= 0.3
+    time.sleep(0.1)
+    assert len(bot.calls) == 1
+    assert len(delivered) == 1
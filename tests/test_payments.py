@@ -0,0 +1,87 @@
+import pytest
+
+import handlers
+from database import Database, normalise_utr
+
+
+@pytest.mark.parametrize('raw, key', [
+    ('UTR1234567890', '1234567890'),
+    ('utr 1234-5678-90', '1234567890'),
+    ('AXIS 4321 0987', 'AXIS43210987'),
+    ('UTR-----', ''),
+    ('no digits here', ''),
+])
+def test_normalise_utr(raw, key):
+    assert normalise_utr(raw) == key
+
+
+def test_duplicate_utr_is_rejected_in_any_spelling(database):
+    database.create_user(1, 'payer')
+
+    first = database.create_payment_request(1, 500, 'UTR1234567890')
+
+    assert first is not None
+    assert database.create_payment_request(1, 500, 'utr 1234 5678 90') is None
+    assert database.create_payment_request(2, 100, '1234567890') is None
+    assert len(database.get_pending_payments(limit=10)) == 1
+
+
+def test_duplicate_utr_is_rejected_across_processes(database):
+    # A second Database on the same file has its own UTR cache, loaded before the first insert
+    other = Database(database.db_path)
+    try:
+        assert other.create_payment_request(1, 500, 'UTR5555555555') is not None
+        assert database.create_payment_request(1, 500, 'UTR1234567890') is not None
+        assert other.create_payment_request(1, 500, 'UTR 1234567890') is None
+    finally:
+        other.close()
+
+
+def test_declined_utr_can_be_submitted_again(database):
+    payment_id = database.create_payment_request(1, 500, 'UTR1234567890')
+
+    database.decline_payments([payment_id], admin_id=1000)
+
+    assert database.create_payment_request(1, 500, 'UTR1234567890') not in (None, payment_id)
+
+
+def test_utr_without_digits_is_refused(database):
+    with pytest.raises(ValueError):
+        database.create_payment_request(1, 500, 'UTR-----')
+
+
+@pytest.fixture
+def pending(database):
+    for user_id in (1, 2, 3):
+        database.create_user(user_id, f'user{user_id}')
+    for index, (user_id, amount) in enumerate([(1, 50), (1, 70), (2, 300), (3, 900), (2, 20)]):
+        database.create_payment_request(user_id, amount, f'UTR{user_id}{amount}{index:06d}')
+    return database
+
+
+def test_bulk_approve_credits_each_small_payment_once(pending):
+    approved = pending.approve_payments_up_to(300, admin_id=1000)
+
+    assert sorted(payment.amount for payment in approved) == [20, 50, 70, 300]
+    assert pending.get_user(1).balance == 120
+    assert pending.get_user(2).balance == 320
+    assert pending.get_user(3).balance == 0
+    assert [payment[2] for payment in pending.get_pending_payments(limit=10)] == [900]
+    assert pending.approve_payments_up_to(300, admin_id=1000) == []
+    assert pending.get_user(1).balance == 120
+
+
+def test_bulk_approve_takes_the_oldest_first(pending):
+    approved = pending.approve_payments_up_to(1000, admin_id=1000, limit=2)
+
+    assert [payment.amount for payment in approved] == [50, 70]
+
+
+def test_bulk_approve_button_notifies_each_user_once(pending, monkeypatch, make_call):
+    monkeypatch.setattr(handlers, 'db', pending)
+
+    reply = handlers.bulk_approve_payments(make_call('confirm_payments_upto_300', user_id=1000))
+
+    assert reply.text.startswith("✅ Approved 4 payments up to ₹300 (₹440)")
+    assert sorted(notice.chat_id for notice in reply.notices) == [1, 2]
+    assert "₹120" in next(notice.text for notice in reply.notices if notice.chat_id == 1)
@@ -0,0 +1,61 @@
+import threading
+
+from database import LedgerEntry, PurchaseResult
+
+
+def test_purchase_debits_reserves_and_queues_in_one_go(stocked):
+    stocked.create_user(1, 'buyer')
+    stocked.update_balance(1, 25)
+
+    result = stocked.purchase_otp(1, 'telegram', 10, chat_id=1, message_id=7)
+
+    assert result.status == PurchaseResult.OK
+    assert stocked.get_user(1).balance == 15
+    assert stocked.get_inventory_counts()['telegram'] == {'available': 9, 'in_use': 1}
+    order = stocked.get_order(result.order_id)
+    assert order[3] == result.phone_number and order[5] == 'pending'
+    assert [job.order_id for job in stocked.claim_due_otp_jobs('test', 10, 60)] == [result.order_id]
+    assert stocked.get_ledger(1)[0].kind == LedgerEntry.PURCHASE
+
+
+def test_failed_purchase_changes_nothing(stocked):
+    stocked.create_user(1, 'buyer')
+    stocked.update_balance(1, 5)
+
+    result = stocked.purchase_otp(1, 'telegram', 10)
+
+    assert result.status == PurchaseResult.INSUFFICIENT_BALANCE
+    assert stocked.get_user(1).balance == 5
+    assert stocked.get_inventory_counts()['telegram'] == {'available': 10}
+    assert stocked.get_user_active_orders(1) == []
+
+
+def test_concurrent_purchases_never_overspend(stocked):
+    stocked.create_user(1, 'buyer')
+    stocked.update_balance(1, 50)
+    results = []
+    start = threading.Barrier(20)
+
+    def buy():
+        start.wait()
+        results.append(stocked.purchase_otp(1, 'telegram', 10).status)
+
+    threads = [threading.Thread(target=buy) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(PurchaseResult.OK) == 5
+    assert results.count(PurchaseResult.INSUFFICIENT_BALANCE) == 15
+    assert stocked.get_user(1).balance == 0
+    assert stocked.get_inventory_counts()['telegram'] == {'available': 5, 'in_use': 5}
+    assert len(stocked.get_user_active_orders(1)) == 5
+
+
+def test_out_of_stock(database):
+    database.create_user(1, 'buyer')
+    database.update_balance(1, 50)
+
+    assert database.purchase_otp(1, 'telegram', 10).status == PurchaseResult.OUT_OF_STOCK
+    assert database.get_user(1).balance == 50
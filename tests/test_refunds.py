@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+
+import pytest
+
+import config
+import handlers
+from database import LedgerEntry
+from idempotency import SeenKeys
+
+
+@pytest.fixture
+def order(stocked):
+    stocked.create_user(1, 'buyer')
+    stocked.update_balance(1, 30)
+    return stocked.purchase_otp(1, 'telegram', 10)
+
+
+@pytest.fixture
+def bot_handlers(stocked, monkeypatch):
+    cancelled = []
+    monkeypatch.setattr(handlers, 'db', stocked)
+    monkeypatch.setattr(handlers, 'recent_taps', SeenKeys(ttl=config.DEDUP_TAP_WINDOW))
+    monkeypatch.setattr(handlers, 'otp_delivery',
+                        SimpleNamespace(cancel=lambda order_id, phone: cancelled.append(order_id)))
+    return cancelled
+
+
+def refunds(database):
+    return [entry for entry in database.get_ledger(1) if entry.kind == LedgerEntry.REFUND]
+
+
+def test_cancel_refunds_once(stocked, order):
+    assert stocked.cancel_otp_order(order.order_id) == (1, 10)
+    assert stocked.cancel_otp_order(order.order_id) is None
+
+    assert stocked.get_user(1).balance == 30
+    assert len(refunds(stocked)) == 1
+    assert stocked.get_inventory_counts()['telegram']['available'] == 10
+
+
+def test_repeated_cancel_taps_refund_once(stocked, order, bot_handlers, make_call):
+    first = handlers.handle_callback(make_call(f'cancel_otp_{order.order_id}'))
+    repeat = handlers.handle_callback(make_call(f'cancel_otp_{order.order_id}'))
+    # A tap the de-duplication does not catch reaches the database and finds nothing to refund
+    late = handlers.handle_callback(make_call(f'cancel_otp_{order.order_id}', message_id=51))
+
+    assert 'Purchase Cancelled' in first.text
+    assert first.notices[0].chat_id == 1
+    assert repeat.alert == "⏳ Already processing..."
+    assert late.alert == "❌ Failed to cancel order!"
+    assert stocked.get_user(1).balance == 30
+    assert len(refunds(stocked)) == 1
+
+
+def test_given_up_delivery_refunds_once(stocked, order):
+    stocked.claim_due_otp_jobs('test', 10, 60)
+
+    given_up = stocked.reschedule_otp_jobs([(order.order_id, 0)], max_attempts=1)
+
+    assert [cancelled.order_id for cancelled in given_up] == [order.order_id]
+    assert stocked.get_order(order.order_id)[5] == 'cancelled'
+    assert stocked.cancel_otp_order(order.order_id) is None
+    assert stocked.refund_failed_otp_jobs() == []
+    assert stocked.get_user(1).balance == 30
+    assert len(refunds(stocked)) == 1
+    assert stocked.get_inventory_counts()['telegram']['available'] == 10
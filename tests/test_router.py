@@ -0,0 +1,69 @@
+import pytest
+
+import config
+import handlers
+from idempotency import SeenKeys
+from router import ADMIN, OWNER, PUBLIC, CallbackRouter
+
+
+@pytest.fixture
+def router():
+    levels = {1: PUBLIC, 2: ADMIN, 3: OWNER}
+    return CallbackRouter(levels.get, lambda call, level: ('denied', call.data, level))
+
+
+def test_exact_key_beats_prefix_and_longest_prefix_wins(router):
+    router.add_exact('buy_otp', 'menu')
+    router.add_prefix('buy_', 'purchase')
+    router.add_prefix('approve_payment_', 'one')
+    router.add_prefix('approve_payments_upto_', 'bulk')
+
+    assert router.resolve('buy_otp').handler == 'menu'
+    assert router.resolve('buy_telegram_otp').handler == 'purchase'
+    assert router.resolve('approve_payment_7').handler == 'one'
+    assert router.resolve('approve_payments_upto_500').handler == 'bulk'
+    assert router.resolve('approve_pay') is None
+
+
+def test_dispatch_checks_the_level_and_counts_hits(router, make_call):
+    router.add_prefix('block_user_', lambda call: ('blocked', call.from_user.id), ADMIN)
+
+    assert router.dispatch(make_call('block_user_9', user_id=1)) == ('denied', 'block_user_9', ADMIN)
+    assert router.dispatch(make_call('block_user_9', user_id=2)) == ('blocked', 2)
+    assert router.dispatch(make_call('unknown')) is None
+    assert router.hit_counts() == {'block_user_*': 2}
+
+
+@pytest.mark.parametrize('data, handler', [
+    ('buy_otp', handlers.show_otp_menu),
+    ('buy_telegram_otp', handlers.handle_purchase),
+    ('view_otp_12', handlers.view_otp),
+    ('users_prev_40', handlers.page_users),
+    ('approve_payment_3', handlers.approve_payment),
+    ('approve_payments_upto_500', handlers.confirm_bulk_approve),
+    ('confirm_payments_upto_500', handlers.bulk_approve_payments),
+])
+def test_route_table(data, handler):
+    assert handlers.callback_router.resolve(data).handler is handler
+
+
+def test_handle_callback_denies_before_running_the_handler(monkeypatch, make_call):
+    monkeypatch.setattr(handlers, 'user_level', lambda user_id: PUBLIC)
+
+    reply = handlers.handle_callback(make_call('owner_panel', user_id=5))
+
+    assert reply.alert == "❌ Owner access required!"
+    assert reply.text is None
+
+
+def test_only_mutating_taps_are_debounced(database, monkeypatch, make_call):
+    monkeypatch.setattr(handlers, 'db', database)
+    monkeypatch.setattr(handlers, 'recent_taps', SeenKeys(ttl=config.DEDUP_TAP_WINDOW))
+    database.create_user(5, 'target')
+
+    menus = [handlers.handle_callback(make_call('main_menu')) for _ in range(2)]
+    blocks = [handlers.handle_callback(make_call('block_user_5', user_id=1000)) for _ in range(2)]
+
+    assert all('Main Menu' in reply.text for reply in menus)
+    assert blocks[0].alert == "✅ User blocked!"
+    assert blocks[1].alert == "⏳ Already processing..."
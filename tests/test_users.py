@@ -0,0 +1,51 @@
+import pytest
+
+import config
+
+
+@pytest.fixture
+def users(database):
+    for user_id, username in enumerate(['bobz', 'BOBZED', 'BobZ_2', 'boby', 'bob{', 'bob_x', 'alice'], 1):
+        database.create_user(user_id, username)
+    return database
+
+
+@pytest.mark.parametrize('prefix', ['bobz', 'BOBZ', 'BobZ', '@bObz'])
+def test_search_matches_any_case_and_stops_at_the_upper_bound(users, prefix):
+    # 'bob{' is the exclusive upper bound for the prefix 'bobz' and must not match
+    assert sorted(user[1] for user in users.search_users(prefix)) == ['BOBZED', 'BobZ_2', 'bobz']
+
+
+def test_search_treats_underscore_literally(users):
+    assert [user[1] for user in users.search_users('Bob_')] == ['bob_x']
+    assert users.search_users('@') == []
+
+
+def test_admin_list_includes_configured_admins(database, monkeypatch):
+    monkeypatch.setattr(config, 'ADMIN_IDS', [42, 7])
+    database.create_user(config.OWNER_ID, 'owner')
+    database.create_user(7, 'seven')
+    database.create_user(9, 'nine')
+    database.add_admin(9)
+
+    # 42 has never started the bot but still gets payment requests
+    assert database.get_all_admins() == [
+        (config.OWNER_ID, 'owner', 1), (7, 'seven', 1), (9, 'nine', 1), (42, None, 1)]
+
+
+def test_a_read_that_raced_a_write_is_not_cached(database, monkeypatch):
+    database.create_user(1, 'buyer')
+    fill = database.users.put
+
+    def put_after_a_write(record, version):
+        # The balance changes after the reader's SELECT but before it fills the cache
+        monkeypatch.setattr(database.users, 'put', fill)
+        database.update_balance(1, 50)
+        fill(record, version)
+
+    monkeypatch.setattr(database.users, 'put', put_after_a_write)
+
+    assert database.get_user(1).balance == 0
+    assert database.users.get(1) is None
+    assert database.get_user(1).balance == 50
+    assert database.users.get(1).balance == 50
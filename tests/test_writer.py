@@ -0,0 +1,68 @@
+import sqlite3
+import threading
+
+import pytest
+
+from database import GroupCommitWriter
+
+
+@pytest.fixture
+def connect(tmp_path):
+    path = str(tmp_path / 'writer.db')
+    with sqlite3.connect(path) as conn:
+        conn.execute('CREATE TABLE notes (id INTEGER PRIMARY KEY, text TEXT NOT NULL)')
+    return lambda: sqlite3.connect(path, check_same_thread=False)
+
+
+def notes(connect):
+    with connect() as conn:
+        return [row[0] for row in conn.execute('SELECT text FROM notes ORDER BY id')]
+
+
+def insert(text):
+    def write(cursor):
+        cursor.execute('INSERT INTO notes (text) VALUES (?)', (text,))
+        return cursor.lastrowid
+    return write
+
+
+def test_a_failing_write_rolls_back_alone(connect):
+    # A long window and a batch of exactly three keeps the writes in one group
+    writer = GroupCommitWriter(connect, window=5, max_batch=3)
+
+    def half_done(cursor):
+        cursor.execute("INSERT INTO notes (text) VALUES ('partial')")
+        raise ValueError('card declined')
+
+    try:
+        first = writer.submit(insert('first'))
+        failed = writer.submit(half_done)
+        last = writer.submit(insert('last'))
+
+        assert first.result(timeout=5) == 1
+        with pytest.raises(ValueError, match='card declined'):
+            failed.result(timeout=5)
+        assert last.result(timeout=5) == 2
+        assert notes(connect) == ['first', 'last']
+    finally:
+        writer.close()
+
+
+def test_run_times_out_but_the_write_still_commits(connect):
+    writer = GroupCommitWriter(connect, window=0, timeout=0.1)
+    release = threading.Event()
+
+    def slow(cursor):
+        release.wait(5)
+        cursor.execute("INSERT INTO notes (text) VALUES ('slow')")
+
+    try:
+        busy = writer.submit(slow)
+        with pytest.raises(sqlite3.OperationalError, match='Timed out after 0.1s'):
+            writer.run(insert('queued'))
+        release.set()
+        busy.result(timeout=5)
+    finally:
+        writer.close()
+
+    assert notes(connect) == ['slow', 'queued']
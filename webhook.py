@@ -0,0 +1,62 @@
+import hmac
+import logging
+import queue
+import threading
+from typing import Optional
+
+from telebot.types import Update
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+def is_authorised(secret_header: Optional[str], secret: str = config.WEBHOOK_SECRET) -> bool:
+    """Check X-Telegram-Bot-Api-Secret-Token against the secret passed to set_webhook
+
+    Without a secret nothing is authorised: anyone who can reach the
+    endpoint could otherwise post updates as any user, the owner included.
+    """
+    if not secret:
+        return False
+    return hmac.compare_digest(secret_header or '', secret)
+
+
+class UpdateQueue:
+    """Bounded hand-off between the webhook endpoint and the bot's handlers
+
+    The HTTP handler only puts the raw request body here and returns, so
+    Telegram gets its 200 straight away. Worker threads parse the updates
+    and feed them to ``bot.process_new_updates``. When the queue is full,
+    ``put`` returns False so the endpoint can refuse the update, and
+    Telegram delivers it again later instead of it being lost.
+    """
+
+    def __init__(self, bot, workers: int = config.WEBHOOK_WORKERS, maxsize: int = config.WEBHOOK_QUEUE_SIZE):
+        self.bot = bot
+        self._queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self._workers = [threading.Thread(target=self._run, name=f'webhook-{i}', daemon=True)
+                         for i in range(max(1, workers))]
+        for worker in self._workers:
+            worker.start()
+
+    def put(self, raw_update: str) -> bool:
+        try:
+            self._queue.put_nowait(raw_update)
+            return True
+        except queue.Full:
+            logger.warning("Webhook update queue is full; asking Telegram to retry")
+            return False
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            raw_update = self._queue.get()
+            try:
+                update = Update.de_json(raw_update)
+                if update:
+                    self.bot.process_new_updates([update])
+            except Exception as e:
+                logger.error(f"Failed to process webhook update: {e}")